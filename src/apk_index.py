@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import re
+import tarfile
+from io import TextIOWrapper
+from typing import TYPE_CHECKING
+
+from package_index import PackageIndex, PackageIndexError, write_package_index
+from version import select_newest
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator, Sequence
+    from pathlib import Path
+
+    from package_manager import PackageManager
+    from version import Version
+
+# E.g. 'alpine:3.20', 'alpine:3.20.3' and 'docker.io/library/alpine:3.20'
+_ALPINE_IMAGE_REGEX = re.compile(r'(?:(?:docker\.io/)?library/)?alpine:(?:([0-9]+\.[0-9]+)(?:\.[0-9]+)?|(edge))')
+_REPOSITORY_NAMES = ('main', 'community')
+
+
+class ApkIndex:
+    """Answers apk version queries from APKINDEX archives, without any container
+
+    The archives are read from a directory with the same layout as an Alpine mirror, e.g.
+    '<dir_path>/v3.20/main/x86_64/APKINDEX.tar.gz'.
+    """
+
+    def __init__(self, dir_path: Path, arch: str) -> None:
+        self.dir_path = dir_path
+        self.arch = arch
+        # Newest version string per package name, per archive
+        self._indexes: dict[Path, dict[str, str] | PackageIndex] = {}
+
+    def find_index_paths(self, image: str) -> list[Path] | None:
+        """Get the archives of the repositories an image uses, or None if they are unknown or missing"""
+        match = _ALPINE_IMAGE_REGEX.fullmatch(image)
+        if not match:
+            return None
+
+        release = f'v{match[1]}' if match[1] else match[2]
+        paths = [self.dir_path / release / name / self.arch / 'APKINDEX.tar.gz' for name in _REPOSITORY_NAMES]
+        if not all(path.is_file() for path in paths):
+            return None
+        return paths
+
+    def query_versions(
+        self, image: str, package_names: Sequence[str], package_manager: PackageManager
+    ) -> dict[str, Version] | None:
+        index_paths = self.find_index_paths(image)
+        if index_paths is None:
+            return None
+
+        versions: list[Version | None] = []
+        for index_path in index_paths:
+            index = self._load(index_path, package_manager)
+            for package_name in package_names:
+                version_str = index.get(package_name)
+                if version_str is not None:
+                    versions.append(package_manager.parse_version_string(package_name, version_str))
+
+        return select_newest(version for version in versions if version is not None)
+
+    def _load(self, index_path: Path, package_manager: PackageManager) -> dict[str, str] | PackageIndex:
+        try:
+            return self._indexes[index_path]
+        except KeyError:
+            pass
+
+        # Prefer the compiled index, unless the archive has been downloaded again since it was compiled
+        index: dict[str, str] | PackageIndex | None = open_compiled_index(index_path)
+        if index is None:
+            index = read_newest_versions(index_path, package_manager)
+
+        self._indexes[index_path] = index
+        return index
+
+
+def compile_apk_index(index_path: Path, package_manager: PackageManager) -> Path:
+    """Compile an APKINDEX.tar.gz archive to a package index next to it"""
+    compiled_path = compiled_index_path(index_path)
+    write_package_index(compiled_path, read_newest_versions(index_path, package_manager))
+    return compiled_path
+
+
+def compiled_index_path(index_path: Path) -> Path:
+    return index_path.with_name('APKINDEX.unold')
+
+
+def is_compiled_index_up_to_date(index_path: Path) -> bool:
+    compiled_index = open_compiled_index(index_path)
+    if compiled_index is None:
+        return False
+    compiled_index.close()
+    return True
+
+
+def open_compiled_index(index_path: Path) -> PackageIndex | None:
+    """Open the compiled index of an archive, or get None if it's missing, older than the archive or unreadable"""
+    compiled_path = compiled_index_path(index_path)
+    try:
+        if compiled_path.stat().st_mtime < index_path.stat().st_mtime:
+            return None
+        return PackageIndex(compiled_path)
+    except (FileNotFoundError, PackageIndexError):
+        # E.g. compiled by another version of UnOld, or truncated
+        return None
+
+
+def read_newest_versions(index_path: Path, package_manager: PackageManager) -> dict[str, str]:
+    """Read the newest version string of each package in an APKINDEX.tar.gz archive"""
+    versions = (
+        package_manager.parse_version_string(package_name, version_str)
+        for package_name, version_str in read_apk_index(index_path)
+    )
+    newest = select_newest(version for version in versions if version is not None)
+    return {package_name: version.source for package_name, version in newest.items()}
+
+
+def read_apk_index(path: Path) -> Iterator[tuple[str, str]]:
+    """Stream the package names and version strings of an APKINDEX.tar.gz archive"""
+    # The archive is a signature archive concatenated with the index archive
+    with tarfile.open(path, 'r:gz', ignore_zeros=True) as tar:
+        for member in tar:
+            if member.name != 'APKINDEX':
+                continue
+            file = tar.extractfile(member)
+            if file is None:
+                continue
+            yield from parse_apk_index(TextIOWrapper(file, encoding='utf-8'))
+
+
+def parse_apk_index(lines: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """Parse the P: (package name) and V: (version) fields of the blank line separated records of an APKINDEX"""
+    package_name, version_str = None, None
+    for line in lines:
+        if line.startswith('P:'):
+            package_name = line[2:].rstrip('\n')
+        elif line.startswith('V:'):
+            version_str = line[2:].rstrip('\n')
+        elif not line.strip():
+            if package_name is not None and version_str is not None:
+                yield package_name, version_str
+            package_name, version_str = None, None
+
+    if package_name is not None and version_str is not None:
+        yield package_name, version_str
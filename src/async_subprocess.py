@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+import asyncio
+import subprocess
+
+
+async def exec_async(*args: str) -> str:
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    stdout_bytes, stderr_bytes = await process.communicate()
+    stdout = stdout_bytes.decode()
+    stderr = stderr_bytes.decode()
+    return_code = process.returncode
+
+    if isinstance(return_code, int) and return_code != 0:
+        raise subprocess.CalledProcessError(return_code, list(args), stdout, stderr)
+
+    return stdout
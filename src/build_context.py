@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import os
+import posixpath
+import re
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import tarfile
+    from collections.abc import Sequence
+
+_GLOB_CHARACTERS = frozenset('*?[')
+# Podman prefers .containerignore, docker only knows .dockerignore
+_IGNORE_FILE_NAMES = ('.containerignore', '.dockerignore')
+# Parts of an ignore pattern: any number of directories, wildcards, character classes, escaped and other characters
+_IGNORE_PATTERN_TOKEN_REGEX = re.compile(r'\*\*/|\*\*|\*|\?|\[!?[^]]+\]|\\.|.', re.DOTALL)
+
+
+@dataclass(frozen=True)
+class _IgnorePattern:
+    regex: re.Pattern[str]
+    exception: bool  # Includes excluded paths again, e.g. '!keep.txt'
+
+
+@dataclass(frozen=True)
+class BuildContext:
+    """The files of a directory that COPY and ADD instructions use"""
+
+    source_dir: Path
+    sources: tuple[str, ...] = ()
+
+    def create(self, dir_path: Path) -> Path:
+        """Link the used files into an otherwise empty directory, and get the directory to build in
+
+        The whole source directory is used instead if a source is the whole directory, if sources have variables, which
+        can't be resolved, or if the files can't be hard linked, such as across file systems. Files are never copied.
+        """
+        source_paths = self._find_source_paths()
+        if source_paths is None:
+            return self.source_dir
+
+        dir_path.mkdir(exist_ok=True)
+        try:
+            self._link_sources(source_paths, dir_path)
+        except OSError:
+            shutil.rmtree(dir_path)
+            return self.source_dir
+        return dir_path
+
+    def add_to_archive(self, tar: tarfile.TarFile) -> None:
+        """Add the used files to a tar archive, or all files of the source directory if it's used as a whole
+
+        Files that .containerignore or .dockerignore excludes are left out, as the command line of the container manager
+        would.
+        """
+        source_paths = self._find_source_paths()
+        ignore_patterns = _read_ignore_patterns(self.source_dir)
+        # Excluded directories are only walked into if exceptions may include files in them again
+        walk_excluded = any(pattern.exception for pattern in ignore_patterns)
+        added: set[str] = set()
+
+        def add(path: Path) -> None:
+            relative_path = path.relative_to(self.source_dir).as_posix()
+            excluded = relative_path != '.' and _is_ignored(relative_path, ignore_patterns)
+            if not excluded and relative_path != '.' and relative_path not in added:
+                tar.add(path, arcname=relative_path, recursive=False)
+                added.add(relative_path)
+            if path.is_dir() and not path.is_symlink() and (walk_excluded or not excluded):
+                for child_path in sorted(path.iterdir()):
+                    add(child_path)
+
+        for source_path in [self.source_dir] if source_paths is None else source_paths:
+            add(source_path)
+
+    def _find_source_paths(self) -> list[Path] | None:
+        """Get the files and directories that the sources match, or None if the whole source directory is used"""
+        sources_normalized = [posixpath.normpath(source.lstrip('/')) for source in self.sources]
+        if any(source == '.' or '$' in source for source in sources_normalized):
+            return None
+
+        source_paths = []
+        for source_normalized in sources_normalized:
+            # Paths outside of the build context fail to build anyway
+            if source_normalized.startswith('..'):
+                continue
+
+            if _GLOB_CHARACTERS.isdisjoint(source_normalized):
+                source_path = self.source_dir / source_normalized
+                if source_path.exists() or source_path.is_symlink():
+                    source_paths.append(source_path)
+            else:
+                source_paths.extend(sorted(self.source_dir.glob(source_normalized)))
+        return source_paths
+
+    def _link_sources(self, source_paths: Sequence[Path], dir_path: Path) -> None:
+        # Let the container manager exclude files from directories just like it would otherwise
+        for ignore_name in _IGNORE_FILE_NAMES:
+            if (self.source_dir / ignore_name).is_file():
+                _link(self.source_dir / ignore_name, dir_path / ignore_name)
+
+        for source_path in source_paths:
+            target_path = dir_path / source_path.relative_to(self.source_dir)
+            if source_path.is_dir() and not source_path.is_symlink():
+                _link_tree(source_path, target_path)
+            else:
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                _link(source_path, target_path)
+
+
+def _link_tree(source_dir: Path, target_dir: Path) -> None:
+    for dir_str, dir_names, file_names in os.walk(source_dir):
+        dir_ = Path(dir_str)
+        target_subdir = target_dir / dir_.relative_to(source_dir)
+        target_subdir.mkdir(parents=True, exist_ok=True)
+        # Symbolic links to directories are listed as directories, but not walked into
+        dir_links = [name for name in dir_names if (dir_ / name).is_symlink()]
+        for name in [*file_names, *dir_links]:
+            _link(dir_ / name, target_subdir / name)
+
+
+def _link(source_path: Path, target_path: Path) -> None:
+    """Hard link a file, or a symbolic link itself"""
+    if target_path.exists() or target_path.is_symlink():
+        return
+    os.link(source_path, target_path, follow_symlinks=False)
+
+
+def _read_ignore_patterns(dir_path: Path) -> list[_IgnorePattern]:
+    for ignore_name in _IGNORE_FILE_NAMES:
+        try:
+            lines = (dir_path / ignore_name).read_text(encoding='utf-8').splitlines()
+        except FileNotFoundError:
+            continue
+
+        patterns = []
+        for line in lines:
+            pattern = line.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            exception = pattern.startswith('!')
+            pattern = posixpath.normpath(pattern.removeprefix('!').strip()).lstrip('/')
+            regex = ''.join(
+                _translate_ignore_token(match[0]) for match in _IGNORE_PATTERN_TOKEN_REGEX.finditer(pattern)
+            )
+            patterns.append(_IgnorePattern(re.compile(regex), exception))
+        return patterns
+    return []
+
+
+def _translate_ignore_token(token: str) -> str:
+    if token == '**/':
+        return '(?:.*/)?'
+    if token == '**':
+        return '.*'
+    if token == '*':
+        return '[^/]*'
+    if token == '?':
+        return '[^/]'
+    if token.startswith('[') and len(token) > 1:
+        negated = token.startswith('[!') and len(token) > 3
+        characters = token[2 if negated else 1 : -1].replace('\\', '\\\\')
+        return f'[{"^" if negated else ""}{characters}]'
+    return re.escape(token.removeprefix('\\'))
+
+
+def _is_ignored(relative_path: str, ignore_patterns: Sequence[_IgnorePattern]) -> bool:
+    """Check whether the last of the patterns that match a path or one of its parent directories excludes it"""
+    paths = [relative_path]
+    while '/' in paths[-1]:
+        paths.append(posixpath.dirname(paths[-1]))
+
+    ignored = False
+    for pattern in ignore_patterns:
+        # Exceptions only matter for excluded paths
+        if pattern.exception and not ignored:
+            continue
+        if any(pattern.regex.fullmatch(path) for path in paths):
+            ignored = not pattern.exception
+    return ignored
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+    from pathlib import Path
+
+    from build_context import BuildContext
+
+# Label of all images and containers that are created by unold
+OWNER_LABEL = 'unold'
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    id: str
+    names: tuple[str, ...]  # Empty if the image is untagged
+    size: int  # Bytes, including layers that are shared with other images
+    labels: dict[str, str] = field(default_factory=dict)
+
+
+def normalize_image_names(names: Iterable[str]) -> tuple[str, ...]:
+    """Turn image names such as 'localhost/unold_0123:latest' into the names they were tagged with"""
+    return tuple(name.removeprefix('localhost/').removesuffix(':latest') for name in names if name != '<none>:<none>')
+
+
+class ContainerManager(ABC):
+    """Builds images and runs commands in containers. Failing commands raise subprocess.CalledProcessError."""
+
+    @abstractmethod
+    async def build_image(
+        self,
+        containerfile_path: Path,
+        build_context: BuildContext,
+        image_name: str,
+        output_dir: Path | None = None,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        """Build and tag an image, or export the files of the final stage to output_dir instead
+
+        Only the files of the build context that its sources select are sent to the container manager.
+        """
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def run(self, image_name: str, command: str) -> str:
+        """Run a shell command in a new container that is removed afterwards, and get its output
+
+        Containers get the owner label, so that they can be found if they're left behind.
+        """
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def start(self, image_name: str, command: str) -> str:
+        """Start a shell command in a new background container that is removed when it stops. Returns its ID."""
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def exec(self, container_id: str, command: str) -> str:
+        """Execute a shell command in a running container, and get its output"""
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def resolve_image_id(self, image: str) -> str:
+        """Get the ID of an image, and pull it if it isn't available"""
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def remove_containers(self, container_ids: Sequence[str]) -> None:
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def list_containers(self, label: str) -> list[str]:
+        """Get the IDs of all containers with a label, also stopped ones"""
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def list_images(self, label: str) -> list[ImageInfo]:
+        """Get all images with a label, also untagged ones"""
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    async def remove_images(self, image_ids: Sequence[str]) -> None:
+        raise NotImplementedError('Subclass this class and override this function')
+
+    async def close(self) -> None:  # noqa: B027
+        """Release held resources, such as connections"""
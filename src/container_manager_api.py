@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import struct
+import subprocess
+import tarfile
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, override
+from urllib.parse import quote, urlencode
+
+from container_manager import OWNER_LABEL, ContainerManager, ImageInfo, normalize_image_names
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping, Sequence
+    from pathlib import Path
+
+    from build_context import BuildContext
+
+# Supported by docker since 20.10 and by the compatible API of podman
+API_VERSION = 'v1.41'
+# Stream type and size of a frame of a multiplexed stdout/stderr stream
+_FRAME_HEADER = struct.Struct('>BxxxI')
+
+
+class ContainerManagerApiError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Response:
+    status: int
+    body: bytes
+
+    def json(self) -> Any:  # noqa: ANN401
+        return json.loads(self.body)
+
+
+class ConnectionPool:
+    """Persistent HTTP/1.1 connections to a Unix socket, reused for one request at a time"""
+
+    def __init__(self, socket_path: Path) -> None:
+        self.socket_path = socket_path
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def request(
+        self, method: str, target: str, body: bytes = b'', content_type: str = 'application/json'
+    ) -> Response:
+        while True:
+            reused = bool(self._idle)
+            if reused:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_unix_connection(str(self.socket_path))
+
+            try:
+                status, response_body, keep_alive = await _exchange(reader, writer, method, target, body, content_type)
+            except _ConnectionClosedError:
+                writer.close()
+                # The server may close idle connections at any time
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                # The state of the connection is unknown
+                writer.close()
+                raise
+
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return Response(status, response_body)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+        await asyncio.gather(*[writer.wait_closed() for _, writer in idle], return_exceptions=True)
+
+
+class ContainerManagerApi(ContainerManager):
+    """Talks to the docker compatible REST API of a container manager over its Unix socket"""
+
+    def __init__(self, socket_path: Path) -> None:
+        self._pool = ConnectionPool(socket_path)
+
+    @override
+    async def build_image(
+        self,
+        containerfile_path: Path,
+        build_context: BuildContext,
+        image_name: str,
+        output_dir: Path | None = None,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        if output_dir is not None:
+            raise ContainerManagerApiError('Exporting build output requires the command line interface')
+
+        # The containerfile is sent along with the build context, under a name that's unlikely to be in it
+        containerfile_name = f'.{containerfile_path.name}.Containerfile'
+        # Reading the files doesn't block the other requests
+        context = await asyncio.to_thread(create_build_archive, containerfile_path, containerfile_name, build_context)
+
+        params = {'dockerfile': containerfile_name, 't': image_name, 'q': '1'}
+        if labels:
+            params['labels'] = json.dumps(dict(labels))
+        query = urlencode(params)
+        response = await self._request('POST', f'/build?{query}', context, 'application/x-tar')
+        _raise_for_stream_error(response)
+
+    @override
+    async def run(self, image_name: str, command: str) -> str:
+        container_id = await self._create_container(image_name, command, auto_remove=False)
+        try:
+            await self._request('POST', f'/containers/{container_id}/start')
+            exit_status = (await self._request('POST', f'/containers/{container_id}/wait')).json()['StatusCode']
+            logs = await self._request('GET', f'/containers/{container_id}/logs?stdout=1&stderr=1')
+        finally:
+            await self.remove_containers([container_id])
+
+        stdout, stderr = demultiplex(logs.body)
+        if exit_status != 0:
+            raise subprocess.CalledProcessError(exit_status, ['sh', '-c', command], stdout, stderr)
+        return stdout
+
+    @override
+    async def start(self, image_name: str, command: str) -> str:
+        container_id = await self._create_container(image_name, command, auto_remove=True)
+        await self._request('POST', f'/containers/{container_id}/start')
+        return container_id
+
+    @override
+    async def exec(self, container_id: str, command: str) -> str:
+        exec_config = {'AttachStdout': True, 'AttachStderr': True, 'Cmd': ['sh', '-c', command]}
+        response = await self._request('POST', f'/containers/{container_id}/exec', _dump_json(exec_config))
+        exec_id = response.json()['Id']
+        output = await self._request('POST', f'/exec/{exec_id}/start', _dump_json({'Detach': False, 'Tty': False}))
+        exit_status = (await self._request('GET', f'/exec/{exec_id}/json')).json()['ExitCode']
+
+        stdout, stderr = demultiplex(output.body)
+        if exit_status != 0:
+            raise subprocess.CalledProcessError(exit_status, ['sh', '-c', command], stdout, stderr)
+        return stdout
+
+    @override
+    async def resolve_image_id(self, image: str) -> str:
+        target = f'/images/{quote(image, safe="/:@")}/json'
+        response = await self._pool.request('GET', f'/{API_VERSION}{target}')
+        if response.status == 404:
+            # Pull the image just like a build would. Without a tag all tags would be pulled.
+            params = {'fromImage': image}
+            if '@' not in image and ':' not in image.rpartition('/')[2]:
+                params['tag'] = 'latest'
+            _raise_for_stream_error(await self._request('POST', f'/images/create?{urlencode(params)}'))
+            response = await self._pool.request('GET', f'/{API_VERSION}{target}')
+        _raise_for_status('GET', target, response)
+        return response.json()['Id']
+
+    @override
+    async def remove_containers(self, container_ids: Sequence[str]) -> None:
+        await asyncio.gather(*[self._remove_container(container_id) for container_id in container_ids])
+
+    @override
+    async def list_containers(self, label: str) -> list[str]:
+        query = urlencode({'all': '1', 'filters': json.dumps({'label': [label]})})
+        return [container['Id'] for container in (await self._request('GET', f'/containers/json?{query}')).json()]
+
+    @override
+    async def list_images(self, label: str) -> list[ImageInfo]:
+        query = urlencode({'filters': json.dumps({'label': [label]})})
+        return [
+            ImageInfo(
+                image['Id'],
+                normalize_image_names(image.get('RepoTags') or ()),
+                image['Size'],
+                image.get('Labels') or {},
+            )
+            for image in (await self._request('GET', f'/images/json?{query}')).json()
+        ]
+
+    @override
+    async def remove_images(self, image_ids: Sequence[str]) -> None:
+        await asyncio.gather(*[self._request('DELETE', f'/images/{image_id}?force=1') for image_id in image_ids])
+
+    @override
+    async def close(self) -> None:
+        await self._pool.close()
+
+    async def _create_container(self, image_name: str, command: str, *, auto_remove: bool) -> str:
+        config = {
+            'Image': image_name,
+            'Cmd': ['sh', '-c', command],
+            'Labels': {OWNER_LABEL: ''},
+            'HostConfig': {'AutoRemove': auto_remove},
+        }
+        return (await self._request('POST', '/containers/create', _dump_json(config))).json()['Id']
+
+    async def _remove_container(self, container_id: str) -> None:
+        response = await self._pool.request('DELETE', f'/{API_VERSION}/containers/{container_id}?force=1')
+        # Containers that are removed automatically may already be gone
+        if response.status != 404:
+            _raise_for_status('DELETE', f'/containers/{container_id}', response)
+
+    async def _request(
+        self, method: str, target: str, body: bytes = b'', content_type: str = 'application/json'
+    ) -> Response:
+        response = await self._pool.request(method, f'/{API_VERSION}{target}', body, content_type)
+        _raise_for_status(method, target, response)
+        return response
+
+
+def create_build_archive(containerfile_path: Path, containerfile_name: str, build_context: BuildContext) -> bytes:
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode='w') as tar:
+        build_context.add_to_archive(tar)
+        tar.add(containerfile_path, arcname=containerfile_name)
+    return context.getvalue()
+
+
+def demultiplex(data: bytes) -> tuple[str, str]:
+    """Split a multiplexed stream into stdout and stderr"""
+    streams = {1: bytearray(), 2: bytearray()}
+    offset = 0
+    while offset + _FRAME_HEADER.size <= len(data):
+        stream_type, size = _FRAME_HEADER.unpack_from(data, offset)
+        offset += _FRAME_HEADER.size
+        if stream_type in streams:
+            streams[stream_type] += data[offset : offset + size]
+        offset += size
+    return streams[1].decode(), streams[2].decode()
+
+
+def parse_json_stream(data: bytes) -> Iterator[Any]:
+    """Parse concatenated JSON values, such as the progress messages of builds and pulls"""
+    decoder = json.JSONDecoder()
+    text = data.decode()
+    index = 0
+    while True:
+        while index < len(text) and text[index].isspace():
+            index += 1
+        if index == len(text):
+            return
+        value, index = decoder.raw_decode(text, index)
+        yield value
+
+
+class _ConnectionClosedError(ConnectionError):
+    pass
+
+
+async def _exchange(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    target: str,
+    body: bytes,
+    content_type: str,
+) -> tuple[int, bytes, bool]:
+    """Send a request and read the response. Returns the status, the body and whether the connection can be reused."""
+    head = (
+        f'{method} {target} HTTP/1.1\r\n'
+        'Host: localhost\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        '\r\n'
+    )
+    writer.write(head.encode() + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise _ConnectionClosedError(f'Connection closed before the response to {method} {target}')
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while (line := await reader.readline()) not in {b'\r\n', b'\n', b''}:
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().casefold()] = value.strip()
+    keep_alive = headers.get('connection', '').casefold() != 'close'
+
+    if status in {204, 304}:
+        return status, b'', keep_alive
+    if headers.get('transfer-encoding', '').casefold() == 'chunked':
+        return status, await _read_chunked(reader), keep_alive
+    if 'content-length' in headers:
+        return status, await reader.readexactly(int(headers['content-length'])), keep_alive
+    # Otherwise the body ends with the connection, e.g. for the output stream of an exec
+    return status, await reader.read(), False
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+    body = bytearray()
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if size == 0:
+            # Skip the trailers
+            while (await reader.readline()) not in {b'\r\n', b'\n', b''}:
+                pass
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+def _dump_json(value: Any) -> bytes:  # noqa: ANN401
+    return json.dumps(value).encode()
+
+
+def _raise_for_status(method: str, target: str, response: Response) -> None:
+    if response.status < 400:
+        return
+    try:
+        message = response.json()['message']
+    except (ValueError, KeyError, TypeError):
+        message = response.body.decode(errors='replace').strip()
+    raise ContainerManagerApiError(f'{method} {target} failed with status {response.status}: {message}')
+
+
+def _raise_for_stream_error(response: Response) -> None:
+    # Builds and pulls report errors in the stream, after the status has been sent
+    for message in parse_json_stream(response.body):
+        if isinstance(message, dict) and 'error' in message:
+            raise ContainerManagerApiError(message['error'])
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import json
+import subprocess
+from typing import TYPE_CHECKING, override
+
+from async_subprocess import exec_async
+from container_manager import OWNER_LABEL, ContainerManager, ImageInfo, normalize_image_names
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping, Sequence
+    from pathlib import Path
+
+    from build_context import BuildContext
+
+
+class ContainerManagerCli(ContainerManager):
+    """Runs the command line interface of a container manager, such as podman or docker"""
+
+    def __init__(self, executable: str) -> None:
+        self.executable = executable
+
+    @override
+    async def build_image(
+        self,
+        containerfile_path: Path,
+        build_context: BuildContext,
+        image_name: str,
+        output_dir: Path | None = None,
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        output_args = ['-t', image_name] if output_dir is None else ['--output', f'type=local,dest={output_dir}']
+        label_args = [arg for name, value in (labels or {}).items() for arg in ('--label', f'{name}={value}')]
+        context_dir = build_context.create(containerfile_path.with_name(f'{containerfile_path.name}_context'))
+        await exec_async(
+            self.executable, 'build', '-f', str(containerfile_path), *output_args, *label_args, '-q', str(context_dir)
+        )
+
+    @override
+    async def run(self, image_name: str, command: str) -> str:
+        return await exec_async(self.executable, 'run', '--rm', '--label', OWNER_LABEL, image_name, 'sh', '-c', command)
+
+    @override
+    async def start(self, image_name: str, command: str) -> str:
+        container_id = await exec_async(
+            self.executable, 'run', '-d', '--rm', '--label', OWNER_LABEL, image_name, 'sh', '-c', command
+        )
+        return container_id.strip()
+
+    @override
+    async def exec(self, container_id: str, command: str) -> str:
+        return await exec_async(self.executable, 'exec', container_id, 'sh', '-c', command)
+
+    @override
+    async def resolve_image_id(self, image: str) -> str:
+        try:
+            return (await exec_async(self.executable, 'image', 'inspect', '--format', '{{.Id}}', image)).strip()
+        except subprocess.CalledProcessError:
+            # Pull the image just like a build would
+            await exec_async(self.executable, 'pull', '-q', image)
+            return (await exec_async(self.executable, 'image', 'inspect', '--format', '{{.Id}}', image)).strip()
+
+    @override
+    async def remove_containers(self, container_ids: Sequence[str]) -> None:
+        if container_ids:
+            await exec_async(self.executable, 'rm', '-f', *container_ids)
+
+    @override
+    async def list_containers(self, label: str) -> list[str]:
+        output = await exec_async(self.executable, 'ps', '-a', '-q', '--no-trunc', '--filter', f'label={label}')
+        return output.split()
+
+    @override
+    async def list_images(self, label: str) -> list[ImageInfo]:
+        output = await exec_async(self.executable, 'images', '-q', '--no-trunc', '--filter', f'label={label}')
+        # Images with several tags are listed several times
+        image_ids = list(dict.fromkeys(output.split()))
+        if not image_ids:
+            return []
+
+        # The listing formats of docker and podman differ, but those of image inspect agree
+        images = []
+        for inspect in json.loads(await exec_async(self.executable, 'image', 'inspect', *image_ids)):
+            names = normalize_image_names(inspect.get('RepoTags') or ())
+            labels = (inspect.get('Config') or {}).get('Labels') or {}
+            images.append(ImageInfo(inspect['Id'], names, inspect['Size'], labels))
+        return images
+
+    @override
+    async def remove_images(self, image_ids: Sequence[str]) -> None:
+        if image_ids:
+            await exec_async(self.executable, 'image', 'rm', '-f', *image_ids)
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+
+    import dockerfile  # type: ignore[import-not-found]
+
+# Matches $NAME, ${NAME}, ${NAME:-default} and ${NAME:+alternative}
+_VARIABLE_REGEX = re.compile(r'\$(?:([A-Za-z_][A-Za-z0-9_]*)|\{([A-Za-z_][A-Za-z0-9_]*)(?::([-+])([^}]*))?\})')
+
+
+@dataclass(frozen=True)
+class Stage:
+    index: int
+    name: str | None
+    base_image: str  # The FROM reference with global ARG defaults substituted
+    start_line: int  # Zero indexed line of the FROM instruction
+    layers: tuple[dockerfile.Command, ...]  # Including the FROM instruction
+
+
+def parse_stages(layers: Sequence[dockerfile.Command]) -> list[Stage]:
+    global_args: dict[str, str] = {}
+    stages: list[Stage] = []
+    stage_layers: list[dockerfile.Command] = []
+    for layer in layers:
+        cmd = layer.cmd.casefold()
+        if cmd == 'from':
+            if stage_layers:
+                stages.append(_create_stage(len(stages), stage_layers, global_args))
+            stage_layers = [layer]
+        elif stage_layers:
+            stage_layers.append(layer)
+        elif cmd == 'arg':
+            # Only ARG instructions before the first FROM are available in FROM instructions
+            global_args.update(parse_arg(layer))
+
+    if stage_layers:
+        stages.append(_create_stage(len(stages), stage_layers, global_args))
+
+    return stages
+
+
+def find_stage(stages: Sequence[Stage], line: int) -> Stage | None:
+    """Find the stage that contains a zero indexed line"""
+    found = None
+    for stage in stages:
+        if stage.start_line > line:
+            break
+        found = stage
+    return found
+
+
+def find_stage_chain(stages: Sequence[Stage], stage: Stage) -> list[Stage]:
+    """Follow a stage through the stages it's based on. The first stage in the chain is based on an image."""
+    chain = [stage]
+    while True:
+        stages_by_name = {s.name: s for s in stages[: chain[0].index] if s.name is not None}
+        base_stage = stages_by_name.get(chain[0].base_image.casefold())
+        if base_stage is None:
+            return chain
+        chain.insert(0, base_stage)
+
+
+def find_base_image(stages: Sequence[Stage], stage: Stage) -> str | None:
+    """Find the image a stage is ultimately based on, or None if it's unknown or empty"""
+    base_image = find_stage_chain(stages, stage)[0].base_image
+    if base_image.casefold() == 'scratch' or '$' in base_image:
+        return None
+    return base_image
+
+
+def find_external_images(stages: Sequence[Stage], stage_indexes: Iterable[int]) -> list[str]:
+    """Find the distinct images that stages are based on, without scratch, other stages and unresolved references"""
+    images: dict[str, None] = {}
+    for index in sorted(stage_indexes):
+        base_image = stages[index].base_image
+        if (
+            base_image.casefold() != 'scratch'
+            and '$' not in base_image
+            and _resolve_stage_reference(stages[:index], base_image) is None
+        ):
+            images[base_image] = None
+    return list(images)
+
+
+def find_stage_dependencies(stages: Sequence[Stage], stage: Stage, end_line: int | None = None) -> set[int]:
+    """Find the indexes of the stages needed to build a stage up to a zero indexed line, including the stage itself
+
+    Stages are needed as base stage, by COPY --from and by RUN --mount=...,from=...
+    """
+    needed: set[int] = set()
+    pending: list[tuple[Stage, int | None]] = [(stage, end_line)]
+    while pending:
+        stage_pending, end_line_pending = pending.pop()
+        if stage_pending.index in needed:
+            continue
+        needed.add(stage_pending.index)
+
+        references = [stage_pending.base_image]
+        for layer in stage_pending.layers[1:]:
+            if end_line_pending is None or layer.start_line - 1 < end_line_pending:
+                references.extend(_find_stage_references(layer))
+        for reference in references:
+            dependency = _resolve_stage_reference(stages[: stage_pending.index], reference)
+            if dependency is not None:
+                pending.append((dependency, None))
+
+    return needed
+
+
+def find_context_sources(stages: Sequence[Stage], stage: Stage, end_line: int) -> list[str]:
+    """Find the build context paths that COPY and ADD instructions use to build a stage up to a zero indexed line"""
+    needed = find_stage_dependencies(stages, stage, end_line)
+    sources: list[str] = []
+    for stage_needed in stages[: stage.index + 1]:
+        if stage_needed.index not in needed:
+            continue
+        for layer in stage_needed.layers[1:]:
+            if stage_needed is stage and layer.start_line - 1 >= end_line:
+                break
+            if layer.cmd.casefold() not in {'copy', 'add'} or any(
+                flag.casefold().startswith('--from=') for flag in layer.flags
+            ):
+                continue
+            # Skip URLs, git repositories and here-documents
+            sources.extend(
+                source for source in layer.value[:-1] if '://' not in source and not source.startswith(('git@', '<<'))
+            )
+    return sources
+
+
+def select_stage_lines(lines: Sequence[str], stages: Sequence[Stage], break_line: int) -> list[str]:
+    """Get the lines before a zero indexed line, without the stages that aren't needed to build up to it"""
+    line_ranges = select_stage_line_ranges(stages, break_line)
+    selected = list(lines[slice(*line_ranges[0])])
+    for start_line, end_line in line_ranges[1:]:
+        # An empty stage keeps the indexes of the following stages, which COPY --from=<index> may refer to
+        selected.extend(lines[start_line:end_line] if start_line < end_line else ['FROM scratch'])
+    return selected
+
+
+def select_stage_line_ranges(stages: Sequence[Stage], break_line: int) -> list[tuple[int, int]]:
+    """Get the ranges of zero indexed lines before a zero indexed line that are needed to build up to it
+
+    The ranges include their start and exclude their end. The first one has the global ARG instructions and parser
+    directives, which are followed by one per stage up to that line. Stages that aren't needed get an empty range.
+    """
+    stage = find_stage(stages, break_line)
+    if stage is None:
+        return [(0, break_line)]
+
+    needed = find_stage_dependencies(stages, stage, break_line)
+    selected = [(0, stages[0].start_line)]
+    for stage_selected in stages[: stage.index + 1]:
+        if stage_selected.index in needed:
+            end_line = break_line if stage_selected is stage else stages[stage_selected.index + 1].start_line
+            selected.append((stage_selected.start_line, end_line))
+        else:
+            selected.append((stage_selected.start_line, stage_selected.start_line))
+    return selected
+
+
+def parse_arg(layer: dockerfile.Command) -> dict[str, str]:
+    """Get the default values of an ARG instruction. Arguments without a default value get an empty string."""
+    args = {}
+    for value in layer.value:
+        name, _, default = value.partition('=')
+        args[name] = default.strip('"\'')
+    return args
+
+
+def substitute_args(str_: str, args: Mapping[str, str]) -> str:
+    """Substitute known variables, and leave unknown ones as they are"""
+
+    def substitute(match: re.Match[str]) -> str:
+        name = match[1] or match[2]
+        if name not in args:
+            return match[0]
+        value = args[name]
+        if match[3] == '-':
+            return value or match[4]
+        if match[3] == '+':
+            return match[4] if value else ''
+        return value
+
+    return _VARIABLE_REGEX.sub(substitute, str_)
+
+
+def _find_stage_references(layer: dockerfile.Command) -> list[str]:
+    references = []
+    for flag in layer.flags:
+        name, _, value = flag.partition('=')
+        if name.casefold() == '--from':
+            references.append(value)
+        elif name.casefold() == '--mount':
+            for option in value.split(','):
+                key, _, option_value = option.partition('=')
+                if key.casefold() == 'from':
+                    references.append(option_value)
+    return references
+
+
+def _resolve_stage_reference(stages: Sequence[Stage], reference: str) -> Stage | None:
+    """Find the stage a reference such as '1' or 'builder' refers to, or None if it refers to an image"""
+    if reference.isdigit():
+        index = int(reference)
+        return stages[index] if index < len(stages) else None
+    stages_by_name = {stage.name: stage for stage in stages if stage.name is not None}
+    return stages_by_name.get(reference.casefold())
+
+
+def _create_stage(index: int, layers: Sequence[dockerfile.Command], global_args: Mapping[str, str]) -> Stage:
+    layer_from = layers[0]
+    name = None
+    if len(layer_from.value) >= 3 and layer_from.value[1].casefold() == 'as':
+        name = layer_from.value[2].casefold()
+    base_image = substitute_args(layer_from.value[0], global_args)
+    return Stage(index, name, base_image, layer_from.start_line - 1, tuple(layers))
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from async_subprocess import exec_async
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+# The counts of the old lines and the start and the count of the new lines of a hunk, e.g. '@@ -10,2 +10,3 @@'
+_HUNK_HEADER_REGEX = re.compile(r'@@ -[0-9]+(?:,([0-9]+))? \+([0-9]+)(?:,([0-9]+))? @@')
+# Escapes of quoted paths, besides octal ones and escaped characters that stand for themselves
+_C_ESCAPES = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+
+def find_repository(path: Path) -> Path | None:
+    """Find the top directory of the git repository that a file is in"""
+    for dir_path in path.resolve().parents:
+        if (dir_path / '.git').exists():
+            return dir_path
+    return None
+
+
+@dataclass(frozen=True)
+class ChangedLines:
+    """The ranges of zero indexed lines that changed since a git revision, including uncommitted changes
+
+    Ranges include their start and exclude their end.
+    """
+
+    # Keyed by the path of their file relative to the repository
+    ranges: dict[str, list[tuple[int, int]]]
+    tracked_paths: frozenset[str]
+
+    def get(self, path: str) -> list[tuple[int, int]]:
+        """Get the changed lines of a file, which changed completely if git doesn't track it, even if it's ignored"""
+        if path not in self.tracked_paths:
+            return [(0, sys.maxsize)]
+        return self.ranges.get(path, [])
+
+
+async def find_changed_lines(repository: Path, revision: str) -> ChangedLines:
+    try:
+        tracked = await _git(repository, 'ls-files', '-z')
+        diff = await _git(
+            repository,
+            'diff',
+            '--no-color',
+            '--no-ext-diff',
+            '--no-renames',
+            '--unified=0',
+            '--end-of-options',
+            revision,
+            '--',
+        )
+    except subprocess.CalledProcessError as exc:
+        msg = f"Failed to find the changes in '{repository}' since '{revision}': {exc.stderr.strip()}"
+        raise RuntimeError(msg) from exc
+
+    return ChangedLines(parse_diff(diff), frozenset(path for path in tracked.split('\0') if path))
+
+
+def parse_diff(diff: str) -> dict[str, list[tuple[int, int]]]:
+    """Get the ranges of zero indexed lines of the new files that the hunks of a diff without context changed"""
+    changed_lines: dict[str, list[tuple[int, int]]] = {}
+    path = None
+    # Lines of the current hunk that are left, which may look like headers
+    hunk_line_count = 0
+    for line in diff.splitlines():
+        if hunk_line_count:
+            # Except for markers like '\ No newline at end of file'
+            if not line.startswith('\\'):
+                hunk_line_count -= 1
+        elif line.startswith('+++ '):
+            path = _parse_path(line.removeprefix('+++ '))
+        elif (match := _HUNK_HEADER_REGEX.match(line)) and path is not None:
+            count_old = 1 if match[1] is None else int(match[1])
+            start = int(match[2])
+            count = 1 if match[3] is None else int(match[3])
+            hunk_line_count = count_old + count
+            if count:
+                changed_lines.setdefault(path, []).append((start - 1, start - 1 + count))
+            else:
+                # Lines were removed after the start line, which may have continued its instruction or preceded the
+                # next one
+                changed_lines.setdefault(path, []).append((max(start - 1, 0), start + 1))
+    return changed_lines
+
+
+def _parse_path(path: str) -> str | None:
+    """Parse the path of a '+++ b/<path>' line, which is None for deleted files"""
+    # Paths with spaces end with a tab
+    path = path.removesuffix('\t')
+    if path == '/dev/null':
+        return None
+    if path.startswith('"'):
+        # Paths with special characters are quoted with C escapes
+        path = re.sub(
+            r'\\([0-7]{3}|.)',
+            lambda match: chr(int(match[1], 8)) if len(match[1]) == 3 else _C_ESCAPES.get(match[1], match[1]),
+            path[1:-1],
+        )
+    return path.removeprefix('b/')
+
+
+async def _git(repository: Path, *args: str) -> str:
+    return await exec_async('git', '-C', str(repository), '-c', 'core.quotePath=false', *args)
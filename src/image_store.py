@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+    from pathlib import Path
+
+    from container_manager import ImageInfo
+
+# Labels of query images, next to the owner label
+QUERY_LABEL = 'unold.query'  # Hash of what the image is built from
+BASE_IMAGE_DIGEST_LABEL = 'unold.base-image-digest'
+CREATED_LABEL = 'unold.created'  # Seconds since the epoch
+
+
+class ImageStore:
+    """Remembers when query images were last used, to evict the least recently used ones"""
+
+    def __init__(self, dir_path: Path) -> None:
+        dir_path.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(dir_path / 'images.sqlite3', timeout=60, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, last_used REAL NOT NULL)')
+
+    def touch(self, name: str) -> None:
+        self._connection.execute(
+            'INSERT OR REPLACE INTO images (name, last_used) VALUES (?, ?)',
+            (name, time.time()),
+        )
+
+    def get_last_used(self) -> dict[str, float]:
+        return dict(self._connection.execute('SELECT name, last_used FROM images').fetchall())
+
+    def forget(self, names: Iterable[str]) -> None:
+        self._connection.executemany('DELETE FROM images WHERE name = ?', [(name,) for name in names])
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def is_reusable(image: ImageInfo, labels: Mapping[str, str]) -> bool:
+    """Whether an existing image was built from the same query on the same base image"""
+    return all(image.labels.get(name) == labels.get(name) for name in (QUERY_LABEL, BASE_IMAGE_DIGEST_LABEL))
+
+
+def select_evictions(
+    images: Sequence[ImageInfo], last_used: Mapping[str, float], max_count: int | None, max_size: int | None
+) -> list[ImageInfo]:
+    """Select the least recently used images to remove, until the others are within the budgets
+
+    Images that were never used, such as untagged ones, are removed first.
+    """
+    images_by_use = sorted(images, key=lambda image: max((last_used.get(name, 0) for name in image.names), default=0))
+    count = len(images)
+    size = sum(image.size for image in images)
+
+    evictions = []
+    for image in images_by_use:
+        if (max_count is None or count <= max_count) and (max_size is None or size <= max_size):
+            break
+        evictions.append(image)
+        count -= 1
+        size -= image.size
+    return evictions
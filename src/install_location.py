@@ -5,7 +5,7 @@ from package import Package
 from package_manager import PackageManager
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class InstallLocation:
     packages: list[Package]
     containerfile_path: Path
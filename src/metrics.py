@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import bisect
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from contextlib import AbstractContextManager
+    from pathlib import Path
+
+# Names without the 'unold_' prefix and the '_total' suffix of counters, with their help text
+COUNTERS = {
+    'install_locations_checked': 'Install locations of packages that were checked',
+    'query_builds': 'Query images that were built',
+    'query_builds_avoided': 'Query image builds that were avoided, by reason',
+    'query_failures': 'Version queries that failed',
+    'outdated_packages': 'Packages that are not up to date',
+    'version_cache_hits': 'Versions of queries and containerfiles that were parsed before',
+    'version_cache_misses': 'Versions of queries and containerfiles that were parsed',
+}
+HISTOGRAMS = {
+    'build_duration_seconds': 'Durations of query image builds',
+    'run_duration_seconds': 'Durations of version queries in query images',
+}
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    """Counters and histograms of a run, in the Prometheus text exposition format"""
+
+    def __init__(self) -> None:
+        # Values by name and by the value of their 'reason' label, which is empty for counters without it
+        self.counters: dict[str, dict[str, int]] = {name: {} for name in COUNTERS}
+        self.histograms = {name: Histogram(DURATION_BUCKETS) for name in HISTOGRAMS}
+
+    def increment(self, name: str, amount: int = 1, reason: str = '') -> None:
+        values = self.counters[name]
+        values[reason] = values.get(reason, 0) + amount
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.histograms[name].observe(time.monotonic() - start)
+
+    def render(self, now: float | None = None) -> str:
+        lines = []
+        for name, help_ in COUNTERS.items():
+            lines += [f'# HELP unold_{name}_total {help_}', f'# TYPE unold_{name}_total counter']
+            values = self.counters[name] or {'': 0}
+            lines.extend(
+                f'unold_{name}_total{{reason="{reason}"}} {value}' if reason else f'unold_{name}_total {value}'
+                for reason, value in sorted(values.items())
+            )
+
+        for name, help_ in HISTOGRAMS.items():
+            histogram = self.histograms[name]
+            lines += [f'# HELP unold_{name} {help_}', f'# TYPE unold_{name} histogram']
+            cumulative = 0
+            for bound, count in zip([*map(str, histogram.buckets), '+Inf'], histogram.counts, strict=True):
+                cumulative += count
+                lines.append(f'unold_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f'unold_{name}_sum {histogram.sum}', f'unold_{name}_count {cumulative}']
+
+        # Lets alerts notice runs that stopped happening
+        lines += [
+            '# HELP unold_last_run_timestamp_seconds When the run ended',
+            '# TYPE unold_last_run_timestamp_seconds gauge',
+            f'unold_last_run_timestamp_seconds {time.time() if now is None else now}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_path: Path) -> None:
+        # Replace the file at once, so that a collector that reads it meanwhile never sees half of it
+        file_path_tmp = file_path.with_name(f'.{file_path.name}.{os.getpid()}')
+        file_path_tmp.write_text(self.render(), encoding='utf-8')
+        file_path_tmp.replace(file_path)
+
+
+def increment(metrics: Metrics | None, name: str, amount: int = 1, reason: str = '') -> None:
+    """Increment a counter if collecting metrics"""
+    if metrics is not None:
+        metrics.increment(name, amount, reason)
+
+
+def time_histogram(metrics: Metrics | None, name: str) -> AbstractContextManager[None]:
+    """Observe how long something takes if collecting metrics"""
+    return nullcontext() if metrics is None else metrics.time(name)
@@ -5,7 +5,7 @@ from dataclasses import dataclass
 from version import Version, VersionConditional
 
 
-@dataclass
+@dataclass(slots=True)
 class Package:
     name: str
     conditional: VersionConditional = VersionConditional.NONE
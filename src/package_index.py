@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+
+# File layout, all integers little endian:
+# - Header: magic, format version and number of packages
+# - Records sorted by package name: offset of name in data, length of name, length of version string
+# - Data: UTF-8 encoded package names, each directly followed by its version string
+MAGIC = b'UNOLDIDX'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sII')
+_RECORD = struct.Struct('<IHH')
+
+
+class PackageIndexError(Exception):
+    pass
+
+
+class PackageIndex:
+    """Memory mapped lookup table from package name to newest version string"""
+
+    def __init__(self, path: Path) -> None:
+        with path.open('rb') as file:
+            # Empty files can't be mapped
+            if os.fstat(file.fileno()).st_size < _HEADER.size:
+                raise PackageIndexError(f"Package index '{path}' is truncated")
+            # The mapping stays valid after the file is closed
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, self._count = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise PackageIndexError(f"'{path}' is not a package index")
+        if format_version != FORMAT_VERSION:
+            raise PackageIndexError(
+                f"Package index '{path}' has format version {format_version}, but {FORMAT_VERSION} is supported"
+            )
+        self._data_offset = _HEADER.size + self._count * _RECORD.size
+        # The data of the last record ends last
+        data_size = 0
+        if self._count and len(self._mmap) >= self._data_offset:
+            name_offset, name_length, version_length = _RECORD.unpack_from(self._mmap, self._data_offset - _RECORD.size)
+            data_size = name_offset + name_length + version_length
+        if len(self._mmap) < self._data_offset + data_size:
+            raise PackageIndexError(f"Package index '{path}' is truncated")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, package_name: str) -> str | None:
+        name = package_name.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            name_offset, name_length, version_length = _RECORD.unpack_from(
+                self._mmap, _HEADER.size + middle * _RECORD.size
+            )
+            start = self._data_offset + name_offset
+            name_middle = self._mmap[start : start + name_length]
+            if name_middle < name:
+                low = middle + 1
+            elif name_middle > name:
+                high = middle
+            else:
+                start += name_length
+                return self._mmap[start : start + version_length].decode()
+        return None
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def write_package_index(path: Path, versions: Mapping[str, str]) -> None:
+    """Write a package index atomically, so that concurrent readers see either the old or the new one"""
+    names = sorted(name.encode() for name in versions)
+    records = bytearray()
+    data = bytearray()
+    for name in names:
+        version = versions[name.decode()].encode()
+        records += _RECORD.pack(len(data), len(name), len(version))
+        data += name + version
+
+    file_descriptor, tmp_path_str = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file:
+            file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(names)))
+            file.write(records)
+            file.write(data)
+        Path(tmp_path_str).replace(path)
+    except BaseException:
+        Path(tmp_path_str).unlink(missing_ok=True)
+        raise
@@ -1,15 +1,22 @@
 from __future__ import annotations
 
+import functools
+import re
+import shlex
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from collections.abc import Sequence
+    from collections.abc import Iterable, Sequence
 
     from package import Package
     from version import Version
 
+_ENVIRONMENT_ASSIGNMENT_REGEX = re.compile('[A-Za-z_][A-Za-z0-9_]*=')
+# Number of parsed versions that a package manager keeps, which bounds the memory of large scans
+VERSION_CACHE_SIZE = 65536
+
 
 @dataclass(frozen=True)
 class ParseInstallPackageResult:
@@ -19,30 +26,47 @@ class ParseInstallPackageResult:
 
 
 class PackageManager(ABC):
+    # Directory in which the package manager keeps downloaded package indexes, which query image builds can share
+    cache_dir: str | None = None
+    # Executables that run the package manager. Only subcommands that run one of them are offered to it.
+    executables: frozenset[str] = frozenset()
+
     def parse_install_package(self, command: Sequence[str]) -> list[ParseInstallPackageResult]:
-        sub_cmd: list[str] = []
         results = []
         command_prefix = ''
-        for i, s in enumerate(command):
-            if s in {'&&', '||', ';'}:
-                packages, forwarded_args = self._parse_install_package_subcommand(sub_cmd)
-                if packages:
-                    results.append(ParseInstallPackageResult(packages, forwarded_args, command_prefix))
-                    command_prefix = ' '.join(command[:i])
-                sub_cmd = []
-                continue
-
-            sub_cmd.append(s)
-
-        if sub_cmd:
+        for sub_cmd, end_idx in split_command(command):
             packages, forwarded_args = self._parse_install_package_subcommand(sub_cmd)
             if packages:
                 results.append(ParseInstallPackageResult(packages, forwarded_args, command_prefix))
+                command_prefix = ' '.join(command[:end_idx])
 
         return results
 
-    @abstractmethod
+    def query_versions_offline(
+        self,
+        package_names: Sequence[str],  # noqa: ARG002
+        forward_arguments: Sequence[str],  # noqa: ARG002
+        image: str,  # noqa: ARG002
+        preceding_instructions: Sequence[str],  # noqa: ARG002
+    ) -> dict[str, Version] | None:
+        """Get the newest versions without building any image. Returns None when that's not possible.
+
+        The image is what the stage is ultimately based on, and the preceding instructions are those between it and the
+        install location.
+        """
+        return None
+
     def create_query_versions_command(self, package_names: Sequence[str], forward_arguments: Sequence[str]) -> str:
+        update_command = self.create_update_index_command()
+        list_command = self.create_list_versions_command(package_names, forward_arguments)
+        return f'{update_command} && {list_command}'
+
+    @abstractmethod
+    def create_update_index_command(self) -> str:
+        raise NotImplementedError('Subclass this class and override this function')
+
+    @abstractmethod
+    def create_list_versions_command(self, package_names: Sequence[str], forward_arguments: Sequence[str]) -> str:
         raise NotImplementedError('Subclass this class and override this function')
 
     @abstractmethod
@@ -53,6 +77,72 @@ class PackageManager(ABC):
     def parse_version_string(self, package_name: str, version_str: str) -> Version | None:
         raise NotImplementedError('Subclass this class and override this function')
 
+    def get_version_cache_counts(self) -> tuple[int, int]:
+        """Get the numbers of hits and misses of the cache of parsed versions, which all instances share"""
+        return 0, 0
+
     @abstractmethod
     def _parse_install_package_subcommand(self, command: Sequence[str]) -> tuple[list[Package], list[str]]:
         raise NotImplementedError('Subclass this class and override this function')
+
+
+class PackageManagerIndex:
+    """Package managers by the executables that run them, so that a subcommand is only parsed by those it may run"""
+
+    def __init__(self, package_managers: Iterable[PackageManager]) -> None:
+        self._package_managers: dict[str, list[PackageManager]] = {}
+        for package_manager in package_managers:
+            for executable in package_manager.executables:
+                self._package_managers.setdefault(executable, []).append(package_manager)
+
+    def parse_install_package(self, command: Sequence[str]) -> list[tuple[PackageManager, ParseInstallPackageResult]]:
+        """Like PackageManager.parse_install_package for all package managers, in the order of the subcommands"""
+        results = []
+        command_prefixes: dict[PackageManager, str] = {}
+        for sub_cmd, end_idx in split_command(command):
+            executable_idx = find_executable(sub_cmd)
+            if executable_idx is None:
+                continue
+            for package_manager in self._package_managers.get(sub_cmd[executable_idx], ()):
+                packages, forwarded_args = package_manager._parse_install_package_subcommand(sub_cmd)  # noqa: SLF001
+                if packages:
+                    command_prefix = command_prefixes.get(package_manager, '')
+                    results.append(
+                        (package_manager, ParseInstallPackageResult(packages, forwarded_args, command_prefix))
+                    )
+                    command_prefixes[package_manager] = ' '.join(command[:end_idx])
+
+        return results
+
+
+def find_executable(command: Sequence[str]) -> int | None:
+    """Get the index of the executable that a command runs, after sudo and environment variable assignments"""
+    for idx, word in enumerate(command):
+        if word != 'sudo' and not _ENVIRONMENT_ASSIGNMENT_REGEX.match(word):
+            return idx
+    return None
+
+
+def split_command(command: Sequence[str]) -> list[tuple[list[str], int]]:
+    """Split a shell command into its non-empty subcommands, each with the index of the token that ends it"""
+    sub_cmds = []
+    sub_cmd: list[str] = []
+    for i, s in enumerate(command):
+        if s in {'&&', '||', ';'}:
+            if sub_cmd:
+                sub_cmds.append((sub_cmd, i))
+            sub_cmd = []
+            continue
+
+        sub_cmd.append(s)
+
+    if sub_cmd:
+        sub_cmds.append((sub_cmd, len(command)))
+
+    return sub_cmds
+
+
+@functools.lru_cache(maxsize=65536)
+def split_shell_words(command: str) -> tuple[str, ...]:
+    """Split a shell command into words. Cached, since every package manager and the query planning need them."""
+    return tuple(shlex.split(command))
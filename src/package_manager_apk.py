@@ -1,27 +1,98 @@
 from __future__ import annotations
 
-import argparse
+import functools
 import re
-from contextlib import redirect_stderr
-from io import StringIO
 from typing import TYPE_CHECKING, override
 
 from package import Package
-from package_manager import PackageManager
+from package_manager import VERSION_CACHE_SIZE, PackageManager, find_executable
 from version import Version, VersionConditional
 
 if TYPE_CHECKING:
     from collections.abc import Sequence
 
+    from apk_index import ApkIndex
+
+# Instructions like these may change which repositories apk uses
+_CHANGE_REPOSITORIES_REGEX = re.compile(r'/etc/apk|^(COPY|ADD)\s.*\s/(etc/?)?$', re.IGNORECASE)
+# Versions are numbers, a letter, suffixes, a commit hash and a revision, such as 1.2.3a_rc1_p2~1a2b3c-r4. See
+# https://gitlab.alpinelinux.org/alpine/apk-tools/-/blob/master/src/version.c
+_VERSION_REGEX = re.compile(
+    r'([0-9]+(?:\.[0-9]+)*)([a-z]?)((?:_(?:alpha|beta|pre|rc|cvs|svn|git|hg|p)[0-9]*)*)(?:~[0-9a-f]+)?(?:-r([0-9]+))?'
+)
+_SUFFIX_REGEX = re.compile('_([a-z]+)([0-9]*)')
+# Pre-releases are older than the version without the suffix
+_PRE_RELEASE_SUFFIXES = ('alpha', 'beta', 'pre', 'rc')
+_SUFFIXES = (*_PRE_RELEASE_SUFFIXES, 'cvs', 'svn', 'git', 'hg', 'p')
+# Ranks of the kinds of tokens in version keys. Where two versions have a different kind of token, the one with the
+# higher ranked token is newer. Commit hashes don't order versions.
+_TOKEN_PRE_RELEASE_SUFFIX = 0
+_TOKEN_END = 1
+_TOKEN_REVISION = 2
+_TOKEN_SUFFIX_NUMBER = 3
+_TOKEN_SUFFIX = 4
+_TOKEN_LETTER = 5
+_TOKEN_NUMBER = 6
+
+# Options that take a value. See:
+# - https://man.archlinux.org/man/extra/apk-tools/apk.8.en
+# - https://man.archlinux.org/man/extra/apk-tools/apk-add.8.en
+_OPTIONS_WITH_VALUES = frozenset(
+    {
+        '--arch',
+        '--cache-dir',
+        '--cache-max-age',
+        '--keys-dir',
+        '--progress-fd',
+        '--repositories-file',
+        '--repository',
+        '--root',
+        '--timeout',
+        '--wait',
+        '-p',
+        '-X',
+    }
+)
+_ADD_OPTIONS_WITH_VALUES = _OPTIONS_WITH_VALUES | {'-t', '--virtual'}
+# Options that change which package versions are available, so the version queries get them too
+_FORWARDED_OPTIONS = ('--arch', '--repository', '-X')
+
 
 class PackageManagerApk(PackageManager):
+    cache_dir = '/var/cache/apk'
+    executables = frozenset({'apk'})
+
+    def __init__(self, index: ApkIndex | None = None) -> None:
+        self.index = index
+
+    @override
+    def query_versions_offline(
+        self,
+        package_names: Sequence[str],
+        forward_arguments: Sequence[str],
+        image: str,
+        preceding_instructions: Sequence[str],
+    ) -> dict[str, Version] | None:
+        # The index only knows about the default repositories of the image
+        if (
+            self.index is None
+            or forward_arguments
+            or any(_CHANGE_REPOSITORIES_REGEX.search(instruction) for instruction in preceding_instructions)
+        ):
+            return None
+        return self.index.query_versions(image, package_names, self)
+
+    @override
+    def create_update_index_command(self) -> str:
+        return 'apk update -q'
+
     @override
-    def create_query_versions_command(self, package_names: Sequence[str], forward_arguments: Sequence[str]) -> str:
+    def create_list_versions_command(self, package_names: Sequence[str], forward_arguments: Sequence[str]) -> str:
         if not package_names:
             raise RuntimeError('No package names supplied')
 
         all_args = list(forward_arguments) + list(package_names)
-        return 'apk update -q && apk list ' + ' '.join(all_args)
+        return 'apk list ' + ' '.join(all_args)
 
     @override
     def parse_version(self, package_version_str: str) -> Version | None:
@@ -34,89 +105,48 @@ class PackageManagerApk(PackageManager):
 
     @override
     def parse_version_string(self, package_name: str, version_str: str) -> Version | None:
-        match = re.match(r'([0-9]+)(\.([0-9]+)(\.([0-9]+)(-r([0-9]+))?)?)?', version_str)
-        if not match:
-            return None
+        return _parse_version_string(package_name, version_str)
 
-        major, minor, patch, revision = None, None, None, None
-        if match[1]:
-            major = int(match[1])
-        if match[3]:
-            minor = int(match[3])
-        if match[5]:
-            patch = int(match[5])
-        if match[7]:
-            revision = int(match[7])
-        return Version(
-            package_name=package_name, source=version_str, major=major, minor=minor, patch=patch, revision=revision
-        )
+    @override
+    def get_version_cache_counts(self) -> tuple[int, int]:
+        cache_info = _parse_version_string.cache_info()
+        return cache_info.hits, cache_info.misses
 
     @override
     def _parse_install_package_subcommand(self, command: Sequence[str]) -> tuple[list[Package], list[str]]:
-        for apk_idx, sub_command in enumerate(command):
-            if sub_command == 'sudo' or re.match('[A-Za-z_][A-Za-z0-9_]*=', sub_command):
-                continue
-            if sub_command == 'apk':
-                apk_args = command[apk_idx + 1 :]
-                break
+        apk_args = _find_apk_args(command)
+        if apk_args is None:
             return [], []
 
-        apk_args = command[apk_idx + 1 :]
-
-        parser = argparse.ArgumentParser()
-        parser_parent = argparse.ArgumentParser()
-        subparsers = parser.add_subparsers(dest='command')
-        parser_add = subparsers.add_parser('add', parents=[parser_parent], add_help=False)
-
-        # See:
-        # - https://man.archlinux.org/man/extra/apk-tools/apk.8.en
-        # - https://man.archlinux.org/man/extra/apk-tools/apk-add.8.en
-        apk_args_with_values = [
-            '--arch',
-            '--cache-dir',
-            '--cache-max-age',
-            '--keys-dir',
-            '--progress-fd',
-            '--repositories-file',
-            '--repository',
-            '--root',
-            '--timeout',
-            '--wait',
-            '-p',
-            '-X',
-        ]
-        apk_add_args_with_values = [
-            '-t',
-            '--virtual',
-        ]
-
-        for arg in apk_args_with_values:
-            parser_parent.add_argument(arg)
-        for arg in apk_add_args_with_values:
-            parser_add.add_argument(arg)
-
-        try:
-            # Hide stderr output from argparse
-            with redirect_stderr(StringIO()):
-                args_parent_known, _ = parser_parent.parse_known_args(apk_args)
-                args_known, args_unknown = parser.parse_known_args(apk_args)
-        except SystemExit:
-            return [], []
-
-        if args_known.command != 'add':
-            return [], []
+        # A single pass over the arguments, in which options may come before and after the subcommand
+        sub_command = None
+        packages: list[Package] = []
+        forwarded: dict[str, str] = {}
+        options_ended = False
+        args = iter(apk_args)
+        for arg in args:
+            if arg.startswith('-') and arg != '-' and not options_ended:
+                if arg == '--':
+                    options_ended = True
+                    continue
+                options_with_values = _OPTIONS_WITH_VALUES if sub_command is None else _ADD_OPTIONS_WITH_VALUES
+                name, value = _split_option(arg, options_with_values)
+                if name in options_with_values:
+                    value = next(args, '') if value is None else value
+                    if name in _FORWARDED_OPTIONS:
+                        forwarded[name] = value
+                continue
 
-        forwarded_args = []
-        if args_parent_known.arch:
-            forwarded_args.extend(['--arch', args_parent_known.arch])
-        if args_parent_known.repository:
-            forwarded_args.extend(['--repository', args_parent_known.repository])
-        if args_parent_known.X:
-            forwarded_args.extend(['-X', args_parent_known.X])
+            if sub_command is None:
+                if arg != 'add':
+                    return [], []
+                sub_command = arg
+            else:
+                packages.append(PackageManagerApk._create_package(arg))
 
-        return [
-            PackageManagerApk._create_package(arg) for arg in args_unknown if not arg.startswith('-')
-        ], forwarded_args
+        # Only the last value of an option counts
+        forwarded_args = [arg for name in _FORWARDED_OPTIONS if name in forwarded for arg in (name, forwarded[name])]
+        return packages, forwarded_args
 
     @staticmethod
     def _create_package(package_str: str) -> Package:
@@ -151,3 +181,51 @@ class PackageManagerApk(PackageManager):
             conditional = VersionConditional.NONE
 
         return Package(name=name, conditional=conditional, version_str=version_str)
+
+
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
+def _parse_version_string(package_name: str, version_str: str) -> Version | None:
+    """Cached, since the same versions recur in the output of every query and in the containerfiles"""
+    match = _VERSION_REGEX.match(version_str)
+    if not match:
+        return None
+
+    numbers, letter, suffixes, revision = match.groups()
+    key = []
+    for i, number in enumerate(numbers.split('.')):
+        number_stripped = number.lstrip('0')
+        if i and number_stripped != number:
+            # Like apk, compare numbers with leading zeros as fractions, so that 1.05 is older than 1.5
+            key.append((_TOKEN_NUMBER, len(number_stripped) - len(number)))
+            if number_stripped:
+                key.append((_TOKEN_NUMBER, int(number_stripped)))
+        else:
+            key.append((_TOKEN_NUMBER, int(number)))
+    if letter:
+        key.append((_TOKEN_LETTER, ord(letter)))
+    for suffix, suffix_number in _SUFFIX_REGEX.findall(suffixes):
+        key.append(
+            (_TOKEN_PRE_RELEASE_SUFFIX if suffix in _PRE_RELEASE_SUFFIXES else _TOKEN_SUFFIX, _SUFFIXES.index(suffix))
+        )
+        if suffix_number:
+            key.append((_TOKEN_SUFFIX_NUMBER, int(suffix_number)))
+    if revision is not None:
+        key.append((_TOKEN_REVISION, int(revision)))
+    key.append((_TOKEN_END, 0))
+    return Version(source=version_str, package_name=package_name, key=tuple(key))
+
+
+def _find_apk_args(command: Sequence[str]) -> Sequence[str] | None:
+    """Get the arguments of apk, if the command runs apk, possibly with sudo or environment variables"""
+    apk_idx = find_executable(command)
+    return command[apk_idx + 1 :] if apk_idx is not None and command[apk_idx] == 'apk' else None
+
+
+def _split_option(arg: str, options_with_values: frozenset[str]) -> tuple[str, str | None]:
+    """Split an option into its name and its value if it's in the same argument, such as '--arch=x86' or '-Xurl'"""
+    if arg.startswith('--'):
+        name, separator, value = arg.partition('=')
+        return name, value if separator else None
+    if len(arg) > 2 and arg[:2] in options_with_values:
+        return arg[:2], arg[2:]
+    return arg, None
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import subprocess
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from container_manager import ContainerManager
+
+# Printed after each command in a batch, followed by the exit status of the command
+_SEPARATOR = '--- unold exit status:'
+
+
+class QueryContainer:
+    """An idle container in which commands are executed in batches, to avoid starting a container per command"""
+
+    def __init__(self, container_manager: ContainerManager, container_id: str, semaphore: asyncio.Semaphore) -> None:
+        self.container_manager = container_manager
+        self.container_id = container_id
+        self._semaphore = semaphore
+        self._pending: list[tuple[str, asyncio.Future[str]]] = []
+        self._batch: asyncio.Future[None] | None = None
+
+    @staticmethod
+    async def start(
+        container_manager: ContainerManager, image_name: str, semaphore: asyncio.Semaphore
+    ) -> QueryContainer:
+        async with semaphore:
+            container_id = await container_manager.start(image_name, 'tail -f /dev/null')
+        return QueryContainer(container_manager, container_id, semaphore)
+
+    async def exec(self, command: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((command, future))
+        if self._batch is None:
+            self._batch = asyncio.ensure_future(self._exec_pending())
+        return await future
+
+    async def _exec_pending(self) -> None:
+        async with self._semaphore:
+            # Commands that arrive while waiting for a job slot join this batch
+            pending, self._pending = self._pending, []
+            self._batch = None
+
+            # Start the separator on a new line, in case the output of the command doesn't end with one
+            script = ' ; '.join(f'{command} ; printf \'\\n{_SEPARATOR} %s\\n\' "$?"' for command, _ in pending)
+            try:
+                output = await self.container_manager.exec(self.container_id, script)
+            except asyncio.CancelledError:
+                for _, future in pending:
+                    future.cancel()
+                raise
+            # Nobody awaits the batch itself, so pass the error on to everyone waiting for it
+            except Exception as exc:  # noqa: BLE001
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+
+        results = _split_output(output)
+        if len(results) != len(pending):
+            results = [(-1, output)] * len(pending)
+
+        for (command, future), (exit_status, command_output) in zip(pending, results, strict=True):
+            # The waiter may have been cancelled
+            if future.done():
+                continue
+            if exit_status == 0:
+                future.set_result(command_output.strip())
+            else:
+                future.set_exception(
+                    subprocess.CalledProcessError(exit_status, ['sh', '-c', command], command_output, '')
+                )
+
+
+async def remove_containers(container_manager: ContainerManager, containers: Sequence[QueryContainer]) -> None:
+    await container_manager.remove_containers([container.container_id for container in containers])
+
+
+def _split_output(output: str) -> list[tuple[int, str]]:
+    results = []
+    command_output: list[str] = []
+    for line in output.splitlines(keepends=True):
+        if line.startswith(_SEPARATOR):
+            results.append((int(line[len(_SEPARATOR) :]), ''.join(command_output)))
+            command_output = []
+        else:
+            command_output.append(line)
+    return results
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import asyncio
+    from pathlib import Path
+
+    from apk_index import ApkIndex
+    from container_manager import ContainerManager, ImageInfo
+    from git_diff import ChangedLines
+    from image_store import ImageStore
+    from metrics import Metrics
+    from query_container import QueryContainer
+
+    from result_cache import ResultCache
+    from trace_events import Tracer
+    from version import Version
+
+
+@dataclass
+class QueryContext:
+    container_manager: ContainerManager
+    dir_path: Path  # Temporary directory for generated containerfiles
+    semaphore: asyncio.Semaphore  # Limits the number of concurrent container manager jobs
+    cache: ResultCache | None = None
+    apk_index: ApkIndex | None = None
+    query_mode: str = 'run'  # See --query-mode
+    build_context: Path | None = None  # See --build-context
+    cache_bust: str | None = None  # Changes to refresh the package indexes of query images
+    cache_mounts: bool = False  # See --cache-mounts
+    image_store: ImageStore | None = None  # Query images are reused and evicted if there's a store
+    max_images: int | None = None  # See --max-images
+    max_images_size: int | None = None  # See --max-images-size
+    pull_semaphore: asyncio.Semaphore | None = None  # Limits the number of concurrent pulls, instead of the semaphore
+    tracer: Tracer | None = None  # See --trace
+    metrics: Metrics | None = None  # See --metrics
+    since: str | None = None  # See --since
+    # Version queries that are in flight or done, keyed by the hash of the query image containerfile and command
+    queries: dict[str, asyncio.Future[dict[str, Version]]] = field(default_factory=dict)
+    # Names of query images that are being built or are built, keyed by the hash of their containerfile
+    images: dict[str, asyncio.Future[str]] = field(default_factory=dict)
+    # Resolved digests of base images, keyed by image reference
+    image_digests: dict[str, asyncio.Future[str]] = field(default_factory=dict)
+    # Query images of earlier runs by name, listed once when the first image is needed
+    stored_images: dict[str, asyncio.Future[dict[str, ImageInfo]]] = field(default_factory=dict)
+    # Changed lines since --since by file path, keyed by the directory of their git repository
+    changed_lines: dict[str, asyncio.Future[ChangedLines]] = field(default_factory=dict)
+    # Containers to execute queries in, keyed by image name
+    containers: dict[str, asyncio.Future[QueryContainer]] = field(default_factory=dict)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from package_manager import split_command, split_shell_words
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    import dockerfile  # type: ignore[import-not-found]
+
+    from install_location import InstallLocation
+    from package_manager import PackageManager
+
+# Instructions that can't change which package versions are available
+HARMLESS_INSTRUCTIONS = frozenset({'arg', 'env', 'expose', 'label'})
+
+
+@dataclass(frozen=True)
+class QueryGroup:
+    # The query runs at the first install location, which comes first in the containerfile
+    install_locations: list[InstallLocation]
+
+    @property
+    def package_names(self) -> list[str]:
+        return list(
+            dict.fromkeys(
+                package.name for install_location in self.install_locations for package in install_location.packages
+            )
+        )
+
+
+def plan_queries(
+    layers: Sequence[dockerfile.Command], install_locations: Sequence[InstallLocation]
+) -> list[QueryGroup]:
+    """Group install locations that can be answered by a single version query
+
+    Install locations are grouped if they share package manager and forwarded arguments, and nothing between them but
+    package installations and harmless instructions. Anything else, e.g. a new stage or an unknown command, might change
+    the available package versions and starts new groups.
+    """
+    install_locations_per_line: dict[int, list[InstallLocation]] = defaultdict(list)
+    for install_location in install_locations:
+        install_locations_per_line[install_location.containerfile_start_line].append(install_location)
+
+    groups: dict[tuple[int, PackageManager, tuple[str, ...]], list[InstallLocation]] = {}
+    epoch = 0
+    for layer in layers:
+        cmd = layer.cmd.casefold()
+        if cmd != 'run':
+            if cmd not in HARMLESS_INSTRUCTIONS:
+                epoch += 1
+            continue
+
+        line_install_locations = install_locations_per_line.get(layer.start_line - 1, [])
+        install_only = len(line_install_locations) == len(split_command(split_shell_words(layer.value[0])))
+        for install_location in line_install_locations:
+            if not install_only:
+                # The install location may be preceded by anything in this command
+                epoch += 1
+            key = (epoch, install_location.package_manager, tuple(install_location.argument_forwards))
+            groups.setdefault(key, []).append(install_location)
+        if not install_only:
+            epoch += 1
+
+    return [QueryGroup(group) for group in groups.values()]
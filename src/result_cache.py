@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+# Bump when the meaning of the stored values changes
+SCHEMA_VERSION = 1
+
+
+class ResultCache:
+    """Persistent cache of version query results, which can be shared between processes"""
+
+    def __init__(self, dir_path: Path, ttl: float, *, refresh: bool = False) -> None:
+        self.ttl = ttl
+        self.refresh = refresh
+
+        dir_path.mkdir(parents=True, exist_ok=True)
+        # Let concurrent writers wait for each other rather than fail
+        self._connection = sqlite3.connect(dir_path / 'results.sqlite3', timeout=60, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, '
+            'created REAL NOT NULL, '
+            'version_strings TEXT NOT NULL'
+            ')'
+        )
+
+    @staticmethod
+    def create_key(base_image_digest: str, query: str) -> str:
+        """Key a query by what the result depends on. The query contains package names and forwarded arguments."""
+        return hashlib.sha256(f'{SCHEMA_VERSION}\0{base_image_digest}\0{query}'.encode()).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        if self.refresh:
+            return None
+
+        row = self._connection.execute(
+            'SELECT version_strings FROM results WHERE key = ? AND created >= ?', (key, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, version_strings: Sequence[str]) -> None:
+        self._connection.execute(
+            'INSERT OR REPLACE INTO results (key, created, version_strings) VALUES (?, ?, ?)',
+            (key, time.time(), json.dumps(list(version_strings))),
+        )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'unold'
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Mapping
+    from contextlib import AbstractContextManager
+    from pathlib import Path
+
+# Tags of the spans of the current task, which tasks that it starts inherit
+_tags: ContextVar[Mapping[str, object] | None] = ContextVar('trace_tags', default=None)
+
+
+class Tracer:
+    """Records spans in the trace event format, which chrome://tracing and https://ui.perfetto.dev load"""
+
+    def __init__(self) -> None:
+        self._start = time.perf_counter_ns()
+        self._events: list[dict[str, object]] = []
+        # Concurrent tasks get a track of their own, since the spans of a track must nest
+        self._task_ids: dict[asyncio.Task[object] | None, int] = {}
+
+    @contextmanager
+    def span(self, name: str, **args: object) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            self._events.append(
+                {
+                    'name': name,
+                    'ph': 'X',
+                    'ts': (start - self._start) / 1000,
+                    'dur': (end - start) / 1000,
+                    'pid': os.getpid(),
+                    'tid': self._get_task_id(),
+                    'args': {**(_tags.get() or {}), **args},
+                }
+            )
+
+    def _get_task_id(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            # Outside of an event loop
+            task = None
+        return self._task_ids.setdefault(task, len(self._task_ids))
+
+    def write(self, file_path: Path) -> None:
+        with file_path.open('w', encoding='utf-8') as file:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, file)
+
+
+def span(tracer: Tracer | None, name: str, **args: object) -> AbstractContextManager[None]:
+    """Record a span if tracing"""
+    return nullcontext() if tracer is None else tracer.span(name, **args)
+
+
+def tag(tracer: Tracer | None, **tags: object) -> None:
+    """Tag the spans of the current task from now on, including those of the tasks that it starts"""
+    if tracer is not None:
+        _tags.set({**(_tags.get() or {}), **tags})
@@ -3,57 +3,380 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
 import hashlib
-import shlex
+import os
+import platform
 import subprocess
 import sys
 import tempfile
+import time
 from pathlib import Path
 from shutil import which
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, TypeVar
 
 import dockerfile  # type: ignore[import-not-found]
 
+from apk_index import ApkIndex, compile_apk_index, is_compiled_index_up_to_date
+from build_context import BuildContext
+from container_manager import OWNER_LABEL
+from container_manager_api import ContainerManagerApi
+from container_manager_cli import ContainerManagerCli
+from containerfile import (
+    find_base_image,
+    find_context_sources,
+    find_external_images,
+    find_stage,
+    find_stage_chain,
+    find_stage_dependencies,
+    parse_stages,
+    select_stage_line_ranges,
+    select_stage_lines,
+)
+from git_diff import find_changed_lines, find_repository
+from image_store import (
+    BASE_IMAGE_DIGEST_LABEL,
+    CREATED_LABEL,
+    QUERY_LABEL,
+    ImageStore,
+    is_reusable,
+    select_evictions,
+)
 from install_location import InstallLocation
+from metrics import Metrics, increment, time_histogram
+from package_manager import PackageManagerIndex, split_shell_words
 from package_manager_apk import PackageManagerApk
-from version import Version, VersionComparison, VersionConditional
+from query_container import QueryContainer, remove_containers
+from query_context import QueryContext
+from query_plan import QueryGroup, plan_queries
+from result_cache import ResultCache, default_cache_dir
+from trace_events import Tracer, span, tag
+from version import Version, VersionComparison, VersionConditional, compare_all
 
 if TYPE_CHECKING:
-    from collections.abc import Sequence
+    from collections.abc import Callable, Coroutine, Mapping, Sequence
 
+    from container_manager import ContainerManager, ImageInfo
+    from containerfile import Stage
+    from git_diff import ChangedLines
     from package_manager import PackageManager
 
+T = TypeVar('T')
+
+# Updating the package index in a query image is cached until the value of this argument changes
+CACHE_BUST_ARG = 'UNOLD_CACHE_BUST'
+# The file to which the export query mode writes the output of a version query
+QUERY_OUTPUT_FILE_NAME = 'unold_versions'
+
 
 def main(args_cmd_line: Sequence[str] | None = None) -> int:
+    if args_cmd_line is None:
+        args_cmd_line = sys.argv[1:]
+    if args_cmd_line and args_cmd_line[0] in SUBCOMMANDS:
+        return SUBCOMMANDS[args_cmd_line[0]](args_cmd_line[1:])
+
     args = parse_arguments(args_cmd_line)
-    container_manager = args.container_manager
     file_paths = [Path(path_str) for path_str in args.file_paths]
 
-    if not is_command_available(container_manager):
-        print(f"Container manager '{container_manager}' is not available", file=sys.stderr)
+    if args.api_socket is not None and args.query_mode == 'export':
+        print('The export query mode requires the command line interface, not --api-socket', file=sys.stderr)
+        return 1
+    if args.api_socket is not None and args.cache_mounts:
+        # The API builds without BuildKit, which cache mounts require
+        print('--cache-mounts requires the command line interface, not --api-socket', file=sys.stderr)
+        return 1
+    container_manager = create_container_manager(args)
+    if container_manager is None:
+        return 1
+
+    cache = None if args.no_cache else ResultCache(args.cache_dir, args.cache_ttl, refresh=args.refresh)
+    image_store = ImageStore(args.cache_dir)
+    tracer = None if args.trace is None else Tracer()
+    metrics = None if args.metrics is None else Metrics()
+    try:
+        with tempfile.TemporaryDirectory(prefix='unold_') as dir_tmp_str:
+            apk_index = None if args.apk_index_dir is None else ApkIndex(args.apk_index_dir, args.apk_index_arch)
+            # The job limit is shared across all files
+            context = QueryContext(
+                container_manager,
+                Path(dir_tmp_str),
+                asyncio.Semaphore(args.jobs),
+                cache,
+                apk_index,
+                args.query_mode,
+                args.build_context,
+                # Refresh package indexes as often as query results expire
+                generate_cache_bust(0 if args.refresh else args.cache_ttl),
+                args.cache_mounts,
+                image_store,
+                args.max_images,
+                args.max_images_size,
+                asyncio.Semaphore(args.pull_jobs),
+                tracer,
+                metrics,
+                args.since,
+            )
+            return asyncio.run(check_files(file_paths, context))
+    finally:
+        if cache is not None:
+            cache.close()
+        image_store.close()
+        # Also when interrupted, to show where the time went
+        if tracer is not None:
+            tracer.write(args.trace)
+        if metrics is not None:
+            metrics.write(args.metrics)
+
+
+def main_index(args_cmd_line: Sequence[str]) -> int:
+    args = parse_index_arguments(args_cmd_line)
+
+    index_paths = sorted(args.apk_index_dir.glob('**/APKINDEX.tar.gz'))
+    if not index_paths:
+        print(f"No APKINDEX.tar.gz archives found in '{args.apk_index_dir}'", file=sys.stderr)
+        return 1
+
+    package_manager = PackageManagerApk()
+    for index_path in index_paths:
+        if args.force or not is_compiled_index_up_to_date(index_path):
+            compile_apk_index(index_path, package_manager)
+
+    return 0
+
+
+def main_gc(args_cmd_line: Sequence[str]) -> int:
+    args = parse_gc_arguments(args_cmd_line)
+    container_manager = create_container_manager(args)
+    if container_manager is None:
         return 1
 
+    image_store = ImageStore(args.cache_dir)
+    try:
+        asyncio.run(collect_garbage(container_manager, image_store, args.max_images, args.max_images_size))
+    finally:
+        image_store.close()
+    return 0
+
+
+async def collect_garbage(
+    container_manager: ContainerManager, image_store: ImageStore, max_images: int | None, max_images_size: int | None
+) -> None:
+    try:
+        # Containers are only left behind when unold is killed
+        await container_manager.remove_containers(await container_manager.list_containers(OWNER_LABEL))
+        await evict_images(container_manager, image_store, max_images, max_images_size)
+    finally:
+        await container_manager.close()
+
+
+def create_container_manager(args: argparse.Namespace) -> ContainerManager | None:
+    if args.api_socket is not None:
+        return ContainerManagerApi(args.api_socket)
+    if is_command_available(args.container_manager):
+        return ContainerManagerCli(args.container_manager)
+    print(f"Container manager '{args.container_manager}' is not available", file=sys.stderr)
+    return None
+
+
+async def check_files(file_paths: Sequence[Path], context: QueryContext) -> int:
     exit_code = 0
+    # The cache of parsed versions outlives runs, so count what this run adds to it
+    version_cache_hits, version_cache_misses = PackageManagerApk().get_version_cache_counts()
 
-    for file_path in file_paths:
-        try:
-            if not check_file(container_manager, file_path):
+    try:
+        # Query all files concurrently, but report them in order
+        tasks = [asyncio.ensure_future(query_file(file_path, context)) for file_path in file_paths]
+        for task in tasks:
+            try:
+                if not report_file(await task, context.tracer, context.metrics):
+                    exit_code = 1
+            # Keep running even if we have one error
+            # ruff: noqa: BLE001,PERF203
+            except Exception as exc:
+                print(str(exc), file=sys.stderr)
                 exit_code = 1
-        # Keep running even if we have one error
-        # ruff: noqa: BLE001,PERF203
-        except Exception as exc:
-            print(str(exc), file=sys.stderr)
-            exit_code = 1
+    finally:
+        hits, misses = PackageManagerApk().get_version_cache_counts()
+        increment(context.metrics, 'version_cache_hits', hits - version_cache_hits)
+        increment(context.metrics, 'version_cache_misses', misses - version_cache_misses)
+        # Also when interrupted
+        await stop_query_containers(context)
+        if context.image_store is not None:
+            try:
+                await evict_images(
+                    context.container_manager, context.image_store, context.max_images, context.max_images_size
+                )
+            except Exception as exc:
+                print(f'Failed to remove old query images: {exc}', file=sys.stderr)
+        await context.container_manager.close()
 
     return exit_code
 
 
+async def evict_images(
+    container_manager: ContainerManager, image_store: ImageStore, max_images: int | None, max_images_size: int | None
+) -> None:
+    """Remove the least recently used query images that exceed the budgets"""
+    images = await container_manager.list_images(OWNER_LABEL)
+    evictions = select_evictions(images, image_store.get_last_used(), max_images, max_images_size)
+    await container_manager.remove_images([image.id for image in evictions])
+    image_store.forget(name for image in evictions for name in image.names)
+
+
+async def stop_query_containers(context: QueryContext) -> None:
+    # Wait for containers that are being started, so that they can be removed too
+    results = await asyncio.gather(*context.containers.values(), return_exceptions=True)
+    containers = [result for result in results if isinstance(result, QueryContainer)]
+    await remove_containers(context.container_manager, containers)
+
+
 def parse_arguments(args_cmd_line: Sequence[str] | None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         prog='Containerfile version checker',
         description='Check if containerfiles (such as dockerfiles) have up to date packages',
     )
 
+    add_container_manager_arguments(parser)
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=positive_int,
+        default=os.cpu_count() or 1,
+        help='Maximum number of images to build and run concurrently. Defaults to the number of CPUs.',
+    )
+    parser.add_argument(
+        '--pull-jobs',
+        type=positive_int,
+        default=4,
+        help='Maximum number of base images to pull concurrently, ahead of building. Defaults to %(default)s.',
+    )
+    parser.add_argument(
+        '--query-mode',
+        choices=['run', 'exec', 'export'],
+        default='run',
+        help=(
+            "How to list package versions in a query image. 'run' starts a container per query. 'exec' starts one "
+            "container per query image and executes the queries in it in batches. 'export' lists them during a build "
+            'and exports the output, without starting a container. Defaults to %(default)s.'
+        ),
+    )
+    parser.add_argument(
+        '--build-context',
+        type=Path,
+        help=(
+            'Directory that COPY and ADD instructions copy files from. Only the files they use are passed to the '
+            'container manager. Defaults to the directory of each containerfile.'
+        ),
+    )
+    parser.add_argument(
+        '--cache-mounts',
+        action='store_true',
+        help=(
+            'Share the downloaded package indexes of all query image builds through cache mounts. Requires BuildKit '
+            'or buildah (podman), and the command line interface instead of --api-socket.'
+        ),
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=Path,
+        default=default_cache_dir(),
+        help='Directory of the version query result cache. Defaults to %(default)s.',
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=3600,
+        help=(
+            'Seconds until a cached version query result expires, and until the package indexes in query images are '
+            'updated again. Defaults to %(default)s.'
+        ),
+    )
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write cached version query results')
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Rerun all version queries in query images with updated package indexes, and update the cache',
+    )
+    add_image_budget_arguments(parser, 100)
+    parser.add_argument(
+        '--trace',
+        type=Path,
+        metavar='FILE',
+        help=(
+            'Write how long parsing, image builds, container runs and version comparisons took to this file, in the '
+            'trace event format of chrome://tracing and https://ui.perfetto.dev'
+        ),
+    )
+    parser.add_argument(
+        '--metrics',
+        type=Path,
+        metavar='FILE',
+        help=(
+            'Write counters of checked install locations, query builds, failures and outdated packages, and histograms '
+            'of build and query durations, to this file in the Prometheus text format at the end of the run, e.g. for '
+            'the textfile collector of the node exporter'
+        ),
+    )
+    parser.add_argument(
+        '--since',
+        metavar='REVISION',
+        help=(
+            'Only check the install locations whose instruction, or a line before it that their query image uses, '
+            'changed since this git revision, including uncommitted changes. Changes of other files are not noticed.'
+        ),
+    )
+    parser.add_argument(
+        '--apk-index-dir',
+        type=Path,
+        help=(
+            'Answer apk version queries from APKINDEX.tar.gz archives in this directory instead of building images, '
+            'when the repositories are known. It has the same layout as an Alpine mirror, e.g. '
+            "'v3.20/main/x86_64/APKINDEX.tar.gz'."
+        ),
+    )
+    parser.add_argument(
+        '--apk-index-arch',
+        default=platform.machine(),
+        help='Architecture of the APKINDEX.tar.gz archives to use. Defaults to %(default)s.',
+    )
+    parser.add_argument('file_paths', nargs='+', help='Containerfile paths')
+    return parser.parse_args(args_cmd_line)
+
+
+def parse_index_arguments(args_cmd_line: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Containerfile version checker index',
+        description=(
+            'Compile APKINDEX.tar.gz archives for fast lookups with --apk-index-dir. Archives that are newer than '
+            'their compiled index are compiled again.'
+        ),
+    )
+    parser.add_argument('-f', '--force', action='store_true', help='Compile all archives, even up to date ones')
+    parser.add_argument('apk_index_dir', type=Path, help='Directory with APKINDEX.tar.gz archives')
+    return parser.parse_args(args_cmd_line)
+
+
+def parse_gc_arguments(args_cmd_line: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='Containerfile version checker gc',
+        description=(
+            'Remove the containers that unold left behind, and the least recently used query images that exceed the '
+            'budgets. By default all query images are removed. Containers of unold runs that are still going on are '
+            'removed too.'
+        ),
+    )
+    add_container_manager_arguments(parser)
+    parser.add_argument(
+        '--cache-dir',
+        type=Path,
+        default=default_cache_dir(),
+        help='Directory in which the last use of query images is recorded. Defaults to %(default)s.',
+    )
+    add_image_budget_arguments(parser, 0)
+    return parser.parse_args(args_cmd_line)
+
+
+def add_container_manager_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         '-c',
         '--container-manager',
@@ -63,31 +386,164 @@ def parse_arguments(args_cmd_line: Sequence[str] | None) -> argparse.Namespace:
             'absolute path.'
         ),
     )
-    parser.add_argument('file_paths', nargs='+', help='Containerfile paths')
-    return parser.parse_args(args_cmd_line)
+    parser.add_argument(
+        '--api-socket',
+        type=Path,
+        help=(
+            'Talk to the docker compatible REST API of the container manager over this Unix socket instead of running '
+            'its command line interface, e.g. /var/run/docker.sock or $XDG_RUNTIME_DIR/podman/podman.sock'
+        ),
+    )
+
+
+def add_image_budget_arguments(parser: argparse.ArgumentParser, max_images_default: int) -> None:
+    parser.add_argument(
+        '--max-images',
+        type=non_negative_int,
+        default=max_images_default,
+        help='Maximum number of query images to keep. Defaults to %(default)s.',
+    )
+    parser.add_argument(
+        '--max-images-size',
+        type=byte_size,
+        help=(
+            "Maximum total size of query images to keep, e.g. '10G'. Layers that images share are counted for each "
+            'image. Unlimited by default.'
+        ),
+    )
+
+
+def positive_int(str_: str) -> int:
+    value = int(str_)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"'{str_}' is not a positive integer")
+    return value
+
+
+def non_negative_int(str_: str) -> int:
+    value = int(str_)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"'{str_}' is not a non-negative integer")
+    return value
+
+
+def byte_size(str_: str) -> int:
+    """Parse a number of bytes with an optional binary unit, such as '512M'"""
+    units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    number, unit = str_[:-1], str_[-1:].upper()
+    if unit.isdigit():
+        number, unit = str_, ''
+    if unit not in units or not number.isdigit():
+        raise argparse.ArgumentTypeError(f"'{str_}' is not a size, such as '512M' or '10G'")
+    return int(number) * units[unit]
 
 
 def is_command_available(command: str) -> bool:
     return which(command) is not None
 
 
-def check_file(container_manager: str, file_path: Path) -> bool:
-    success = True
+async def check_file(file_path: Path, context: QueryContext) -> bool:
+    return report_file(await query_file(file_path, context), context.tracer, context.metrics)
+
 
-    package_managers = [PackageManagerApk()]
+async def query_file(
+    file_path: Path, context: QueryContext
+) -> list[tuple[InstallLocation, dict[str, Version] | BaseException]]:
+    package_managers = [PackageManagerApk(context.apk_index)]
+    tag(context.tracer, file=str(file_path))
 
     containerfile_contents = file_path.read_text(encoding='utf-8')
-    layers = parse_containerfile_contents(containerfile_contents)
+    with span(context.tracer, 'parse_containerfile_contents'):
+        layers = parse_containerfile_contents(containerfile_contents)
 
-    install_locations = read_packages(layers, package_managers, file_path)
+    with span(context.tracer, 'read_packages'):
+        install_locations = read_packages(layers, package_managers, file_path)
     for install_location in install_locations:
         for package in install_location.packages:
             package.version = install_location.package_manager.parse_version_string(package.name, package.version_str)
 
-    with tempfile.TemporaryDirectory(prefix='unold_') as dir_tmp_str:
-        dir_tmp_path = Path(dir_tmp_str)
-        for install_location in install_locations:
-            if not check_install_location(install_location, container_manager, containerfile_contents, dir_tmp_path):
+    stages = parse_stages(layers)
+    if context.since is not None:
+        with span(context.tracer, 'select_changed_install_locations'):
+            install_locations = await select_changed_install_locations(
+                file_path, layers, stages, install_locations, context.since, context
+            )
+    groups = plan_queries(layers, install_locations)
+    group_results = await asyncio.gather(
+        *[query_group(group, containerfile_contents, stages, context) for group in groups],
+        return_exceptions=True,
+    )
+    increment(context.metrics, 'install_locations_checked', len(install_locations))
+    increment(context.metrics, 'query_failures', sum(isinstance(result, BaseException) for result in group_results))
+
+    # Every install location gets the versions of its whole group
+    results = {
+        id(install_location): group_result
+        for group, group_result in zip(groups, group_results, strict=True)
+        for install_location in group.install_locations
+    }
+    return [(install_location, results[id(install_location)]) for install_location in install_locations]
+
+
+async def select_changed_install_locations(
+    file_path: Path,
+    layers: Sequence[dockerfile.Command],
+    stages: Sequence[Stage],
+    install_locations: Sequence[InstallLocation],
+    revision: str,
+    context: QueryContext,
+) -> list[InstallLocation]:
+    """Select the install locations whose instruction, or a line that their query image uses, changed since revision"""
+    changed_lines = await find_changed_lines_of_file(file_path, revision, context)
+    end_lines = {layer.start_line - 1: layer.end_line for layer in layers}
+    selected = []
+    for install_location in install_locations:
+        start_line = install_location.containerfile_start_line
+        line_ranges = [*select_stage_line_ranges(stages, start_line), (start_line, end_lines[start_line])]
+        if any(
+            start < end_changed and start_changed < end
+            for start, end in line_ranges
+            for start_changed, end_changed in changed_lines
+        ):
+            selected.append(install_location)
+    return selected
+
+
+async def find_changed_lines_of_file(file_path: Path, revision: str, context: QueryContext) -> list[tuple[int, int]]:
+    repository = find_repository(file_path)
+    if repository is None:
+        msg = f"File '{file_path}' is not in a git repository"
+        raise RuntimeError(msg)
+
+    async def find() -> ChangedLines:
+        async with context.semaphore:
+            return await find_changed_lines(repository, revision)
+
+    # One diff per repository, instead of processes per file
+    changed_lines = await await_shared(context.changed_lines, str(repository), find)
+    return changed_lines.get(file_path.resolve().relative_to(repository).as_posix())
+
+
+def report_file(
+    results: Sequence[tuple[InstallLocation, dict[str, Version] | BaseException]],
+    tracer: Tracer | None = None,
+    metrics: Metrics | None = None,
+) -> bool:
+    success = True
+
+    # Report in install location order, just as if the queries were run one at a time
+    for install_location, result in results:
+        if isinstance(result, BaseException):
+            if isinstance(result, subprocess.CalledProcessError) and result.stderr:
+                print(result.stderr, file=sys.stderr)
+            raise result
+        with span(
+            tracer,
+            'compare_versions',
+            file=str(install_location.containerfile_path),
+            line=install_location.containerfile_start_line + 1,
+        ):
+            if not compare_versions(install_location, result, metrics):
                 success = False
 
     return success
@@ -103,82 +559,351 @@ def read_packages(
     file_path: Path,
 ) -> list[InstallLocation]:
     install_locations: list[InstallLocation] = []
+    package_manager_index = PackageManagerIndex(package_managers)
     for layer in layers:
         if layer.cmd.casefold() == 'run'.casefold():
-            for package_manager in package_managers:
-                command = shlex.split(layer.value[0])
-                parse_install_package_results = package_manager.parse_install_package(command)
-                install_locations.extend(
-                    InstallLocation(
-                        result.packages,
-                        file_path,
-                        layer.start_line - 1,
-                        package_manager,
-                        result.forwarded_args,
-                        result.command_prefix,
-                    )
-                    for result in parse_install_package_results
+            install_locations.extend(
+                InstallLocation(
+                    result.packages,
+                    file_path,
+                    layer.start_line - 1,
+                    package_manager,
+                    result.forwarded_args,
+                    result.command_prefix,
+                )
+                for package_manager, result in package_manager_index.parse_install_package(
+                    split_shell_words(layer.value[0])
                 )
+            )
     return install_locations
 
 
-def check_install_location(
-    install_location: InstallLocation, container_manager: str, containerfile_contents: str, dir_path: Path
-) -> bool:
-    package_names = [package.name for package in install_location.packages]
-    package_str = install_location.package_manager.create_query_versions_command(
-        package_names, install_location.argument_forwards
-    )
-    version_query_containerfile = generate_containerfile_contents(
+async def query_group(
+    group: QueryGroup, containerfile_contents: str, stages: Sequence[Stage], context: QueryContext
+) -> dict[str, Version]:
+    install_location = group.install_locations[0]
+    # Shared builds and queries are tagged with the line of the query that started them
+    tag(context.tracer, line=install_location.containerfile_start_line + 1)
+    stage = find_stage(stages, install_location.containerfile_start_line)
+    base_image = None if stage is None else find_base_image(stages, stage)
+
+    if stage is not None and base_image is not None:
+        preceding_instructions = [
+            layer.original
+            for chain_stage in find_stage_chain(stages, stage)
+            for layer in chain_stage.layers[1:]
+            if layer.start_line - 1 < install_location.containerfile_start_line
+        ]
+        if install_location.command_prefix:
+            preceding_instructions.append(install_location.command_prefix)
+        packages_and_versions = install_location.package_manager.query_versions_offline(
+            group.package_names, install_location.argument_forwards, base_image, preceding_instructions
+        )
+        if packages_and_versions is not None:
+            increment(context.metrics, 'query_builds_avoided', reason='apk_index')
+            return packages_and_versions
+
+    package_manager = install_location.package_manager
+    query_image_containerfile = generate_containerfile_contents(
         containerfile_contents,
-        package_str,
+        package_manager.create_update_index_command(),
         install_location.containerfile_start_line,
         install_location.command_prefix,
+        instruction='RUN',
+        stages=stages,
+        cache_bust=context.cache_bust,
+        cache_dir=package_manager.cache_dir if context.cache_mounts else None,
+    )
+    # Sorted, so that the same packages in another order result in the same query
+    list_command = package_manager.create_list_versions_command(
+        sorted(group.package_names), install_location.argument_forwards
+    )
+
+    build_context = BuildContext(
+        (context.build_context or install_location.containerfile_path.parent).absolute(),
+        () if stage is None else tuple(find_context_sources(stages, stage, install_location.containerfile_start_line)),
+    )
+    # Images of the stages that the query image needs, which are only pulled if it's built
+    external_images = (
+        []
+        if stage is None
+        else find_external_images(
+            stages, find_stage_dependencies(stages, stage, install_location.containerfile_start_line)
+        )
+    )
+    # The same containerfile copying files from different directories results in different images
+    query_image_key = query_image_containerfile
+    if build_context.sources:
+        query_image_key += f'\0{build_context.source_dir}'
+
+    # Identical queries, within a file or across files, are only run once
+    query_hash = generate_query_hash(f'{query_image_key}\0{list_command}')
+    if query_hash in context.queries:
+        increment(context.metrics, 'query_builds_avoided', reason='shared_query')
+    return await await_shared(
+        context.queries,
+        query_hash,
+        lambda: run_query(
+            query_image_containerfile,
+            query_image_key,
+            build_context,
+            list_command,
+            base_image,
+            external_images,
+            package_manager,
+            context,
+        ),
     )
 
-    image_name = generate_image_name(version_query_containerfile)
 
-    build_image(container_manager, version_query_containerfile, dir_path, image_name)
-    results = run_container_from_image(container_manager, image_name)
+async def run_query(
+    query_image_containerfile: str,
+    query_image_key: str,
+    build_context: BuildContext,
+    list_command: str,
+    base_image: str | None,
+    external_images: Sequence[str],
+    package_manager: PackageManager,
+    context: QueryContext,
+) -> dict[str, Version]:
+    # Only cache results of queries that are based on an image with a known digest
+    cache_key = None
+    if context.cache is not None and base_image is not None:
+        base_image_digest = await resolve_image_digest(base_image, context)
+        cache_key = ResultCache.create_key(base_image_digest, f'{query_image_key}\0{list_command}')
+        version_strings = context.cache.get(cache_key)
+        if version_strings is not None:
+            increment(context.metrics, 'query_builds_avoided', reason='result_cache')
+            with span(context.tracer, 'parse_versions'):
+                return parse_versions(version_strings, package_manager)
+
+    # All queries with the same prefix share one image, in which the package index is already updated
+    image_hash = generate_query_hash(query_image_key)
+    if image_hash in context.images:
+        increment(context.metrics, 'query_builds_avoided', reason='shared_image')
+    image_name = await await_shared(
+        context.images,
+        image_hash,
+        lambda: build_query_image(
+            query_image_containerfile, query_image_key, build_context, base_image, external_images, context
+        ),
+    )
+
+    if context.query_mode == 'export':
+        results = await export_query_output(image_name, list_command, context)
+    elif context.query_mode == 'exec':
+        container = await await_shared(
+            context.containers,
+            image_name,
+            lambda: QueryContainer.start(context.container_manager, image_name, context.semaphore),
+        )
+        # Including the wait for the other queries of the batch
+        with span(context.tracer, 'exec', image=image_name), time_histogram(context.metrics, 'run_duration_seconds'):
+            results = await container.exec(list_command)
+    else:
+        async with context.semaphore:
+            with (
+                span(context.tracer, 'run_container_from_image', image=image_name),
+                time_histogram(context.metrics, 'run_duration_seconds'),
+            ):
+                results = await run_container_from_image(context.container_manager, image_name, list_command)
     version_strings = results.splitlines()
-    packages_and_versions = parse_versions(version_strings, install_location.package_manager)
-    return compare_versions(install_location, packages_and_versions)
 
+    if context.cache is not None and cache_key is not None:
+        context.cache.put(cache_key, version_strings)
+
+    with span(context.tracer, 'parse_versions'):
+        return parse_versions(version_strings, package_manager)
+
+
+async def build_query_image(
+    query_image_containerfile: str,
+    query_image_key: str,
+    build_context: BuildContext,
+    base_image: str | None,
+    external_images: Sequence[str],
+    context: QueryContext,
+) -> str:
+    image_name = generate_image_name(query_image_key)
+    labels = {OWNER_LABEL: '', QUERY_LABEL: generate_query_hash(query_image_key), CREATED_LABEL: str(int(time.time()))}
+
+    # Reuse the image of an earlier run, unless the base image has been updated since
+    if context.image_store is not None:
+        if base_image is not None:
+            labels[BASE_IMAGE_DIGEST_LABEL] = await resolve_image_digest(base_image, context)
+        stored_images = await await_shared(context.stored_images, OWNER_LABEL, lambda: list_stored_images(context))
+        image = stored_images.get(image_name)
+        if image is not None and is_reusable(image, labels):
+            increment(context.metrics, 'query_builds_avoided', reason='stored_image')
+            context.image_store.touch(image_name)
+            return image_name
+
+    # Pull the images of all builds concurrently, instead of one at a time during the builds
+    await prefetch_images(external_images, context)
+    async with context.semaphore:
+        with (
+            span(context.tracer, 'build_image', image=image_name),
+            time_histogram(context.metrics, 'build_duration_seconds'),
+        ):
+            await build_image(
+                context.container_manager,
+                query_image_containerfile,
+                context.dir_path,
+                image_name,
+                build_context=build_context,
+                labels=labels,
+            )
+    increment(context.metrics, 'query_builds')
+    if context.image_store is not None:
+        context.image_store.touch(image_name)
+    return image_name
+
+
+async def list_stored_images(context: QueryContext) -> dict[str, ImageInfo]:
+    async with context.semaphore:
+        images = await context.container_manager.list_images(OWNER_LABEL)
+    return {name: image for image in images for name in image.names}
+
+
+async def export_query_output(image_name: str, command: str, context: QueryContext) -> str:
+    """Write the output of a command to a file during a build and export it, without starting a container"""
+    export_containerfile = generate_export_containerfile_contents(image_name, command)
+    export_name = generate_image_name(export_containerfile)
+    output_dir = context.dir_path / f'{export_name}_output'
+    async with context.semaphore:
+        with (
+            span(context.tracer, 'build_image', image=image_name, export=export_name),
+            time_histogram(context.metrics, 'run_duration_seconds'),
+        ):
+            await build_image(
+                context.container_manager, export_containerfile, context.dir_path, export_name, output_dir=output_dir
+            )
+    return (output_dir / QUERY_OUTPUT_FILE_NAME).read_text(encoding='utf-8').strip()
 
-def generate_containerfile_contents(input_: str, package_str: str, break_line: int, command_prefix: str) -> str:
-    lines = input_.splitlines()
-    lines = lines[:break_line]
 
-    line = 'CMD '
+async def await_shared(
+    futures: dict[str, asyncio.Future[T]], key: str, create: Callable[[], Coroutine[Any, Any, T]]
+) -> T:
+    """Await a job that is shared by all callers with the same key, and start it if it's the first"""
+    try:
+        future = futures[key]
+    except KeyError:
+        future = asyncio.ensure_future(create())
+        futures[key] = future
+
+    # Shield the shared job so that one cancelled waiter doesn't cancel it for all
+    return await asyncio.shield(future)
+
+
+async def prefetch_images(images: Sequence[str], context: QueryContext) -> None:
+    # Failures are left for the builds to report
+    await asyncio.gather(*[resolve_image_digest(image, context) for image in images], return_exceptions=True)
+
+
+async def resolve_image_digest(image: str, context: QueryContext) -> str:
+    """Get the digest of an image, which is pulled if it's not available yet"""
+    semaphore = context.semaphore if context.pull_semaphore is None else context.pull_semaphore
+    return await await_shared(
+        context.image_digests,
+        image,
+        lambda: inspect_image_digest(context.container_manager, image, semaphore),
+    )
+
+
+async def inspect_image_digest(container_manager: ContainerManager, image: str, semaphore: asyncio.Semaphore) -> str:
+    async with semaphore:
+        return await container_manager.resolve_image_id(image)
+
+
+def generate_containerfile_contents(
+    input_: str,
+    package_str: str,
+    break_line: int,
+    command_prefix: str,
+    instruction: str = 'CMD',
+    stages: Sequence[Stage] | None = None,
+    cache_bust: str | None = None,
+    cache_dir: str | None = None,
+) -> str:
+    lines = input_.splitlines()
+    # With the stages, only those that the break line depends on are built
+    lines = lines[:break_line] if stages is None else select_stage_lines(lines, stages, break_line)
+
+    if cache_bust is None and cache_dir is None:
+        line = f'{instruction} '
+        if command_prefix:
+            line += f'{command_prefix} && '
+        line += package_str
+        lines.append(line)
+        return '\n'.join(lines) + '\n'
+
+    # Layers up to the command prefix are reused from earlier builds, and the last layer until the cache bust value
+    # changes, since ARG values affect the cache of later RUN instructions
     if command_prefix:
-        line += f'{command_prefix} && '
-    line += package_str
-    lines.append(line)
+        lines.append(f'RUN {command_prefix}')
+    if cache_bust is not None:
+        lines.append(f'ARG {CACHE_BUST_ARG}={cache_bust}')
+    lines.extend(generate_cached_commands(package_str, cache_dir, instruction))
     return '\n'.join(lines) + '\n'
 
 
-def generate_image_name(str_: str) -> str:
-    # Famous last words: 16^8 = 2^32 bits hash should be sufficient
-    hash_ = hashlib.sha1(str_.encode()).hexdigest()[:8]
-    return f'unold_{hash_}'
+def generate_cached_commands(command: str, cache_dir: str | None, instruction: str = 'RUN') -> list[str]:
+    """Run a command with a cache mount that all builds share. The cache directory stays in the image."""
+    if cache_dir is None:
+        return [f'{instruction} {command}']
+    # Whatever is written to the mount isn't in the layer, so copy it and swap it in after the mount is gone
+    cache_dir_copy = f'{cache_dir}.unold'
+    return [
+        f'{instruction} --mount=type=cache,id=unold{cache_dir},target={cache_dir},sharing=locked '
+        f'{command} && cp -a {cache_dir} {cache_dir_copy}',
+        f'{instruction} rm -rf {cache_dir} && mv {cache_dir_copy} {cache_dir}',
+    ]
+
+
+def generate_cache_bust(interval: float, now: float | None = None) -> str:
+    """Get a value that changes every interval seconds"""
+    if now is None:
+        now = time.time()
+    if interval <= 0:
+        return str(now)
+    return str(int(now // interval))
+
+
+def generate_export_containerfile_contents(image_name: str, command: str) -> str:
+    # Only the output file ends up in the final stage, so only it is exported
+    return (
+        f'FROM {image_name} AS query\n'
+        f'RUN {command} > /{QUERY_OUTPUT_FILE_NAME}\n'
+        'FROM scratch\n'
+        f'COPY --from=query /{QUERY_OUTPUT_FILE_NAME} /{QUERY_OUTPUT_FILE_NAME}\n'
+    )
+
 
+def generate_query_hash(str_: str) -> str:
+    return hashlib.sha1(str_.encode()).hexdigest()
 
-def build_image(container_manager: str, containerfile_contents: str, dir_: Path, image_name: str) -> None:
+
+def generate_image_name(str_: str) -> str:
+    return f'unold_{generate_query_hash(str_)}'
+
+
+async def build_image(
+    container_manager: ContainerManager,
+    containerfile_contents: str,
+    dir_: Path,
+    image_name: str,
+    output_dir: Path | None = None,
+    build_context: BuildContext | None = None,
+    labels: Mapping[str, str] | None = None,
+) -> None:
     file_path = Path(dir_ / image_name)
     file_path.write_text(containerfile_contents, encoding='utf-8')
-    try:
-        subprocess.check_output(
-            [container_manager, 'build', '-f', str(file_path), '-t', image_name, '-q'],
-            text=True,
-            stderr=subprocess.PIPE,
-        )
-    except subprocess.CalledProcessError as exc:
-        print(exc.stderr, file=sys.stderr)
-        raise
+    # Pass only the files that the build uses, instead of whatever directory the container manager defaults to
+    await container_manager.build_image(file_path, build_context or BuildContext(dir_), image_name, output_dir, labels)
 
 
-def run_container_from_image(container_manager: str, image_name: str) -> str:
-    return subprocess.check_output([container_manager, 'run', image_name], text=True).strip()
+async def run_container_from_image(container_manager: ContainerManager, image_name: str, command: str) -> str:
+    return (await container_manager.run(image_name, command)).strip()
 
 
 def parse_versions(version_strings: Sequence[str], package_manager: PackageManager) -> dict[str, Version]:
@@ -194,9 +919,18 @@ def parse_versions(version_strings: Sequence[str], package_manager: PackageManag
 def compare_versions(
     install_location: InstallLocation,
     packages_and_versions: dict[str, Version],
+    metrics: Metrics | None = None,
 ) -> bool:
     success = True
 
+    # Compared in one pass, in the order of the packages that have a newest version
+    comparisons = iter(
+        compare_all(
+            (package.version, packages_and_versions[package.name])
+            for package in install_location.packages
+            if package.name in packages_and_versions
+        )
+    )
     for package in install_location.packages:
         try:
             version_newest = packages_and_versions[package.name]
@@ -208,7 +942,7 @@ def compare_versions(
             )
             success = False
             continue
-        comparison = package.version.compare(version_newest)
+        comparison = next(comparisons)
         if (
             package.conditional in {VersionConditional.EQUALITY, VersionConditional.FUZZY}
             and comparison != VersionComparison.EQUAL
@@ -219,10 +953,13 @@ def compare_versions(
                 f"not up to date. The latest version is '{version_newest.source}'.",
                 file=sys.stderr,
             )
+            increment(metrics, 'outdated_packages')
             success = False
 
     return success
 
 
+SUBCOMMANDS = {'index': main_index, 'gc': main_gc}
+
 if __name__ == '__main__':
     sys.exit(main())
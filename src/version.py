@@ -2,6 +2,10 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from enum import Enum, auto
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
 
 
 class VersionComparison(Enum):
@@ -19,33 +23,42 @@ class VersionConditional(Enum):
     FUZZY = auto()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Version:
     source: str
     package_name: str
-    major: int | None = None
-    minor: int | None = None
-    patch: int | None = None
-    revision: int | None = None
+    # Tokens that order versions when comparing keys, precomputed by the package manager. The last one marks the end of
+    # the version, since what follows a version may make it newer or older.
+    key: tuple[tuple[int, int], ...]
 
     def compare(self, other: Version) -> VersionComparison:
-        tup_mine: tuple = ()
-        tup_other: tuple = ()
-        for element_mine, element_other in zip(
-            (self.major, self.minor, self.patch, self.revision),
-            (other.major, other.minor, other.patch, other.revision),
-            strict=True,
-        ):
-            if element_mine is None or element_other is None:
-                break
-
-            tup_mine += (element_mine,)
-            tup_other += (element_other,)
-
-        if not tup_mine or not tup_other:
-            return VersionComparison.UNCOMPARABLE
-        if tup_mine < tup_other:
-            return VersionComparison.LESS_THAN_OTHER
-        if tup_mine == tup_other:
-            return VersionComparison.EQUAL
-        return VersionComparison.GREATER_THAN_OTHER
+        """Compare the tokens that both versions have, so that a version like 2.43 equals 2.43.0-r1"""
+        return _compare_prefixes(self.key, other.key)
+
+
+def compare_all(versions: Iterable[tuple[Version, Version]]) -> list[VersionComparison]:
+    """Compare pairs of versions, such as those of all packages of an install location with the newest versions"""
+    return [_compare_prefixes(version.key, version_other.key) for version, version_other in versions]
+
+
+def select_newest(versions: Iterable[Version]) -> dict[str, Version]:
+    """Select the newest version of each package, such as from all versions of a package index"""
+    newest: dict[str, Version] = {}
+    for version in versions:
+        version_other = newest.get(version.package_name)
+        if version_other is None or version.key > version_other.key:
+            newest[version.package_name] = version
+    return newest
+
+
+def _compare_prefixes(key: tuple[tuple[int, int], ...], key_other: tuple[tuple[int, int], ...]) -> VersionComparison:
+    # Without the end tokens
+    length = min(len(key), len(key_other)) - 1
+    if length <= 0:
+        return VersionComparison.UNCOMPARABLE
+    prefix, prefix_other = key[:length], key_other[:length]
+    if prefix < prefix_other:
+        return VersionComparison.LESS_THAN_OTHER
+    if prefix == prefix_other:
+        return VersionComparison.EQUAL
+    return VersionComparison.GREATER_THAN_OTHER
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import io
+import subprocess
+import tarfile
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from pathlib import Path
+
+APKINDEX_MAIN = """\
+C:Q1abc=
+P:git
+V:2.45.2-r0
+A:x86_64
+S:1
+
+P:musl
+V:1.2.5-r0
+A:x86_64
+"""
+
+APKINDEX_COMMUNITY = """\
+P:git
+V:2.43.0-r0
+
+P:ripgrep
+V:14.1.1-r0
+"""
+
+
+def _write_apk_index(path: Path, contents: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in (('DESCRIPTION', b'v3.20.3\n'), ('APKINDEX', contents.encode())):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def index_dir(tmp_path: Path) -> Path:
+    _write_apk_index(tmp_path / 'v3.20' / 'main' / 'x86_64' / 'APKINDEX.tar.gz', APKINDEX_MAIN)
+    _write_apk_index(tmp_path / 'v3.20' / 'community' / 'x86_64' / 'APKINDEX.tar.gz', APKINDEX_COMMUNITY)
+    return tmp_path
+
+
+@pytest.fixture
+def git() -> Callable[..., None]:
+    """Get a function that runs git in a directory, with a committer identity"""
+
+    def run(dir_path: Path, *args: str) -> None:
+        subprocess.run(
+            ['git', '-c', 'user.name=unold', '-c', 'user.email=unold@example.com', *args],
+            cwd=dir_path,
+            check=True,
+            capture_output=True,
+        )
+
+    return run
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import os
+from contextlib import redirect_stderr
+from io import StringIO
+from typing import TYPE_CHECKING
+
+import pytest
+
+from apk_index import ApkIndex, compiled_index_path, is_compiled_index_up_to_date, parse_apk_index, read_apk_index
+from package_index import FORMAT_VERSION, MAGIC, PackageIndex
+from package_manager_apk import PackageManagerApk
+from unold import main
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_parse_apk_index() -> None:
+    lines = ['C:Q1abc=\n', 'P:git\n', 'V:2.45.2-r0\n', 'A:x86_64\n', '\n', 'P:musl\n', 'V:1.2.5-r0']
+    assert list(parse_apk_index(lines)) == [
+        ('git', '2.45.2-r0'),
+        ('musl', '1.2.5-r0'),
+    ]
+
+
+def test_read_apk_index(index_dir: Path) -> None:
+    assert list(read_apk_index(index_dir / 'v3.20' / 'community' / 'x86_64' / 'APKINDEX.tar.gz')) == [
+        ('git', '2.43.0-r0'),
+        ('ripgrep', '14.1.1-r0'),
+    ]
+
+
+def test_find_index_paths(index_dir: Path) -> None:
+    index = ApkIndex(index_dir, 'x86_64')
+    assert index.find_index_paths('alpine:3.20') is not None
+    assert index.find_index_paths('alpine:3.20.3') is not None
+    assert index.find_index_paths('docker.io/library/alpine:3.20') is not None
+    assert index.find_index_paths('alpine:3.19') is None
+    assert index.find_index_paths('alpine') is None
+    assert index.find_index_paths('python:3.12-alpine3.20') is None
+    assert ApkIndex(index_dir, 'aarch64').find_index_paths('alpine:3.20') is None
+
+
+def test_query_versions(index_dir: Path) -> None:
+    pkg_man = PackageManagerApk(ApkIndex(index_dir, 'x86_64'))
+
+    packages_and_versions = pkg_man.query_versions_offline(['git', 'ripgrep', 'nginx'], [], 'alpine:3.20', [])
+    assert packages_and_versions is not None
+    assert {package_name: version.source for package_name, version in packages_and_versions.items()} == {
+        'git': '2.45.2-r0',
+        'ripgrep': '14.1.1-r0',
+    }
+
+
+def test_query_versions_unknown_repositories(index_dir: Path) -> None:
+    pkg_man = PackageManagerApk(ApkIndex(index_dir, 'x86_64'))
+
+    assert pkg_man.query_versions_offline(['git'], [], 'alpine:3.19', []) is None
+    assert pkg_man.query_versions_offline(['git'], ['-X', 'https://example.com'], 'alpine:3.20', []) is None
+    assert (
+        pkg_man.query_versions_offline(
+            ['git'], [], 'alpine:3.20', ['RUN echo https://example.com >> /etc/apk/repositories']
+        )
+        is None
+    )
+    assert pkg_man.query_versions_offline(['git'], [], 'alpine:3.20', ['COPY rootfs /']) is None
+    assert pkg_man.query_versions_offline(['git'], [], 'alpine:3.20', ['COPY app /app']) is not None
+    assert PackageManagerApk().query_versions_offline(['git'], [], 'alpine:3.20', []) is None
+
+
+def test_compiled_index(index_dir: Path) -> None:
+    index_path = index_dir / 'v3.20' / 'community' / 'x86_64' / 'APKINDEX.tar.gz'
+    assert not is_compiled_index_up_to_date(index_path)
+
+    assert main(['index', str(index_dir)]) == 0
+    assert is_compiled_index_up_to_date(index_path)
+    assert PackageIndex(compiled_index_path(index_path)).get('ripgrep') == '14.1.1-r0'
+
+    # Lookups give the same result as with the archives
+    pkg_man = PackageManagerApk(ApkIndex(index_dir, 'x86_64'))
+    packages_and_versions = pkg_man.query_versions_offline(['git', 'ripgrep', 'nginx'], [], 'alpine:3.20', [])
+    assert packages_and_versions is not None
+    assert {package_name: version.source for package_name, version in packages_and_versions.items()} == {
+        'git': '2.45.2-r0',
+        'ripgrep': '14.1.1-r0',
+    }
+
+
+def test_compiled_index_outdated(index_dir: Path) -> None:
+    index_path = index_dir / 'v3.20' / 'community' / 'x86_64' / 'APKINDEX.tar.gz'
+    assert main(['index', str(index_dir)]) == 0
+
+    # As if the archive was downloaded after it was compiled
+    index_mtime = index_path.stat().st_mtime
+    os.utime(compiled_index_path(index_path), (index_mtime - 1, index_mtime - 1))
+    assert not is_compiled_index_up_to_date(index_path)
+
+    assert main(['index', str(index_dir)]) == 0
+    assert is_compiled_index_up_to_date(index_path)
+
+
+@pytest.mark.parametrize('corruption', ['format_version', 'truncated'])
+def test_compiled_index_unreadable(index_dir: Path, corruption: str) -> None:
+    index_path = index_dir / 'v3.20' / 'community' / 'x86_64' / 'APKINDEX.tar.gz'
+    assert main(['index', str(index_dir)]) == 0
+
+    compiled_path = compiled_index_path(index_path)
+    contents = compiled_path.read_bytes()
+    if corruption == 'format_version':
+        # As if it was compiled by another version
+        compiled_path.write_bytes(MAGIC + (FORMAT_VERSION + 1).to_bytes(4, 'little') + contents[12:])
+    else:
+        compiled_path.write_bytes(contents[:-1])
+    assert not is_compiled_index_up_to_date(index_path)
+
+    # The archive is used instead
+    pkg_man = PackageManagerApk(ApkIndex(index_dir, 'x86_64'))
+    packages_and_versions = pkg_man.query_versions_offline(['git', 'ripgrep'], [], 'alpine:3.20', [])
+    assert packages_and_versions is not None
+    assert {package_name: version.source for package_name, version in packages_and_versions.items()} == {
+        'git': '2.45.2-r0',
+        'ripgrep': '14.1.1-r0',
+    }
+
+    assert main(['index', str(index_dir)]) == 0
+    assert is_compiled_index_up_to_date(index_path)
+
+
+def test_compile_nothing(tmp_path: Path) -> None:
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert main(['index', str(tmp_path)]) == 1
+    assert stderr.getvalue() == f"No APKINDEX.tar.gz archives found in '{tmp_path}'\n"
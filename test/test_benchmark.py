@@ -0,0 +1,45 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent / 'tools'
+BENCHMARK = TOOLS_DIR / 'benchmark.py'
+
+
+@pytest.mark.parametrize('query_mode', ['run', 'exec', 'export'])
+def test_benchmark(query_mode: str) -> None:
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            str(BENCHMARK),
+            '--files',
+            '2',
+            '--install-locations',
+            '2',
+            '--unique-images',
+            '--failure-rate',
+            '0.2',
+            '--query-mode',
+            query_mode,
+            '--repeat',
+            '1',
+            '--no-results',
+        ],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    result = json.loads(output)
+    assert result['params']['files'] == 2
+    assert result['params']['query_mode'] == query_mode
+    assert len(result['durations']) == 1
+
+
+def test_benchmark_apk_parser() -> None:
+    output = subprocess.check_output(
+        [sys.executable, str(TOOLS_DIR / 'benchmark_apk_parser.py'), '--files', '10', '--repeat', '1'], text=True
+    )
+    assert output.startswith('218 apk subcommands, 0 mismatches\n')
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import errno
+import io
+import os
+import tarfile
+from typing import TYPE_CHECKING
+
+import pytest
+
+from build_context import BuildContext
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+@pytest.fixture
+def source_dir(tmp_path: Path) -> Path:
+    source_dir = tmp_path / 'source'
+    for relative_path in ('a.txt', 'b.txt', 'c.conf', 'dir/d.txt', 'dir/sub/e.txt', 'unused/f.txt', '.dockerignore'):
+        path = source_dir / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(relative_path, encoding='utf-8')
+    (source_dir / 'dir' / 'link').symlink_to('d.txt')
+    return source_dir
+
+
+def list_files(dir_path: Path) -> list[str]:
+    return sorted(str(path.relative_to(dir_path)) for path in dir_path.rglob('*') if not path.is_dir())
+
+
+def test_only_sources(source_dir: Path, tmp_path: Path) -> None:
+    context_dir = BuildContext(source_dir, ('/a.txt', './dir/', '*.conf', 'missing', '../outside')).create(
+        tmp_path / 'context'
+    )
+
+    assert context_dir == tmp_path / 'context'
+    assert list_files(context_dir) == ['.dockerignore', 'a.txt', 'c.conf', 'dir/d.txt', 'dir/link', 'dir/sub/e.txt']
+    # Files are linked instead of copied
+    assert (context_dir / 'a.txt').stat().st_ino == (source_dir / 'a.txt').stat().st_ino
+    assert (context_dir / 'dir' / 'link').is_symlink()
+
+
+def test_whole_directory(source_dir: Path, tmp_path: Path) -> None:
+    assert BuildContext(source_dir, ('a.txt', './')).create(tmp_path / 'context') == source_dir
+    assert BuildContext(source_dir, ('/',)).create(tmp_path / 'context') == source_dir
+    assert not (tmp_path / 'context').exists()
+
+
+def test_link_failure(source_dir: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def link(_source: Path, _target: Path, *, follow_symlinks: bool) -> None:  # noqa: ARG001
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    # Instead of copying the files, e.g. from another file system
+    monkeypatch.setattr(os, 'link', link)
+    assert BuildContext(source_dir, ('a.txt', 'dir')).create(tmp_path / 'context') == source_dir
+    assert not (tmp_path / 'context').exists()
+
+
+def test_no_sources(source_dir: Path, tmp_path: Path) -> None:
+    context_dir = BuildContext(source_dir).create(tmp_path / 'context')
+    assert list_files(context_dir) == ['.dockerignore']
+
+
+def test_unresolved_variable(source_dir: Path, tmp_path: Path) -> None:
+    assert BuildContext(source_dir, ('a.txt', '$FILE')).create(tmp_path / 'context') == source_dir
+    assert not (tmp_path / 'context').exists()
+
+
+def list_archive(build_context: BuildContext) -> list[str]:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        build_context.add_to_archive(tar)
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tar:
+        return sorted(member.name for member in tar if not member.isdir())
+
+
+def test_archive_only_sources(source_dir: Path) -> None:
+    assert list_archive(BuildContext(source_dir, ('/a.txt', './dir/', '*.conf', 'dir/d.txt', 'missing'))) == [
+        'a.txt',
+        'c.conf',
+        'dir/d.txt',
+        'dir/link',
+        'dir/sub/e.txt',
+    ]
+    assert list_archive(BuildContext(source_dir)) == []
+
+
+def test_archive_ignored(source_dir: Path) -> None:
+    (source_dir / '.git' / 'objects').mkdir(parents=True)
+    (source_dir / '.git' / 'objects' / 'pack').write_text('pack', encoding='utf-8')
+    (source_dir / '.dockerignore').write_text('# Comment\n/.git\nunused\n**/*.txt\n!dir/sub/e.txt\n', encoding='utf-8')
+
+    # The whole directory is only sent without the excluded files
+    assert list_archive(BuildContext(source_dir, ('.',))) == ['.dockerignore', 'c.conf', 'dir/link', 'dir/sub/e.txt']
+    assert list_archive(BuildContext(source_dir, ('dir', 'unused/f.txt'))) == ['dir/link', 'dir/sub/e.txt']
+
+    # Podman prefers .containerignore
+    (source_dir / '.containerignore').write_text('dir/[!l]*\n', encoding='utf-8')
+    assert list_archive(BuildContext(source_dir, ('$FILE',))) == [
+        '.containerignore',
+        '.dockerignore',
+        '.git/objects/pack',
+        'a.txt',
+        'b.txt',
+        'c.conf',
+        'dir/link',
+        'unused/f.txt',
+    ]
@@ -0,0 +1,606 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import subprocess
+from contextlib import redirect_stderr
+from io import StringIO
+from typing import TYPE_CHECKING
+
+import pytest
+
+import async_subprocess
+import container_manager_cli
+import git_diff
+import unold
+from apk_index import ApkIndex
+from container_manager import ImageInfo
+from container_manager_cli import ContainerManagerCli
+from image_store import BASE_IMAGE_DIGEST_LABEL, ImageStore
+from metrics import Metrics
+from query_context import QueryContext
+from result_cache import ResultCache
+from trace_events import Tracer
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Mapping, Sequence
+    from pathlib import Path
+
+    from build_context import BuildContext
+    from container_manager import ContainerManager
+
+# Every install location is in its own stage to get one query each
+CONTAINERFILE_CONTENTS = """FROM alpine:3.20
+RUN apk add --no-cache git==2.43.0-r0
+FROM alpine:3.20
+RUN apk add --no-cache nginx==1.26.1-r0
+FROM alpine:3.20
+RUN apk add --no-cache ripgrep==14.1.1-r0
+"""
+
+LATEST_VERSIONS = {
+    'git': 'git-2.45.2-r0 x86_64 {git} (GPL-2.0-only)',
+    'nginx': 'nginx-1.26.2-r0 x86_64 {nginx} (BSD-2-Clause)',
+    'ripgrep': 'ripgrep-14.1.1-r0 x86_64 {ripgrep} (MIT)',
+}
+
+
+@pytest.fixture
+def containerfile(tmp_path: Path) -> Path:
+    path = tmp_path / 'Containerfile'
+    path.write_text(CONTAINERFILE_CONTENTS, encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def fake_engine(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Replace image building and running with a fake where shorter package names finish first. Returns the builds."""
+    builds: list[str] = []
+    pulled: set[str] = set()
+
+    async def build_image(
+        _container_manager: ContainerManager,
+        containerfile_contents: str,
+        _dir: Path,
+        image_name: str,
+        output_dir: Path | None = None,
+        build_context: BuildContext | None = None,  # noqa: ARG001
+        labels: Mapping[str, str] | None = None,  # noqa: ARG001
+    ) -> None:
+        # The base images of a query image are pulled before it's built
+        stage_names: set[str] = set()
+        for line in containerfile_contents.splitlines():
+            if line.startswith('FROM '):
+                base_image, _, stage_name = line.removeprefix('FROM ').partition(' AS ')
+                if base_image not in {*stage_names, 'scratch'} and not base_image.startswith('unold_'):
+                    base_image_regex = re.escape(base_image).replace(re.escape('${ALPINE_VERSION}'), '.+')
+                    assert any(re.fullmatch(base_image_regex, image) for image in pulled)
+                stage_names.add(stage_name)
+        builds.append(image_name)
+        if output_dir is not None:
+            # Export the output of the query, like the RUN instruction of the export containerfile would
+            command = containerfile_contents.splitlines()[1].removeprefix('RUN ').partition(' >')[0]
+            output_dir.mkdir()
+            output = await run_container_from_image(_container_manager, image_name, command)
+            (output_dir / unold.QUERY_OUTPUT_FILE_NAME).write_text(output + '\n', encoding='utf-8')
+
+    async def run_container_from_image(_container_manager: ContainerManager, image_name: str, command: str) -> str:
+        # Skip forwarded arguments such as '--repository https://example.com'
+        package_names = [
+            arg for arg in command.removeprefix('apk list ').split(' ') if not arg.startswith('-') and '/' not in arg
+        ]
+        await asyncio.sleep(0.01 * len(package_names[0]))
+        if 'broken' in package_names:
+            raise subprocess.CalledProcessError(1, ['podman', 'run', image_name], '', 'Error: broken\n')
+        return '\n'.join(LATEST_VERSIONS[package_name] for package_name in package_names)
+
+    async def inspect_image_digest(
+        _container_manager: ContainerManager, image: str, _semaphore: asyncio.Semaphore
+    ) -> str:
+        pulled.add(image)
+        return f'sha256:{image}'
+
+    monkeypatch.setattr(unold, 'build_image', build_image)
+    monkeypatch.setattr(unold, 'run_container_from_image', run_container_from_image)
+    monkeypatch.setattr(unold, 'inspect_image_digest', inspect_image_digest)
+    return builds
+
+
+def create_context(tmp_path: Path, jobs: int) -> QueryContext:
+    return QueryContext(ContainerManagerCli('podman'), tmp_path, asyncio.Semaphore(jobs))
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('fake_engine')
+@pytest.mark.parametrize('jobs', [1, 3])
+async def test_output_order(containerfile: Path, jobs: int) -> None:
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        success = await unold.check_file(containerfile, create_context(containerfile.parent, jobs))
+
+    assert not success
+    assert stderr.getvalue() == (
+        f"Package 'git' with version 2.43.0-r0 starting at line 2 in file '{containerfile}' is not up to date. "
+        "The latest version is '2.45.2-r0'.\n"
+        f"Package 'nginx' with version 1.26.1-r0 starting at line 4 in file '{containerfile}' is not up to date. "
+        "The latest version is '1.26.2-r0'.\n"
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('fake_engine')
+async def test_error_reported_in_order(containerfile: Path) -> None:
+    containerfile.write_text(CONTAINERFILE_CONTENTS.replace('nginx', 'broken'), encoding='utf-8')
+
+    stderr = StringIO()
+    with redirect_stderr(stderr), pytest.raises(subprocess.CalledProcessError):
+        await unold.check_file(containerfile, create_context(containerfile.parent, 3))
+
+    assert stderr.getvalue() == (
+        f"Package 'git' with version 2.43.0-r0 starting at line 2 in file '{containerfile}' is not up to date. "
+        "The latest version is '2.45.2-r0'.\n"
+        'Error: broken\n\n'
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('fake_engine')
+async def test_multiple_files_isolated(containerfile: Path) -> None:
+    file_path_missing = containerfile.parent / 'Missing.Containerfile'
+
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        exit_code = await unold.check_files(
+            [file_path_missing, containerfile, containerfile], create_context(containerfile.parent, 4)
+        )
+
+    assert exit_code == 1
+    report = (
+        f"Package 'git' with version 2.43.0-r0 starting at line 2 in file '{containerfile}' is not up to date. "
+        "The latest version is '2.45.2-r0'.\n"
+        f"Package 'nginx' with version 1.26.1-r0 starting at line 4 in file '{containerfile}' is not up to date. "
+        "The latest version is '1.26.2-r0'.\n"
+    )
+    assert stderr.getvalue() == f"[Errno 2] No such file or directory: '{file_path_missing}'\n" + report + report
+
+
+@pytest.mark.asyncio
+async def test_identical_queries_run_once(containerfile: Path, fake_engine: list[str]) -> None:
+    containerfile.write_text(
+        CONTAINERFILE_CONTENTS + 'FROM alpine:3.20\nRUN apk add git==2.45.2-r0\n', encoding='utf-8'
+    )
+    containerfile_copy = containerfile.parent / 'Copy.Containerfile'
+    containerfile_copy.write_text(CONTAINERFILE_CONTENTS, encoding='utf-8')
+    context = create_context(containerfile.parent, 4)
+
+    with redirect_stderr(StringIO()):
+        assert not await unold.check_file(containerfile, context)
+        assert not await unold.check_file(containerfile_copy, context)
+
+    # The last install location has a different prefix and thus a query of its own
+    assert len(fake_engine) == 4
+    assert len(context.queries) == 4
+
+
+@pytest.mark.asyncio
+async def test_cached_queries_skip_engine(
+    containerfile: Path, fake_engine: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    image_digests = {'alpine:3.20': 'sha256:1'}
+    inspect_image_digest = unold.inspect_image_digest
+
+    async def inspect_image_digest_changed(
+        container_manager: ContainerManager, image: str, semaphore: asyncio.Semaphore
+    ) -> str:
+        await inspect_image_digest(container_manager, image, semaphore)
+        return image_digests[image]
+
+    monkeypatch.setattr(unold, 'inspect_image_digest', inspect_image_digest_changed)
+
+    async def check(cache: ResultCache) -> None:
+        context = create_context(containerfile.parent, 4)
+        context.cache = cache
+        with redirect_stderr(StringIO()):
+            assert not await unold.check_file(containerfile, context)
+
+    cache = ResultCache(containerfile.parent / 'cache', 60)
+    await check(cache)
+    assert len(fake_engine) == 3
+    await check(cache)
+    assert len(fake_engine) == 3
+
+    # A new base image invalidates the results
+    image_digests['alpine:3.20'] = 'sha256:2'
+    await check(cache)
+    assert len(fake_engine) == 6
+
+    await check(ResultCache(containerfile.parent / 'cache', 60, refresh=True))
+    assert len(fake_engine) == 9
+
+
+@pytest.mark.asyncio
+async def test_cached_queries_skip_pulls(
+    containerfile: Path, fake_engine: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    containerfile.write_text(
+        'FROM rust:1.82 AS build\nRUN make\nFROM alpine:3.20\nCOPY --from=build /a /a\nRUN apk add git==2.43.0-r0\n',
+        encoding='utf-8',
+    )
+    inspect_image_digest = unold.inspect_image_digest
+    images: list[str] = []
+
+    async def inspect_image_digest_recorded(
+        container_manager: ContainerManager, image: str, semaphore: asyncio.Semaphore
+    ) -> str:
+        images.append(image)
+        return await inspect_image_digest(container_manager, image, semaphore)
+
+    monkeypatch.setattr(unold, 'inspect_image_digest', inspect_image_digest_recorded)
+
+    cache = ResultCache(containerfile.parent / 'cache', 60)
+    for _ in range(2):
+        context = create_context(containerfile.parent, 4)
+        context.cache = cache
+        with redirect_stderr(StringIO()):
+            assert not await unold.check_file(containerfile, context)
+
+    # Only the base image of the install stage is needed for a cached result
+    assert len(fake_engine) == 1
+    assert sorted(images) == ['alpine:3.20', 'alpine:3.20', 'rust:1.82']
+
+
+@pytest.mark.asyncio
+async def test_apk_index_skips_engine(containerfile: Path, fake_engine: list[str], index_dir: Path) -> None:
+    containerfile.write_text(
+        CONTAINERFILE_CONTENTS + 'FROM alpine:3.20\nRUN apk add --repository=https://example.com nginx==1.26.2-r0\n',
+        encoding='utf-8',
+    )
+    context = create_context(containerfile.parent, 4)
+    context.apk_index = ApkIndex(index_dir, 'x86_64')
+
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert not await unold.check_file(containerfile, context)
+
+    # Only the install location with an extra repository needs a query image
+    assert len(fake_engine) == 1
+    assert stderr.getvalue().startswith(
+        f"Package 'git' with version 2.43.0-r0 starting at line 2 in file '{containerfile}' is not up to date. "
+        "The latest version is '2.45.2-r0'.\n"
+        f"Failed to find version of package 'nginx' starting at line 4 in file '{containerfile}'\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_query_image_shared(tmp_path: Path, fake_engine: list[str]) -> None:
+    file_paths = []
+    for package_name in ('git', 'nginx', 'ripgrep'):
+        file_path = tmp_path / f'{package_name}.Containerfile'
+        file_path.write_text(f'FROM alpine:3.20\nRUN apk add {package_name}==1.0.0-r0\n', encoding='utf-8')
+        file_paths.append(file_path)
+    context = create_context(tmp_path, 4)
+
+    with redirect_stderr(StringIO()):
+        assert await unold.check_files(file_paths, context) == 1
+
+    # Files with the same prefix run their queries in the same image
+    assert len(fake_engine) == 1
+    assert len(context.images) == 1
+    assert len(context.queries) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('fake_engine')
+async def test_base_images_prefetched(tmp_path: Path) -> None:
+    file_paths = []
+    for index, package_name in enumerate(('git', 'nginx', 'ripgrep')):
+        file_path = tmp_path / f'{package_name}.Containerfile'
+        file_path.write_text(
+            f'ARG ALPINE_VERSION=3.2{index}\n'
+            'FROM golang:1.23 AS unused\n'
+            'FROM alpine:${ALPINE_VERSION}\n'
+            f'RUN apk add {package_name}==1.0.0-r0\n',
+            encoding='utf-8',
+        )
+        file_paths.append(file_path)
+    context = create_context(tmp_path, 4)
+
+    with redirect_stderr(StringIO()):
+        assert await unold.check_files(file_paths, context) == 1
+
+    # The digests of the base images are recorded, but images of stages that the queries don't need aren't pulled
+    assert {image: await digest for image, digest in context.image_digests.items()} == {
+        'alpine:3.20': 'sha256:alpine:3.20',
+        'alpine:3.21': 'sha256:alpine:3.21',
+        'alpine:3.22': 'sha256:alpine:3.22',
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('fake_engine')
+async def test_trace(containerfile: Path) -> None:
+    context = create_context(containerfile.parent, 4)
+    context.tracer = Tracer()
+
+    with redirect_stderr(StringIO()):
+        await unold.check_files([containerfile], context)
+    context.tracer.write(containerfile.parent / 'trace.json')
+
+    events = json.loads((containerfile.parent / 'trace.json').read_text(encoding='utf-8'))['traceEvents']
+    assert sorted({event['name'] for event in events}) == [
+        'build_image',
+        'compare_versions',
+        'parse_containerfile_contents',
+        'parse_versions',
+        'read_packages',
+        'run_container_from_image',
+    ]
+    builds = [event['args'] for event in events if event['name'] == 'build_image']
+    assert sorted(build['line'] for build in builds) == [2, 4, 6]
+    assert all(build['file'] == str(containerfile) and build['image'].startswith('unold_') for build in builds)
+
+
+@pytest.mark.asyncio
+async def test_since(containerfile: Path, fake_engine: list[str], git: Callable[..., None]) -> None:
+    git(containerfile.parent, 'init', '-q')
+    git(containerfile.parent, 'add', containerfile.name)
+    git(containerfile.parent, 'commit', '-q', '-m', 'Add Containerfile')
+    containerfile.write_text(CONTAINERFILE_CONTENTS.replace('1.26.1-r0', '1.26.0-r0'), encoding='utf-8')
+    context = create_context(containerfile.parent, 4)
+    context.since = 'HEAD'
+
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert not await unold.check_file(containerfile, context)
+
+    # Only the changed install location is checked
+    assert len(fake_engine) == 1
+    assert stderr.getvalue() == (
+        f"Package 'nginx' with version 1.26.0-r0 starting at line 4 in file '{containerfile}' is not up to date. "
+        "The latest version is '1.26.2-r0'.\n"
+    )
+
+    # A change of the base image of the first stage only affects its install location
+    git(containerfile.parent, 'commit', '-q', '-a', '-m', 'Downgrade nginx')
+    containerfile.write_text(
+        CONTAINERFILE_CONTENTS.replace('1.26.1-r0', '1.26.0-r0').replace('FROM alpine:3.20', 'FROM alpine:3.19', 1),
+        encoding='utf-8',
+    )
+    context = create_context(containerfile.parent, 4)
+    context.since = 'HEAD'
+    with redirect_stderr(StringIO()):
+        assert not await unold.check_file(containerfile, context)
+    assert len(fake_engine) == 2
+
+    # Files that git doesn't track changed completely, even ignored ones
+    ignored_path = containerfile.parent / 'ignored.Containerfile'
+    ignored_path.write_text('FROM alpine:3.20\nRUN apk add git==2.43.0-r0\n', encoding='utf-8')
+    (containerfile.parent / '.gitignore').write_text(f'{ignored_path.name}\n', encoding='utf-8')
+    with redirect_stderr(StringIO()):
+        assert not await unold.check_file(ignored_path, context)
+    assert len(fake_engine) == 3
+
+
+@pytest.mark.asyncio
+async def test_since_many_files(
+    tmp_path: Path, fake_engine: list[str], monkeypatch: pytest.MonkeyPatch, git: Callable[..., None]
+) -> None:
+    file_paths = []
+    for index in range(100):
+        file_path = tmp_path / f'{index % 10}' / f'{index}.Containerfile'
+        file_path.parent.mkdir(exist_ok=True)
+        file_path.write_text('FROM alpine:3.20\nRUN apk add ripgrep==14.1.1-r0\n', encoding='utf-8')
+        file_paths.append(file_path)
+    git(tmp_path, 'init', '-q')
+    git(tmp_path, 'add', '.')
+    git(tmp_path, 'commit', '-q', '-m', 'Add Containerfiles')
+    for file_path in file_paths[::25]:
+        file_path.write_text('FROM alpine:3.20\nRUN apk add git==2.43.0-r0\n', encoding='utf-8')
+
+    git_commands: list[Sequence[str]] = []
+
+    async def exec_async(*args: str) -> str:
+        git_commands.append(args)
+        return await async_subprocess.exec_async(*args)
+
+    monkeypatch.setattr(git_diff, 'exec_async', exec_async)
+    context = create_context(tmp_path, 1)
+    context.since = 'HEAD'
+
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert await unold.check_files(file_paths, context) == 1
+
+    # One diff for the whole repository
+    assert len(git_commands) == 2
+    assert len(fake_engine) == 1
+    assert stderr.getvalue().count("Package 'git' with version 2.43.0-r0") == 4
+
+
+@pytest.mark.asyncio
+async def test_metrics(tmp_path: Path, fake_engine: list[str]) -> None:
+    file_paths: list[Path] = []
+    for package_name in ('git', 'nginx', 'broken', 'git'):
+        file_path = tmp_path / f'{len(file_paths)}.Containerfile'
+        file_path.write_text(f'FROM alpine:3.20\nRUN apk add {package_name}==2.43.0-r0\n', encoding='utf-8')
+        file_paths.append(file_path)
+    context = create_context(tmp_path, 4)
+    context.metrics = Metrics()
+
+    with redirect_stderr(StringIO()):
+        assert await unold.check_files(file_paths, context) == 1
+
+    assert len(fake_engine) == 1
+    assert context.metrics.counters == {
+        'install_locations_checked': {'': 4},
+        'query_builds': {'': 1},
+        'query_builds_avoided': {'shared_image': 2, 'shared_query': 1},
+        'query_failures': {'': 1},
+        'outdated_packages': {'': 3},
+        'version_cache_hits': context.metrics.counters['version_cache_hits'],
+        'version_cache_misses': context.metrics.counters['version_cache_misses'],
+    }
+    # The four declared versions and the results of the two queries that succeeded, some maybe parsed by earlier tests
+    assert (
+        context.metrics.counters['version_cache_hits'][''] + context.metrics.counters['version_cache_misses'][''] == 6
+    )
+    assert context.metrics.histograms['build_duration_seconds'].counts[-1] == 0
+    assert sum(context.metrics.histograms['build_duration_seconds'].counts) == 1
+    assert sum(context.metrics.histograms['run_duration_seconds'].counts) == 3
+
+
+@pytest.mark.asyncio
+async def test_exec_query_mode(containerfile: Path, fake_engine: list[str], monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[list[str]] = []
+
+    async def exec_fake(*args: str) -> str:
+        calls.append(list(args))
+        if args[1] == 'run':
+            return f'container_{len(calls)}\n'
+        if args[1] == 'exec':
+            package_names = args[-1].partition(' ;')[0].removeprefix('apk list ').split(' ')
+            return (
+                '\n'.join(LATEST_VERSIONS[package_name] for package_name in package_names)
+                + '\n--- unold exit status: 0\n'
+            )
+        return ''
+
+    monkeypatch.setattr(container_manager_cli, 'exec_async', exec_fake)
+    context = create_context(containerfile.parent, 4)
+    context.query_mode = 'exec'
+
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert await unold.check_files([containerfile], context) == 1
+
+    assert "The latest version is '2.45.2-r0'" in stderr.getvalue()
+    assert len(fake_engine) == 3
+    assert sorted(call[1] for call in calls) == ['exec', 'exec', 'exec', 'rm', 'run', 'run', 'run']
+    assert calls[-1] == ['podman', 'rm', '-f', 'container_1', 'container_2', 'container_3']
+
+
+@pytest.mark.asyncio
+async def test_export_query_mode(containerfile: Path, fake_engine: list[str]) -> None:
+    context = create_context(containerfile.parent, 4)
+    context.query_mode = 'export'
+
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert await unold.check_files([containerfile], context) == 1
+
+    assert "The latest version is '2.45.2-r0'" in stderr.getvalue()
+    # A query image and an export build per query
+    assert len(fake_engine) == 6
+    assert not context.containers
+
+
+@pytest.mark.asyncio
+async def test_package_order_irrelevant(tmp_path: Path, fake_engine: list[str]) -> None:
+    file_paths: list[Path] = []
+    for packages in ('git==1.0.0-r0 nginx==1.0.0-r0', 'nginx==1.0.0-r0 git==1.0.0-r0'):
+        file_path = tmp_path / f'{len(file_paths)}.Containerfile'
+        file_path.write_text(f'FROM alpine:3.20\nRUN apk add {packages}\n', encoding='utf-8')
+        file_paths.append(file_path)
+    context = create_context(tmp_path, 4)
+
+    with redirect_stderr(StringIO()):
+        assert await unold.check_files(file_paths, context) == 1
+
+    assert len(fake_engine) == 1
+    assert len(context.queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_stored_image_reused(containerfile: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    builds: dict[str, Mapping[str, str] | None] = {}
+
+    async def build_image(
+        _container_manager: ContainerManager,
+        _containerfile_contents: str,
+        _dir: Path,
+        image_name: str,
+        output_dir: Path | None = None,  # noqa: ARG001
+        build_context: BuildContext | None = None,  # noqa: ARG001
+        labels: Mapping[str, str] | None = None,
+    ) -> None:
+        builds[image_name] = labels
+
+    async def run_container_from_image(_container_manager: ContainerManager, _image_name: str, _command: str) -> str:
+        return LATEST_VERSIONS['git']
+
+    image_digests = {'alpine:3.20': 'sha256:1'}
+
+    async def inspect_image_digest(
+        _container_manager: ContainerManager, image: str, _semaphore: asyncio.Semaphore
+    ) -> str:
+        return image_digests[image]
+
+    monkeypatch.setattr(unold, 'build_image', build_image)
+    monkeypatch.setattr(unold, 'run_container_from_image', run_container_from_image)
+    monkeypatch.setattr(unold, 'inspect_image_digest', inspect_image_digest)
+    containerfile.write_text('FROM alpine:3.20\nRUN apk add git==2.45.2-r0\n', encoding='utf-8')
+    image_store = ImageStore(containerfile.parent / 'cache')
+    stored_images: list[ImageInfo] = []
+
+    async def check() -> None:
+        context = create_context(containerfile.parent, 4)
+        context.image_store = image_store
+
+        async def list_images(_label: str) -> list[ImageInfo]:
+            return stored_images
+
+        async def remove_images(image_ids: Sequence[str]) -> None:
+            assert not image_ids
+
+        monkeypatch.setattr(context.container_manager, 'list_images', list_images)
+        monkeypatch.setattr(context.container_manager, 'remove_images', remove_images)
+        assert await unold.check_files([containerfile], context) == 0
+
+    await check()
+    assert len(builds) == 1
+    image_name, labels = next(iter(builds.items()))
+    assert labels is not None
+    assert labels[BASE_IMAGE_DIGEST_LABEL] == 'sha256:1'
+    assert image_name in image_store.get_last_used()
+
+    # The image of the earlier run is reused
+    builds.clear()
+    stored_images.append(ImageInfo('sha256:a', (image_name,), 1, dict(labels)))
+    await check()
+    assert not builds
+
+    # Unless the base image has changed since
+    image_digests['alpine:3.20'] = 'sha256:2'
+    await check()
+    assert len(builds) == 1
+
+
+@pytest.mark.asyncio
+async def test_collect_garbage(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    container_manager = ContainerManagerCli('podman')
+    removed: list[str] = []
+    images = [ImageInfo(f'sha256:{i}', (f'unold_{i}',), 1) for i in range(3)]
+
+    async def list_containers(label: str) -> list[str]:
+        assert label == 'unold'
+        return ['container_id']
+
+    async def list_images(label: str) -> list[ImageInfo]:
+        assert label == 'unold'
+        return images
+
+    async def remove(ids: Sequence[str]) -> None:
+        removed.extend(ids)
+
+    monkeypatch.setattr(container_manager, 'list_containers', list_containers)
+    monkeypatch.setattr(container_manager, 'list_images', list_images)
+    monkeypatch.setattr(container_manager, 'remove_containers', remove)
+    monkeypatch.setattr(container_manager, 'remove_images', remove)
+    image_store = ImageStore(tmp_path)
+    image_store.touch('unold_0')
+
+    await unold.collect_garbage(container_manager, image_store, 1, None)
+
+    # The recently used image is kept
+    assert removed == ['container_id', 'sha256:1', 'sha256:2']
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import struct
+import subprocess
+import tarfile
+from contextlib import redirect_stderr
+from io import BytesIO, StringIO
+from typing import TYPE_CHECKING
+
+import pytest
+import pytest_asyncio
+
+from build_context import BuildContext
+from container_manager import ImageInfo
+from container_manager_api import ContainerManagerApi, ContainerManagerApiError, demultiplex, parse_json_stream
+from unold import main
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+    from pathlib import Path
+
+
+class FakeApi:
+    """Stand-in for the REST API of a container manager, which executes the commands of containers on the host"""
+
+    def __init__(self) -> None:
+        self.images = {'alpine:3.20': 'sha256:1'}
+        self.pullable = {'alpine:3.21': 'sha256:2'}
+        self.containers: dict[str, list[str]] = {}
+        self.execs: dict[str, tuple[list[str], int]] = {}
+        self.results: dict[str, tuple[int, bytes]] = {}
+        self.requests: list[tuple[str, str]] = []
+        self.builds: list[tuple[str, bytes]] = []
+        self.build_contexts: list[list[str]] = []
+        self.connections = 0
+        self.image_list: list[dict[str, object]] = [
+            {'Id': 'sha256:4', 'RepoTags': ['localhost/unold_a:latest'], 'Size': 10, 'Labels': {'unold': ''}},
+            {'Id': 'sha256:5', 'RepoTags': None, 'Size': 20, 'Labels': None},
+        ]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        while request_line := await reader.readline():
+            method, target, _ = request_line.decode().split(' ')
+            headers = {}
+            while (line := await reader.readline()) != b'\r\n':
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().casefold()] = value.strip()
+            body = await reader.readexactly(int(headers['content-length']))
+
+            path = target.removeprefix('/v1.41')
+            self.requests.append((method, path))
+            status, response_body, framing = await self.route(path, body)
+
+            if framing == 'close':
+                writer.write(f'HTTP/1.1 {status} OK\r\n\r\n'.encode() + response_body)
+                await writer.drain()
+                break
+            if framing == 'chunked':
+                chunks = b''.join(
+                    f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n'
+                    for chunk in (response_body[:5], response_body[5:])
+                    if chunk
+                )
+                writer.write(
+                    f'HTTP/1.1 {status} OK\r\nTransfer-Encoding: chunked\r\n\r\n'.encode() + chunks + b'0\r\n\r\n'
+                )
+            else:
+                writer.write(
+                    f'HTTP/1.1 {status} OK\r\nContent-Length: {len(response_body)}\r\n\r\n'.encode() + response_body
+                )
+            await writer.drain()
+        writer.close()
+
+    async def route(self, path: str, body: bytes) -> tuple[int, bytes, str]:  # noqa: C901, PLR0911, PLR0912
+        if path.startswith('/images/json?'):
+            return 200, json.dumps(self.image_list).encode(), ''
+        if path.startswith('/containers/json?'):
+            return 200, json.dumps([{'Id': container_id} for container_id in self.containers]).encode(), ''
+        if match := re.fullmatch(r'/images/(.+)\?force=1', path):
+            self.image_list = [image for image in self.image_list if image['Id'] != match[1]]
+            return 200, b'[]', ''
+        if match := re.fullmatch(r'/images/(.+)/json', path):
+            if match[1] not in self.images:
+                return 404, json.dumps({'message': f'No such image: {match[1]}'}).encode(), ''
+            return 200, json.dumps({'Id': self.images[match[1]]}).encode(), ''
+        if match := re.fullmatch(r'/images/create\?fromImage=(.+)', path):
+            image = match[1].replace('%3A', ':')
+            if image not in self.pullable:
+                return 200, b'{"status":"Pulling"}\r\n{"error":"manifest unknown"}\r\n', 'chunked'
+            self.images[image] = self.pullable[image]
+            return 200, b'{"status":"Pulling"}\r\n{"status":"Done"}\r\n', 'chunked'
+        if match := re.fullmatch(r'/build\?dockerfile=([^&]+)&.*', path):
+            with tarfile.open(fileobj=BytesIO(body)) as tar:
+                file = tar.extractfile(match[1])
+                assert file is not None
+                self.builds.append((path, file.read()))
+                self.build_contexts.append(sorted(name for name in tar.getnames() if name != match[1]))
+            return 200, b'{"stream":"sha256:3\\n"}\r\n', 'chunked'
+        if path == '/containers/create':
+            container_id = f'container_{len(self.containers)}'
+            self.containers[container_id] = json.loads(body)['Cmd']
+            return 201, json.dumps({'Id': container_id}).encode(), ''
+        if match := re.fullmatch(r'/containers/(\w+)/start', path):
+            return 204, b'', ''
+        if match := re.fullmatch(r'/containers/(\w+)/wait', path):
+            self.results[match[1]] = await execute(self.containers[match[1]])
+            return 200, json.dumps({'StatusCode': self.results[match[1]][0]}).encode(), ''
+        if match := re.fullmatch(r'/containers/(\w+)/logs\?stdout=1&stderr=1', path):
+            return 200, self.results[match[1]][1], 'chunked'
+        if match := re.fullmatch(r'/containers/(\w+)\?force=1', path):
+            if self.containers.pop(match[1], None) is None:
+                return 404, b'{"message":"No such container"}', ''
+            return 204, b'', ''
+        if match := re.fullmatch(r'/containers/(\w+)/exec', path):
+            if match[1] not in self.containers:
+                return 404, json.dumps({'message': f'No such container: {match[1]}'}).encode(), ''
+            exec_id = f'exec_{len(self.execs)}'
+            self.execs[exec_id] = (json.loads(body)['Cmd'], -1)
+            return 201, json.dumps({'Id': exec_id}).encode(), ''
+        if match := re.fullmatch(r'/exec/(\w+)/start', path):
+            exit_status, output = await execute(self.execs[match[1]][0])
+            self.execs[match[1]] = (self.execs[match[1]][0], exit_status)
+            return 200, output, 'close'
+        if match := re.fullmatch(r'/exec/(\w+)/json', path):
+            return 200, json.dumps({'ExitCode': self.execs[match[1]][1]}).encode(), ''
+        return 404, b'{"message":"page not found"}', ''
+
+
+async def execute(command: list[str]) -> tuple[int, bytes]:
+    """Execute a command and multiplex its output like the API does"""
+    try:
+        stdout = await asyncio.to_thread(subprocess.check_output, command, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as exc:
+        return exc.returncode, frame(1, exc.stdout) + frame(2, exc.stderr)
+    return 0, frame(1, stdout)
+
+
+def frame(stream_type: int, data: bytes) -> bytes:
+    return struct.pack('>BxxxI', stream_type, len(data)) + data
+
+
+@pytest_asyncio.fixture
+async def api(tmp_path: Path) -> AsyncIterator[tuple[FakeApi, ContainerManagerApi]]:
+    fake_api = FakeApi()
+    socket_path = tmp_path / 'api.sock'
+    server = await asyncio.start_unix_server(fake_api.handle, str(socket_path))
+    container_manager = ContainerManagerApi(socket_path)
+    yield fake_api, container_manager
+    await container_manager.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_run(api: tuple[FakeApi, ContainerManagerApi]) -> None:
+    fake_api, container_manager = api
+
+    assert await container_manager.run('unold_image', 'echo first && echo second') == 'first\nsecond\n'
+    assert await container_manager.run('unold_image', 'echo third') == 'third\n'
+
+    # The container is removed, and one connection is used for all requests
+    assert not fake_api.containers
+    assert fake_api.connections == 1
+    assert [request[1] for request in fake_api.requests[:5]] == [
+        '/containers/create',
+        '/containers/container_0/start',
+        '/containers/container_0/wait',
+        '/containers/container_0/logs?stdout=1&stderr=1',
+        '/containers/container_0?force=1',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_failing_command(api: tuple[FakeApi, ContainerManagerApi]) -> None:
+    fake_api, container_manager = api
+
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        await container_manager.run('unold_image', 'echo out && echo error >&2 && exit 3')
+
+    assert exc_info.value.returncode == 3
+    assert exc_info.value.stdout == 'out\n'
+    assert exc_info.value.stderr == 'error\n'
+    assert not fake_api.containers
+
+
+@pytest.mark.asyncio
+async def test_exec(api: tuple[FakeApi, ContainerManagerApi]) -> None:
+    fake_api, container_manager = api
+
+    container_id = await container_manager.start('unold_image', 'tail -f /dev/null')
+    assert fake_api.containers[container_id] == ['sh', '-c', 'tail -f /dev/null']
+
+    assert await container_manager.exec(container_id, 'echo first') == 'first\n'
+    assert await container_manager.exec(container_id, 'echo second') == 'second\n'
+    # The output stream of an exec ends with the connection, which thus can't be reused
+    assert fake_api.connections == 3
+
+    await container_manager.remove_containers([container_id])
+    assert not fake_api.containers
+    # Already removed containers are fine
+    await container_manager.remove_containers([container_id])
+
+
+@pytest.mark.asyncio
+async def test_resolve_image_id(api: tuple[FakeApi, ContainerManagerApi]) -> None:
+    fake_api, container_manager = api
+
+    assert await container_manager.resolve_image_id('alpine:3.20') == 'sha256:1'
+    assert await container_manager.resolve_image_id('alpine:3.21') == 'sha256:2'
+    assert fake_api.requests[-2:] == [
+        ('POST', '/images/create?fromImage=alpine%3A3.21'),
+        ('GET', '/images/alpine:3.21/json'),
+    ]
+
+    with pytest.raises(ContainerManagerApiError, match='manifest unknown'):
+        await container_manager.resolve_image_id('alpine:0.1')
+
+
+@pytest.mark.asyncio
+async def test_build_image(api: tuple[FakeApi, ContainerManagerApi], tmp_path: Path) -> None:
+    fake_api, container_manager = api
+    containerfile_path = tmp_path / 'unold_image'
+    containerfile_path.write_text('FROM alpine:3.20\nCOPY a /a\nRUN apk update -q\n', encoding='utf-8')
+    context_dir = tmp_path / 'context'
+    context_dir.mkdir()
+    (context_dir / 'a').write_text('a', encoding='utf-8')
+    (context_dir / 'b').write_text('b', encoding='utf-8')
+    build_context = BuildContext(context_dir, ('a',))
+
+    await container_manager.build_image(containerfile_path, build_context, 'unold_image')
+
+    assert fake_api.builds == [
+        (
+            '/build?dockerfile=.unold_image.Containerfile&t=unold_image&q=1',
+            b'FROM alpine:3.20\nCOPY a /a\nRUN apk update -q\n',
+        )
+    ]
+    # Only the selected files are sent
+    assert fake_api.build_contexts == [['a']]
+    with pytest.raises(ContainerManagerApiError):
+        await container_manager.build_image(containerfile_path, build_context, 'unold_image', tmp_path / 'output')
+
+
+@pytest.mark.parametrize('option', [['--query-mode', 'export'], ['--cache-mounts']])
+def test_unsupported_options(tmp_path: Path, option: list[str]) -> None:
+    # Refused before any build is started
+    stderr = StringIO()
+    with redirect_stderr(stderr):
+        assert main(['--api-socket', str(tmp_path / 'api.sock'), *option, str(tmp_path / 'Containerfile')]) == 1
+    assert 'requires the command line interface, not --api-socket' in stderr.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_list_and_remove(api: tuple[FakeApi, ContainerManagerApi]) -> None:
+    fake_api, container_manager = api
+
+    assert await container_manager.list_images('unold') == [
+        ImageInfo('sha256:4', ('unold_a',), 10, {'unold': ''}),
+        ImageInfo('sha256:5', (), 20, {}),
+    ]
+    await container_manager.remove_images(['sha256:5'])
+    assert [image.id for image in await container_manager.list_images('unold')] == ['sha256:4']
+
+    container_id = await container_manager.start('unold_image', 'tail -f /dev/null')
+    assert await container_manager.list_containers('unold') == [container_id]
+    assert fake_api.requests[-1] == ('GET', '/containers/json?all=1&filters=%7B%22label%22%3A+%5B%22unold%22%5D%7D')
+
+
+@pytest.mark.asyncio
+async def test_error_status(api: tuple[FakeApi, ContainerManagerApi]) -> None:
+    _, container_manager = api
+
+    with pytest.raises(ContainerManagerApiError, match='status 404: No such container: container_id'):
+        await container_manager.exec('container_id', 'echo first')
+
+
+def test_demultiplex() -> None:
+    assert demultiplex(frame(1, b'out\n') + frame(2, b'err\n') + frame(1, b'more\n')) == ('out\nmore\n', 'err\n')
+
+
+def test_parse_json_stream() -> None:
+    assert list(parse_json_stream(b'{"a": 1}\r\n{"b": 2}{"c": 3}\n')) == [{'a': 1}, {'b': 2}, {'c': 3}]
@@ -0,0 +1,120 @@
+from textwrap import dedent
+
+from containerfile import (
+    find_base_image,
+    find_context_sources,
+    find_external_images,
+    find_stage,
+    find_stage_dependencies,
+    parse_stages,
+    select_stage_line_ranges,
+    substitute_args,
+)
+from unold import parse_containerfile_contents
+
+CONTAINERFILE_CONTENTS = dedent("""\
+    ARG ALPINE_VERSION=3.20
+    FROM alpine:${ALPINE_VERSION} AS build
+    RUN apk add git
+
+    FROM build AS test
+    RUN apk add nginx
+
+    FROM scratch
+    COPY --from=build /a /a
+
+    FROM python:$PYTHON_VERSION
+    """)
+
+
+def test_parse_stages() -> None:
+    stages = parse_stages(parse_containerfile_contents(CONTAINERFILE_CONTENTS))
+    assert [(stage.index, stage.name, stage.base_image, stage.start_line) for stage in stages] == [
+        (0, 'build', 'alpine:3.20', 1),
+        (1, 'test', 'build', 4),
+        (2, None, 'scratch', 7),
+        (3, None, 'python:$PYTHON_VERSION', 10),
+    ]
+    assert [len(stage.layers) for stage in stages] == [2, 2, 2, 1]
+
+
+def test_find_stage() -> None:
+    stages = parse_stages(parse_containerfile_contents(CONTAINERFILE_CONTENTS))
+    assert find_stage(stages, 0) is None
+    assert find_stage(stages, 2) == stages[0]
+    assert find_stage(stages, 4) == stages[1]
+    assert find_stage(stages, 100) == stages[3]
+
+
+def test_find_base_image() -> None:
+    stages = parse_stages(parse_containerfile_contents(CONTAINERFILE_CONTENTS))
+    assert [find_base_image(stages, stage) for stage in stages] == ['alpine:3.20', 'alpine:3.20', None, None]
+
+
+def test_find_external_images() -> None:
+    stages = parse_stages(
+        parse_containerfile_contents(CONTAINERFILE_CONTENTS + 'FROM alpine:3.20\nFROM golang:1.23 AS go\n')
+    )
+    assert find_external_images(stages, range(len(stages))) == ['alpine:3.20', 'golang:1.23']
+    assert find_external_images(stages, {1, 2}) == []
+
+
+def test_find_stage_dependencies() -> None:
+    stages = parse_stages(
+        parse_containerfile_contents(
+            dedent("""\
+            FROM alpine:3.20 AS compile
+            RUN make
+            FROM alpine:3.20 AS assets
+            RUN make assets
+            FROM alpine:3.20 AS cache
+            FROM compile
+            COPY --from=1 /assets /assets
+            RUN --mount=type=cache,from=cache,target=/cache apk add git
+            COPY --from=compile /a /a
+            COPY --from=alpine:3.20 /etc/apk /etc/apk
+            """)
+        )
+    )
+    assert find_stage_dependencies(stages, stages[3]) == {0, 1, 2, 3}
+    # Only instructions before the line count
+    assert find_stage_dependencies(stages, stages[3], 7) == {0, 1, 3}
+    assert find_stage_dependencies(stages, stages[3], 6) == {0, 3}
+    assert find_stage_dependencies(stages, stages[1]) == {1}
+
+
+def test_find_context_sources() -> None:
+    stages = parse_stages(
+        parse_containerfile_contents(
+            dedent("""\
+            FROM alpine:3.20 AS compile
+            COPY src/ /src/
+            FROM alpine:3.20 AS unused
+            COPY unused /unused
+            FROM compile
+            COPY ["a b", "c", "/d/"]
+            ADD https://example.com/e.tar.gz git@example.com:f.git /
+            COPY --from=compile /g /g
+            COPY <<EOF /h
+            h
+            EOF
+            RUN apk add git
+            COPY i /i
+            """)
+        )
+    )
+    assert find_context_sources(stages, stages[2], 11) == ['src/', 'a b', 'c']
+
+
+def test_select_stage_line_ranges() -> None:
+    stages = parse_stages(parse_containerfile_contents(CONTAINERFILE_CONTENTS))
+    assert select_stage_line_ranges(stages, 0) == [(0, 0)]
+    assert select_stage_line_ranges(stages, 2) == [(0, 1), (1, 2)]
+    assert select_stage_line_ranges(stages, 5) == [(0, 1), (1, 4), (4, 5)]
+    assert select_stage_line_ranges(stages, 9) == [(0, 1), (1, 4), (4, 4), (7, 9)]
+
+
+def test_substitute_args() -> None:
+    args = {'A': '1', 'EMPTY': ''}
+    assert substitute_args('$A ${A} $B ${B}', args) == '1 1 $B ${B}'
+    assert substitute_args('${A:-2} ${EMPTY:-2} ${A:+2} ${EMPTY:+2}', args) == '1 2 2 '
@@ -1,6 +1,12 @@
 from textwrap import dedent
 
-from unold import generate_containerfile_contents
+from containerfile import parse_stages
+from unold import (
+    generate_cache_bust,
+    generate_containerfile_contents,
+    generate_export_containerfile_contents,
+    parse_containerfile_contents,
+)
 
 
 def test_no_command_prefix() -> None:
@@ -41,3 +47,113 @@ def test_with_command_prefix() -> None:
 
         CMD command_prefix && some_command
 """)
+
+
+def test_run_instruction() -> None:
+    output = generate_containerfile_contents(
+        dedent("""
+        FROM alpine:3.20
+
+        RUN apk add --no-cache \
+            git==2.43.0-r0 \
+            nginx==1.26.2-r0
+        """),
+        'some_command',
+        3,
+        'command_prefix',
+        instruction='RUN',
+    )
+    assert output == dedent("""
+        FROM alpine:3.20
+
+        RUN command_prefix && some_command
+""")
+
+
+def test_cache_bust() -> None:
+    output = generate_containerfile_contents(
+        dedent("""
+        FROM alpine:3.20
+
+        RUN cd /tmp && apk add --no-cache \
+            git==2.43.0-r0
+        """),
+        'some_command',
+        3,
+        'cd /tmp',
+        instruction='RUN',
+        cache_bust='20000',
+    )
+    assert output == dedent("""
+        FROM alpine:3.20
+
+        RUN cd /tmp
+        ARG UNOLD_CACHE_BUST=20000
+        RUN some_command
+""")
+
+
+def test_cache_mount() -> None:
+    output = generate_containerfile_contents(
+        'FROM alpine:3.20\nRUN apk add git==2.43.0-r0\n',
+        'apk update -q',
+        1,
+        '',
+        instruction='RUN',
+        cache_bust='20000',
+        cache_dir='/var/cache/apk',
+    )
+    assert output == dedent("""\
+        FROM alpine:3.20
+        ARG UNOLD_CACHE_BUST=20000
+        RUN --mount=type=cache,id=unold/var/cache/apk,target=/var/cache/apk,sharing=locked apk update -q \
+&& cp -a /var/cache/apk /var/cache/apk.unold
+        RUN rm -rf /var/cache/apk && mv /var/cache/apk.unold /var/cache/apk
+        """)
+
+
+def test_generate_cache_bust() -> None:
+    assert generate_cache_bust(3600, 7199) == '1'
+    assert generate_cache_bust(3600, 7200) == '2'
+    assert generate_cache_bust(0, 7200) == '7200'
+
+
+def test_only_needed_stages() -> None:
+    input_ = dedent("""\
+        # syntax=docker/dockerfile:1
+        ARG ALPINE_VERSION=3.20
+        FROM alpine:${ALPINE_VERSION} AS compile
+        RUN make
+
+        FROM alpine:${ALPINE_VERSION} AS assets
+        RUN make assets
+
+        FROM alpine:${ALPINE_VERSION}
+        COPY --from=1 /assets /assets
+        RUN apk add --no-cache git==2.43.0-r0
+        COPY --from=compile /a /a
+        """)
+    output = generate_containerfile_contents(
+        input_, 'some_command', 10, '', instruction='RUN', stages=parse_stages(parse_containerfile_contents(input_))
+    )
+    assert output == dedent("""\
+        # syntax=docker/dockerfile:1
+        ARG ALPINE_VERSION=3.20
+        FROM scratch
+        FROM alpine:${ALPINE_VERSION} AS assets
+        RUN make assets
+
+        FROM alpine:${ALPINE_VERSION}
+        COPY --from=1 /assets /assets
+        RUN some_command
+        """)
+
+
+def test_export() -> None:
+    output = generate_export_containerfile_contents('unold_0123abcd', 'apk list git')
+    assert output == dedent("""\
+        FROM unold_0123abcd AS query
+        RUN apk list git > /unold_versions
+        FROM scratch
+        COPY --from=query /unold_versions /unold_versions
+        """)
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import sys
+from typing import TYPE_CHECKING
+
+import pytest
+
+from git_diff import find_changed_lines, find_repository, parse_diff
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from pathlib import Path
+
+
+def test_parse_diff() -> None:
+    diff = (
+        'diff --git a/Containerfile b/Containerfile\n'
+        '--- a/Containerfile\n'
+        '+++ b/Containerfile\n'
+        '@@ -2 +2 @@ FROM alpine:3.20\n'
+        '-RUN apk add git\n'
+        '+RUN apk add git nginx\n'
+        '@@ -5,0 +6,2 @@\n'
+        '+RUN apk add ripgrep\n'
+        '+++ b/Not a header\n'
+        '@@ -9,2 +10,0 @@\n'
+        '-RUN apk add \\\n'
+        '-    curl\n'
+        '\\ No newline at end of file\n'
+        'diff --git "a/docker/a \\"b\\".Containerfile" "b/docker/a \\"b\\".Containerfile"\n'
+        '--- "a/docker/a \\"b\\".Containerfile"\n'
+        '+++ "b/docker/a \\"b\\".Containerfile"\n'
+        '@@ -1 +1 @@\n'
+        '-FROM alpine:3.19\n'
+        '+FROM alpine:3.20\n'
+        'diff --git a/Removed.Containerfile b/Removed.Containerfile\n'
+        '--- a/Removed.Containerfile\n'
+        '+++ /dev/null\n'
+        '@@ -1 +0,0 @@\n'
+        '-FROM alpine:3.20\n'
+    )
+    assert parse_diff(diff) == {
+        'Containerfile': [(1, 2), (5, 7), (9, 11)],
+        'docker/a "b".Containerfile': [(0, 1)],
+    }
+    assert parse_diff('') == {}
+
+
+@pytest.mark.asyncio
+async def test_find_changed_lines(tmp_path: Path, git: Callable[..., None]) -> None:
+    file_path = tmp_path / 'docker' / 'Containerfile'
+    file_path.parent.mkdir()
+    git(tmp_path, 'init', '-q')
+    assert find_repository(file_path) == tmp_path
+
+    file_path.write_text('FROM alpine:3.20\nRUN apk add git\n', encoding='utf-8')
+    (tmp_path / 'Other.Containerfile').write_text('FROM alpine:3.20\n', encoding='utf-8')
+    git(tmp_path, 'add', 'Other.Containerfile')
+    git(tmp_path, 'commit', '-q', '-m', 'Add Containerfile')
+    changed_lines = await find_changed_lines(tmp_path, 'HEAD')
+    assert changed_lines.get('docker/Containerfile') == [(0, sys.maxsize)]
+    assert changed_lines.get('Other.Containerfile') == []
+
+    git(tmp_path, 'add', 'docker/Containerfile')
+    git(tmp_path, 'commit', '-q', '-m', 'Add Containerfile')
+    assert (await find_changed_lines(tmp_path, 'HEAD')).ranges == {}
+
+    file_path.write_text('FROM alpine:3.20\nRUN apk add git nginx\n', encoding='utf-8')
+    assert (await find_changed_lines(tmp_path, 'HEAD')).get('docker/Containerfile') == [(1, 2)]
+
+    # Also ignored files aren't tracked
+    (tmp_path / '.gitignore').write_text('*.ignored\n', encoding='utf-8')
+    assert (await find_changed_lines(tmp_path, 'HEAD')).get('a.ignored') == [(0, sys.maxsize)]
+
+    with pytest.raises(RuntimeError, match="Failed to find the changes in '.*' since 'missing'"):
+        await find_changed_lines(tmp_path, 'missing')
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from container_manager import ImageInfo
+from image_store import BASE_IMAGE_DIGEST_LABEL, QUERY_LABEL, ImageStore, is_reusable, select_evictions
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+IMAGES = [
+    ImageInfo('sha256:1', ('unold_1',), 100),
+    ImageInfo('sha256:2', ('unold_2',), 200),
+    ImageInfo('sha256:3', (), 300),
+    ImageInfo('sha256:4', ('unold_4', 'unold_5'), 400),
+]
+LAST_USED = {'unold_1': 3.0, 'unold_2': 1.0, 'unold_4': 0.5, 'unold_5': 2.0}
+
+
+def test_image_store(tmp_path: Path) -> None:
+    image_store = ImageStore(tmp_path)
+    image_store.touch('unold_1')
+    image_store.touch('unold_2')
+    image_store.forget(['unold_2', 'unold_3'])
+    image_store.close()
+
+    # The store persists between runs
+    image_store = ImageStore(tmp_path)
+    assert list(image_store.get_last_used()) == ['unold_1']
+    image_store.close()
+
+
+def test_select_evictions_by_count() -> None:
+    assert select_evictions(IMAGES, LAST_USED, 4, None) == []
+    # The untagged image goes first, and an image is as recent as its most recent name
+    assert [image.id for image in select_evictions(IMAGES, LAST_USED, 1, None)] == ['sha256:3', 'sha256:2', 'sha256:4']
+    assert len(select_evictions(IMAGES, LAST_USED, 0, None)) == 4
+
+
+def test_select_evictions_by_size() -> None:
+    assert select_evictions(IMAGES, LAST_USED, None, 1000) == []
+    assert [image.id for image in select_evictions(IMAGES, LAST_USED, None, 500)] == ['sha256:3', 'sha256:2']
+    assert [image.id for image in select_evictions(IMAGES, LAST_USED, 3, 800)] == ['sha256:3']
+
+
+def test_is_reusable() -> None:
+    labels = {QUERY_LABEL: 'a', BASE_IMAGE_DIGEST_LABEL: 'sha256:1'}
+    assert is_reusable(ImageInfo('sha256:2', ('unold_a',), 1, {**labels, 'unold.created': '1'}), labels)
+    assert not is_reusable(ImageInfo('sha256:2', ('unold_a',), 1, {QUERY_LABEL: 'a'}), labels)
+    assert not is_reusable(ImageInfo('sha256:2', ('unold_a',), 1, {**labels, QUERY_LABEL: 'b'}), labels)
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from metrics import Metrics, increment, time_histogram
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_render() -> None:
+    metrics = Metrics()
+    metrics.increment('install_locations_checked', 3)
+    metrics.increment('query_builds_avoided', reason='result_cache')
+    metrics.increment('query_builds_avoided', 2, reason='apk_index')
+    metrics.histograms['build_duration_seconds'].observe(0.5)
+    metrics.histograms['build_duration_seconds'].observe(400)
+
+    lines = metrics.render(now=1700000000).splitlines()
+
+    assert lines[:6] == [
+        '# HELP unold_install_locations_checked_total Install locations of packages that were checked',
+        '# TYPE unold_install_locations_checked_total counter',
+        'unold_install_locations_checked_total 3',
+        '# HELP unold_query_builds_total Query images that were built',
+        '# TYPE unold_query_builds_total counter',
+        'unold_query_builds_total 0',
+    ]
+    assert 'unold_query_builds_avoided_total{reason="apk_index"} 2' in lines
+    assert 'unold_query_builds_avoided_total{reason="result_cache"} 1' in lines
+    build_index = lines.index('# TYPE unold_build_duration_seconds histogram')
+    assert lines[build_index + 1 : build_index + 4] == [
+        'unold_build_duration_seconds_bucket{le="0.1"} 0',
+        'unold_build_duration_seconds_bucket{le="0.5"} 1',
+        'unold_build_duration_seconds_bucket{le="1.0"} 1',
+    ]
+    assert lines[build_index + 11 : build_index + 14] == [
+        'unold_build_duration_seconds_bucket{le="+Inf"} 2',
+        'unold_build_duration_seconds_sum 400.5',
+        'unold_build_duration_seconds_count 2',
+    ]
+    assert lines[-1] == 'unold_last_run_timestamp_seconds 1700000000'
+
+
+def test_write(tmp_path: Path) -> None:
+    metrics = Metrics()
+    with time_histogram(metrics, 'run_duration_seconds'):
+        increment(metrics, 'query_failures')
+    metrics.write(tmp_path / 'unold.prom')
+
+    assert list(tmp_path.iterdir()) == [tmp_path / 'unold.prom']
+    contents = (tmp_path / 'unold.prom').read_text(encoding='utf-8')
+    assert 'unold_query_failures_total 1\n' in contents
+    assert 'unold_run_duration_seconds_count 1\n' in contents
+
+
+def test_disabled() -> None:
+    increment(None, 'query_failures')
+    with time_histogram(None, 'run_duration_seconds'):
+        pass
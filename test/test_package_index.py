@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from package_index import FORMAT_VERSION, MAGIC, PackageIndex, PackageIndexError, write_package_index
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_lookup(tmp_path: Path) -> None:
+    versions = {'nginx': '1.26.2-r0', 'git': '2.45.2-r0', 'zstd': '1.5.6-r0', 'åäö': '1'}
+    path = tmp_path / 'index'
+    write_package_index(path, versions)
+
+    index = PackageIndex(path)
+    assert len(index) == 4
+    for package_name, version_str in versions.items():
+        assert index.get(package_name) == version_str
+    assert index.get('') is None
+    assert index.get('a') is None
+    assert index.get('gi') is None
+    assert index.get('gitt') is None
+    assert index.get('zzz') is None
+    index.close()
+
+
+def test_empty(tmp_path: Path) -> None:
+    path = tmp_path / 'index'
+    write_package_index(path, {})
+    index = PackageIndex(path)
+    assert len(index) == 0
+    assert index.get('git') is None
+
+
+def test_overwrite(tmp_path: Path) -> None:
+    path = tmp_path / 'index'
+    write_package_index(path, {'git': '2.43.0-r0'})
+    write_package_index(path, {'git': '2.45.2-r0'})
+    assert PackageIndex(path).get('git') == '2.45.2-r0'
+    assert [child.name for child in tmp_path.iterdir()] == ['index']
+
+
+def test_invalid(tmp_path: Path) -> None:
+    path = tmp_path / 'index'
+
+    path.write_bytes(b'')
+    with pytest.raises(PackageIndexError, match='truncated'):
+        PackageIndex(path)
+
+    path.write_bytes(MAGIC)
+    with pytest.raises(PackageIndexError, match='truncated'):
+        PackageIndex(path)
+
+    write_package_index(path, {'git': '2.45.2-r0'})
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(PackageIndexError, match='truncated'):
+        PackageIndex(path)
+
+    path.write_bytes(b'P:git\nV:2.45.2-r0\n\n')
+    with pytest.raises(PackageIndexError, match='not a package index'):
+        PackageIndex(path)
+
+    write_package_index(path, {'git': '2.45.2-r0'})
+    path.write_bytes(MAGIC + (FORMAT_VERSION + 1).to_bytes(4, 'little') + path.read_bytes()[12:])
+    with pytest.raises(PackageIndexError, match='format version'):
+        PackageIndex(path)
@@ -5,7 +5,7 @@ from typing import TYPE_CHECKING, override
 import pytest
 
 from package import Package
-from package_manager import PackageManager
+from package_manager import PackageManager, PackageManagerIndex, find_executable, split_command, split_shell_words
 
 if TYPE_CHECKING:
     from collections.abc import Sequence
@@ -15,8 +15,12 @@ if TYPE_CHECKING:
 
 class PackageManagerStub(PackageManager):
     @override
-    def create_query_versions_command(self, package_names: Sequence[str], forward_arguments: Sequence[str]) -> str:
-        raise NotImplementedError
+    def create_update_index_command(self) -> str:
+        return 'update'
+
+    @override
+    def create_list_versions_command(self, package_names: Sequence[str], forward_arguments: Sequence[str]) -> str:
+        return ' '.join(['list', *forward_arguments, *package_names])
 
     @override
     def parse_version(self, package_version_str: str) -> Version | None:
@@ -74,3 +78,48 @@ def test_parse_install_package_multi(pkg_man: PackageManagerStub) -> None:
     assert results[3].packages == [Package('rm'), Package('-rf'), Package('/var/cache/apk/*')]
     assert results[3].forwarded_args == ['-X', 'repo']
     assert results[3].command_prefix == 'apk update && apk add git=2.43.0 || ls'
+
+
+def test_package_manager_index() -> None:
+    pkg_man_apk = PackageManagerStub()
+    pkg_man_apk.executables = frozenset({'apk'})
+    pkg_man_apt = PackageManagerStub()
+    pkg_man_apt.executables = frozenset({'apt-get', 'apt'})
+    index = PackageManagerIndex([pkg_man_apk, pkg_man_apt, PackageManagerStub()])
+
+    results = index.parse_install_package(
+        ['apk', 'add', 'git', '&&', 'ls', 'apk', ';', 'sudo', 'apt', 'install', 'vim', '&&', 'apk', 'add', 'curl']
+    )
+    assert [(pkg_man, result.packages, result.command_prefix) for pkg_man, result in results] == [
+        (pkg_man_apk, [Package('apk'), Package('add'), Package('git')], ''),
+        (pkg_man_apt, [Package('sudo'), Package('apt'), Package('install'), Package('vim')], ''),
+        (pkg_man_apk, [Package('apk'), Package('add'), Package('curl')], 'apk add git'),
+    ]
+
+
+def test_find_executable() -> None:
+    assert find_executable([]) is None
+    assert find_executable(['apk', 'add']) == 0
+    assert find_executable(['PATH=/bin', 'sudo', 'apk', 'add']) == 2
+    assert find_executable(['sudo', 'PATH=/bin']) is None
+
+
+def test_split_command() -> None:
+    assert split_command([]) == []
+    assert split_command(['apk', 'add', 'git']) == [(['apk', 'add', 'git'], 3)]
+    assert split_command([';', 'apk', 'update', '&&', '&&', 'apk', 'add', 'git', '||', 'ls', ';']) == [
+        (['apk', 'update'], 3),
+        (['apk', 'add', 'git'], 8),
+        (['ls'], 10),
+    ]
+
+
+def test_create_query_versions_command(pkg_man: PackageManagerStub) -> None:
+    assert pkg_man.create_query_versions_command(['git', 'nginx'], ['-X', 'repo']) == 'update && list -X repo git nginx'
+
+
+def test_split_shell_words() -> None:
+    words = split_shell_words('apk add  \'git=2.43.0\' "nginx"')
+    assert words == ('apk', 'add', 'git=2.43.0', 'nginx')
+    # Every package manager gets the same words
+    assert split_shell_words('apk add  \'git=2.43.0\' "nginx"') is words
@@ -4,7 +4,7 @@ from io import StringIO
 import pytest
 
 from package_manager_apk import PackageManagerApk
-from version import Version, VersionConditional
+from version import Version, VersionComparison, VersionConditional
 
 
 @pytest.fixture
@@ -152,6 +152,24 @@ def test_parse_install_package_subcommand_flags(pkg_man: PackageManagerApk) -> N
     assert forwarded_args == []
 
 
+def test_parse_install_package_subcommand_option_values(pkg_man: PackageManagerApk) -> None:
+    # Values of options aren't packages, whether they are before or after the subcommand or in the same argument
+    packages, forwarded_args = pkg_man._parse_install_package_subcommand(
+        ['apk', '--root', '/mnt', '-X', 'repo1', 'add', '--virtual=.deps', '-Xrepo2', '--arch', 'x86', 'git=2.43.0']
+    )
+
+    assert [package.name for package in packages] == ['git']
+    # Only the last value of an option counts
+    assert forwarded_args == ['--arch', 'x86', '-X', 'repo2']
+
+
+def test_parse_install_package_subcommand_end_of_options(pkg_man: PackageManagerApk) -> None:
+    packages, forwarded_args = pkg_man._parse_install_package_subcommand(['apk', 'add', '--', '-git', 'nginx'])
+
+    assert [package.name for package in packages] == ['-git', 'nginx']
+    assert forwarded_args == []
+
+
 def test_create_query_versions_command_empty(pkg_man: PackageManagerApk) -> None:
     with pytest.raises(RuntimeError):
         pkg_man.create_query_versions_command([], [])
@@ -177,24 +195,90 @@ def test_create_query_versions_command_forward_multiple(pkg_man: PackageManagerA
     assert command == 'apk update -q && apk list -X repo1 --repository repo2 --arch arch git'
 
 
+def test_create_update_index_command(pkg_man: PackageManagerApk) -> None:
+    assert pkg_man.create_update_index_command() == 'apk update -q'
+
+
+def test_create_list_versions_command(pkg_man: PackageManagerApk) -> None:
+    command = pkg_man.create_list_versions_command(['git', 'nginx'], ['-X', 'repo'])
+    assert command == 'apk list -X repo git nginx'
+
+    with pytest.raises(RuntimeError):
+        pkg_man.create_list_versions_command([], [])
+
+
 def test_parse_version_string(pkg_man: PackageManagerApk) -> None:
     version = pkg_man.parse_version_string('git', '2.45.2-r0')
-    assert version == Version('2.45.2-r0', 'git', 2, 45, 2, 0)
+    assert version == Version('2.45.2-r0', 'git', ((6, 2), (6, 45), (6, 2), (2, 0), (1, 0)))
 
     version = pkg_man.parse_version_string('git', '2.45.2')
-    assert version == Version('2.45.2', 'git', 2, 45, 2)
-
-    version = pkg_man.parse_version_string('git', '2.45')
-    assert version == Version('2.45', 'git', 2, 45)
+    assert version == Version('2.45.2', 'git', ((6, 2), (6, 45), (6, 2), (1, 0)))
 
     version = pkg_man.parse_version_string('git', '2')
-    assert version == Version('2', 'git', 2)
+    assert version == Version('2', 'git', ((6, 2), (1, 0)))
+
+    version = pkg_man.parse_version_string('openssl', '3.3.2a_rc1_p2~1a2b3c-r4')
+    assert version == Version(
+        '3.3.2a_rc1_p2~1a2b3c-r4',
+        'openssl',
+        ((6, 3), (6, 3), (6, 2), (5, 97), (0, 3), (3, 1), (4, 8), (3, 2), (2, 4), (1, 0)),
+    )
 
     version = pkg_man.parse_version_string('git', 'prerelease')
     assert version is None
 
 
+def test_version_order(pkg_man: PackageManagerApk) -> None:
+    # Ascending, like apk version -t orders them
+    version_strs = [
+        '1.0_alpha',
+        '1.0_alpha1',
+        '1.0_beta',
+        '1.0_pre2',
+        '1.0_rc1',
+        '1.0',
+        '1.0-r1',
+        '1.0_p1',
+        '1.0a',
+        '1.0.1',
+        '1.01.1',
+        '1.1',
+        '1.2_rc1',
+        '1.2',
+        '1.10',
+        '20240101',
+    ]
+    versions = [pkg_man.parse_version_string('openssl', version_str) for version_str in version_strs]
+    keys = [version.key for version in versions if version is not None]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(version_strs)
+
+
+def test_compare_prefix(pkg_man: PackageManagerApk) -> None:
+    def compare(version_str: str, version_str_other: str) -> VersionComparison:
+        version = pkg_man.parse_version_string('git', version_str)
+        version_other = pkg_man.parse_version_string('git', version_str_other)
+        assert version is not None
+        assert version_other is not None
+        return version.compare(version_other)
+
+    assert compare('2.43', '2.43.0-r1') == VersionComparison.EQUAL
+    assert compare('2.43.0', '2.43.0_rc1-r0') == VersionComparison.EQUAL
+    assert compare('2.43.0_rc1', '2.43.0-r0') == VersionComparison.LESS_THAN_OTHER
+    assert compare('2.43.0-r1', '2.43.0-r0') == VersionComparison.GREATER_THAN_OTHER
+
+
+def test_parse_version_string_cached(pkg_man: PackageManagerApk) -> None:
+    hits, misses = pkg_man.get_version_cache_counts()
+    version = pkg_man.parse_version_string('musl', '1.2.5-r0-cached')
+    assert pkg_man.get_version_cache_counts() == (hits, misses + 1)
+
+    assert PackageManagerApk().parse_version_string('musl', '1.2.5-r0-cached') is version
+    assert pkg_man.parse_version('musl-1.2.5-r0-cached x86_64 {musl} (MIT)') is version
+    assert pkg_man.get_version_cache_counts() == (hits + 2, misses + 1)
+
+
 def test_parse_version(pkg_man: PackageManagerApk) -> None:
     package_version_str = 'git-2.45.2-r0 x86_64 {git} (GPL-2.0-only)'
     version = pkg_man.parse_version(package_version_str)
-    assert version == Version('2.45.2-r0', 'git', 2, 45, 2, 0)
+    assert version == Version('2.45.2-r0', 'git', ((6, 2), (6, 45), (6, 2), (2, 0), (1, 0)))
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import subprocess
+
+import pytest
+
+import container_manager_cli
+from async_subprocess import exec_async
+from container_manager_cli import ContainerManagerCli
+from query_container import QueryContainer, remove_containers
+
+
+@pytest.fixture
+def calls(monkeypatch: pytest.MonkeyPatch) -> list[list[str]]:
+    """Replace the container manager with a fake that executes commands on the host"""
+    calls: list[list[str]] = []
+
+    async def exec_fake(*args: str) -> str:
+        calls.append(list(args))
+        if args[1] == 'run':
+            return 'container_id\n'
+        if args[1] == 'exec':
+            return await exec_async(*args[3:])
+        return ''
+
+    monkeypatch.setattr(container_manager_cli, 'exec_async', exec_fake)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_batch(calls: list[list[str]]) -> None:
+    container = await QueryContainer.start(ContainerManagerCli('podman'), 'unold_image', asyncio.Semaphore(1))
+    assert container.container_id == 'container_id'
+
+    outputs = await asyncio.gather(
+        container.exec('echo first'), container.exec('printf second'), container.exec('echo "third\nline"')
+    )
+    assert outputs == ['first', 'second', 'third\nline']
+
+    # One exec for all commands
+    assert [call[1] for call in calls] == ['run', 'exec']
+
+    await remove_containers(ContainerManagerCli('podman'), [container])
+    assert calls[-1] == ['podman', 'rm', '-f', 'container_id']
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures('calls')
+async def test_failing_command() -> None:
+    container = await QueryContainer.start(ContainerManagerCli('podman'), 'unold_image', asyncio.Semaphore(1))
+
+    results = await asyncio.gather(
+        container.exec('echo first'), container.exec('echo fail && (exit 3)'), return_exceptions=True
+    )
+    assert results[0] == 'first'
+    assert isinstance(results[1], subprocess.CalledProcessError)
+    assert results[1].returncode == 3
+    assert results[1].cmd[-1] == 'echo fail && (exit 3)'
+
+
+@pytest.mark.asyncio
+async def test_failing_exec(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def exec_fake(*args: str) -> str:
+        raise subprocess.CalledProcessError(125, list(args), '', 'Error: no such container\n')
+
+    monkeypatch.setattr(container_manager_cli, 'exec_async', exec_fake)
+    container = QueryContainer(ContainerManagerCli('podman'), 'container_id', asyncio.Semaphore(1))
+
+    with pytest.raises(subprocess.CalledProcessError):
+        await container.exec('echo first')
@@ -0,0 +1,80 @@
+from pathlib import Path
+from textwrap import dedent
+
+from package_manager_apk import PackageManagerApk
+from query_plan import plan_queries
+from unold import parse_containerfile_contents, read_packages
+
+
+def plan(contents: str) -> list[list[tuple[int, list[str]]]]:
+    layers = parse_containerfile_contents(dedent(contents))
+    install_locations = read_packages(layers, [PackageManagerApk()], Path('Containerfile'))
+    return [
+        [
+            (install_location.containerfile_start_line, [package.name for package in install_location.packages])
+            for install_location in group.install_locations
+        ]
+        for group in plan_queries(layers, install_locations)
+    ]
+
+
+def test_empty() -> None:
+    assert plan('FROM alpine:3.20\n') == []
+
+
+def test_merge_install_commands() -> None:
+    groups = plan("""\
+        FROM alpine:3.20
+        ARG VERSION=1
+        RUN apk add git=2.43.0 && apk add --no-cache nginx=1.26.2
+        ENV PATH=/usr/local/bin:$PATH
+        RUN apk add git=2.43.0 ripgrep=14.1.1
+        """)
+    assert groups == [[(2, ['git']), (2, ['nginx']), (4, ['git', 'ripgrep'])]]
+
+
+def test_package_names() -> None:
+    layers = parse_containerfile_contents('FROM alpine:3.20\nRUN apk add git nginx\nRUN apk add ripgrep git\n')
+    install_locations = read_packages(layers, [PackageManagerApk()], Path('Containerfile'))
+    (group,) = plan_queries(layers, install_locations)
+    assert group.package_names == ['git', 'nginx', 'ripgrep']
+
+
+def test_split_on_stage() -> None:
+    groups = plan("""\
+        FROM alpine:3.20
+        RUN apk add git=2.43.0
+        FROM alpine:3.20
+        RUN apk add nginx=1.26.2
+        """)
+    assert groups == [[(1, ['git'])], [(3, ['nginx'])]]
+
+
+def test_split_on_unknown_instruction() -> None:
+    groups = plan("""\
+        FROM alpine:3.20
+        RUN apk add git=2.43.0
+        COPY repositories /etc/apk/repositories
+        RUN apk add nginx=1.26.2
+        """)
+    assert groups == [[(1, ['git'])], [(3, ['nginx'])]]
+
+
+def test_split_on_other_commands() -> None:
+    groups = plan("""\
+        FROM alpine:3.20
+        RUN apk add git=2.43.0
+        RUN apk add nginx=1.26.2 && echo https://example.com >> /etc/apk/repositories && apk add ripgrep=14.1.1
+        RUN apk add astyle=3.6.3
+        """)
+    assert groups == [[(1, ['git'])], [(2, ['nginx'])], [(2, ['ripgrep'])], [(3, ['astyle'])]]
+
+
+def test_split_on_forwarded_arguments() -> None:
+    groups = plan("""\
+        FROM alpine:3.20
+        RUN apk add git=2.43.0
+        RUN apk add --repository=https://example.com nginx=1.26.2
+        RUN apk add ripgrep=14.1.1
+        """)
+    assert groups == [[(1, ['git']), (3, ['ripgrep'])], [(2, ['nginx'])]]
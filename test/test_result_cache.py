@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+
+from result_cache import ResultCache
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    import pytest
+
+
+def test_miss(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path, 60)
+    assert cache.get(ResultCache.create_key('sha256:1', 'query')) is None
+
+
+def test_hit(tmp_path: Path) -> None:
+    cache = ResultCache(tmp_path, 60)
+    key = ResultCache.create_key('sha256:1', 'query')
+    cache.put(key, ['git-2.45.2-r0 x86_64 {git} (GPL-2.0-only)'])
+    assert cache.get(key) == ['git-2.45.2-r0 x86_64 {git} (GPL-2.0-only)']
+    assert cache.get(ResultCache.create_key('sha256:2', 'query')) is None
+    assert cache.get(ResultCache.create_key('sha256:1', 'other query')) is None
+
+
+def test_shared_between_instances(tmp_path: Path) -> None:
+    key = ResultCache.create_key('sha256:1', 'query')
+    ResultCache(tmp_path, 60).put(key, ['a'])
+    ResultCache(tmp_path, 60).put(key, ['b'])
+    assert ResultCache(tmp_path, 60).get(key) == ['b']
+
+
+def test_expired(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = ResultCache(tmp_path, 60)
+    key = ResultCache.create_key('sha256:1', 'query')
+    cache.put(key, ['a'])
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert cache.get(key) is None
+
+
+def test_refresh(tmp_path: Path) -> None:
+    key = ResultCache.create_key('sha256:1', 'query')
+    cache = ResultCache(tmp_path, 60, refresh=True)
+    cache.put(key, ['a'])
+    assert cache.get(key) is None
+    assert ResultCache(tmp_path, 60).get(key) == ['a']
@@ -24,6 +24,18 @@ def test_no_file_path_argument() -> None:
     assert stdout.getvalue() == ''
     assert (
         stderr.getvalue() == 'usage: Containerfile version checker [-h] [-c CONTAINER_MANAGER]\n'
+        '                                     [--api-socket API_SOCKET] [-j JOBS]\n'
+        '                                     [--pull-jobs PULL_JOBS]\n'
+        '                                     [--query-mode {run,exec,export}]\n'
+        '                                     [--build-context BUILD_CONTEXT]\n'
+        '                                     [--cache-mounts] [--cache-dir CACHE_DIR]\n'
+        '                                     [--cache-ttl CACHE_TTL] [--no-cache]\n'
+        '                                     [--refresh] [--max-images MAX_IMAGES]\n'
+        '                                     [--max-images-size MAX_IMAGES_SIZE]\n'
+        '                                     [--trace FILE] [--metrics FILE]\n'
+        '                                     [--since REVISION]\n'
+        '                                     [--apk-index-dir APK_INDEX_DIR]\n'
+        '                                     [--apk-index-arch APK_INDEX_ARCH]\n'
         '                                     file_paths [file_paths ...]\n'
         'Containerfile version checker: error: the following arguments are required: file_paths\n'
     )
@@ -39,7 +51,9 @@ def test_non_buildable_containerfile() -> None:
         '/bin/sh: hfdjsk: not found\n'
         'Error: building at STEP "RUN hfdjsk": while running runtime: exit status 127\n'
         '\n'
-        "Command '\\['podman', 'build', '-f', '/tmp/unold_.*?/unold_.*?', '-t', 'unold_.*?', '-q']' "
+        "Command '\\['podman', 'build', '-f', '/tmp/unold_.*?/unold_.*?', '-t', 'unold_.*?', "
+        "(?:'--label', '.*?', )*'-q', "
+        "'/tmp/unold_.*?/unold_.*?_context']' "
         'returned non-zero exit status 127.\n',
         stderr.getvalue(),
     )
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import TYPE_CHECKING
+
+import pytest
+
+from trace_events import Tracer, span, tag
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+@pytest.mark.asyncio
+async def test_spans(tmp_path: Path) -> None:
+    tracer = Tracer()
+
+    async def query(line: int) -> None:
+        tag(tracer, line=line)
+        with span(tracer, 'outer', image='unold_a'):
+            await asyncio.sleep(0.01)
+            with span(tracer, 'inner'):
+                await asyncio.sleep(0)
+
+    tag(tracer, file='Containerfile')
+    with span(tracer, 'parse'):
+        pass
+    await asyncio.gather(query(2), query(4))
+    tracer.write(tmp_path / 'trace.json')
+
+    events = json.loads((tmp_path / 'trace.json').read_text(encoding='utf-8'))['traceEvents']
+    assert [(event['name'], event['tid'], event['args']) for event in events] == [
+        ('parse', 0, {'file': 'Containerfile'}),
+        ('inner', 1, {'file': 'Containerfile', 'line': 2}),
+        ('outer', 1, {'file': 'Containerfile', 'line': 2, 'image': 'unold_a'}),
+        ('inner', 2, {'file': 'Containerfile', 'line': 4}),
+        ('outer', 2, {'file': 'Containerfile', 'line': 4, 'image': 'unold_a'}),
+    ]
+    assert all(event['ph'] == 'X' for event in events)
+    # Concurrent spans overlap, but are on separate tracks
+    assert events[1]['ts'] < events[3]['ts'] + events[3]['dur']
+    assert events[2]['dur'] >= 10000
+
+
+def test_disabled() -> None:
+    tag(None, file='Containerfile')
+    with span(None, 'parse'):
+        pass
@@ -1,60 +1,71 @@
-from version import Version, VersionComparison
+from version import Version, VersionComparison, compare_all, select_newest
+
+
+def _version(*numbers: int, package_name: str = '') -> Version:
+    return Version('.'.join(map(str, numbers)), package_name, (*((1, number) for number in numbers), (0, 0)))
 
 
 def test_compare_equal() -> None:
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.EQUAL
-    assert Version('', '', 4, 3, 2, None).compare(Version('', '', 4, 3, 2, None)) == VersionComparison.EQUAL
-    assert Version('', '', 4, 3, None, None).compare(Version('', '', 4, 3, None, None)) == VersionComparison.EQUAL
-    assert Version('', '', 4, None, None, None).compare(Version('', '', 4, None, None, None)) == VersionComparison.EQUAL
+    assert _version(4, 3, 2, 1).compare(_version(4, 3, 2, 1)) == VersionComparison.EQUAL
+    assert _version(4, 3, 2).compare(_version(4, 3, 2)) == VersionComparison.EQUAL
+    assert _version(4, 3).compare(_version(4, 3)) == VersionComparison.EQUAL
+    assert _version(4).compare(_version(4)) == VersionComparison.EQUAL
 
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 3, 2, None)) == VersionComparison.EQUAL
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 3, None, None)) == VersionComparison.EQUAL
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, None, None, None)) == VersionComparison.EQUAL
+    assert _version(4, 3, 2, 1).compare(_version(4, 3, 2)) == VersionComparison.EQUAL
+    assert _version(4, 3, 2, 1).compare(_version(4, 3)) == VersionComparison.EQUAL
+    assert _version(4, 3, 2, 1).compare(_version(4)) == VersionComparison.EQUAL
 
-    assert Version('', '', 4, 3, 2, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.EQUAL
-    assert Version('', '', 4, 3, None, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.EQUAL
-    assert Version('', '', 4, None, None, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.EQUAL
+    assert _version(4, 3, 2).compare(_version(4, 3, 2, 1)) == VersionComparison.EQUAL
+    assert _version(4, 3).compare(_version(4, 3, 2, 1)) == VersionComparison.EQUAL
+    assert _version(4).compare(_version(4, 3, 2, 1)) == VersionComparison.EQUAL
 
 
 def test_compare_smaller() -> None:
-    assert Version('', '', 4, 3, 2, 0).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
-    assert Version('', '', 4, 3, 1, 2).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
-    assert Version('', '', 4, 2, 3, 1).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
-    assert Version('', '', 3, 4, 2, 1).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(4, 3, 2, 0).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(4, 3, 1, 2).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(4, 2, 3, 1).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(3, 4, 2, 1).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
 
-    assert Version('', '', 4, 3, 1, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
-    assert Version('', '', 4, 2, None, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
-    assert (
-        Version('', '', 3, None, None, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
-    )
+    assert _version(4, 3, 1).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(4, 2).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(3).compare(_version(4, 3, 2, 1)) == VersionComparison.LESS_THAN_OTHER
 
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 3, 3, None)) == VersionComparison.LESS_THAN_OTHER
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 4, None, None)) == VersionComparison.LESS_THAN_OTHER
-    assert (
-        Version('', '', 4, 3, 2, 1).compare(Version('', '', 5, None, None, None)) == VersionComparison.LESS_THAN_OTHER
-    )
+    assert _version(4, 3, 2, 1).compare(_version(4, 3, 3)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(4, 3, 2, 1).compare(_version(4, 4)) == VersionComparison.LESS_THAN_OTHER
+    assert _version(4, 3, 2, 1).compare(_version(5)) == VersionComparison.LESS_THAN_OTHER
 
 
 def test_compare_greater() -> None:
-    assert Version('', '', 4, 3, 2, 2).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
-    assert Version('', '', 4, 3, 3, 0).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
-    assert Version('', '', 4, 4, 1, 1).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
-    assert Version('', '', 5, 2, 2, 1).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
-
-    assert Version('', '', 4, 3, 3, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
-    assert (
-        Version('', '', 4, 4, None, None).compare(Version('', '', 4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
-    )
-    assert (
-        Version('', '', 5, None, None, None).compare(Version('', '', 4, 3, 2, 1))
-        == VersionComparison.GREATER_THAN_OTHER
-    )
-
-    assert Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 3, 1, None)) == VersionComparison.GREATER_THAN_OTHER
-    assert (
-        Version('', '', 4, 3, 2, 1).compare(Version('', '', 4, 2, None, None)) == VersionComparison.GREATER_THAN_OTHER
-    )
-    assert (
-        Version('', '', 4, 3, 2, 1).compare(Version('', '', 3, None, None, None))
-        == VersionComparison.GREATER_THAN_OTHER
-    )
+    assert _version(4, 3, 2, 2).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(4, 3, 3, 0).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(4, 4, 1, 1).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(5, 2, 2, 1).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+
+    assert _version(4, 3, 3).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(4, 4).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(5).compare(_version(4, 3, 2, 1)) == VersionComparison.GREATER_THAN_OTHER
+
+    assert _version(4, 3, 2, 1).compare(_version(4, 3, 1)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(4, 3, 2, 1).compare(_version(4, 2)) == VersionComparison.GREATER_THAN_OTHER
+    assert _version(4, 3, 2, 1).compare(_version(3)) == VersionComparison.GREATER_THAN_OTHER
+
+
+def test_compare_uncomparable() -> None:
+    assert _version().compare(_version(4, 3)) == VersionComparison.UNCOMPARABLE
+
+
+def test_compare_all() -> None:
+    assert compare_all([(_version(4, 3), _version(4, 3, 1)), (_version(4, 3), _version(4, 4))]) == [
+        VersionComparison.EQUAL,
+        VersionComparison.LESS_THAN_OTHER,
+    ]
+
+
+def test_select_newest() -> None:
+    versions = [
+        _version(4, 3, package_name='git'),
+        _version(4, 3, 1, package_name='git'),
+        _version(4, 2, 9, package_name='git'),
+        _version(1, package_name='nginx'),
+    ]
+    assert select_newest(versions) == {'git': versions[1], 'nginx': versions[3]}
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Benchmark unold on generated containerfiles with a fake container manager, and record the results per commit"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+TOP_DIR = Path(__file__).resolve().parent.parent
+FAKE_CONTAINER_MANAGER = TOP_DIR / 'tools' / 'fake_container_manager.py'
+
+
+def main() -> int:
+    args = _parse_arguments()
+    params = {
+        'files': args.files,
+        'install_locations': args.install_locations,
+        'packages': args.packages,
+        'unique_images': args.unique_images,
+        'build_latency': args.build_latency,
+        'run_latency': args.run_latency,
+        'failure_rate': args.failure_rate,
+        'jobs': args.jobs,
+        'query_mode': args.query_mode,
+    }
+
+    with tempfile.TemporaryDirectory(prefix='unold_benchmark_') as dir_tmp_str:
+        dir_tmp = Path(dir_tmp_str)
+        file_paths = generate_files(
+            dir_tmp / 'containerfiles',
+            args.files,
+            args.install_locations,
+            args.packages,
+            unique_images=args.unique_images,
+        )
+        durations = []
+        for _ in range(args.repeat):
+            duration, exit_code = _run_unold(file_paths, dir_tmp / 'cache', args)
+            durations.append(duration)
+            print(f'{duration:.3f} s, exit code {exit_code}', file=sys.stderr)
+
+    result = {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'time': int(time.time()),
+        'python': platform.python_version(),
+        'params': params,
+        'durations': durations,
+        'median': statistics.median(durations),
+        # Of unold, the fake container manager is much smaller
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+    if args.results is not None:
+        _compare(result, args.results)
+        with args.results.open('a', encoding='utf-8') as file:
+            file.write(json.dumps(result) + '\n')
+    print(json.dumps(result))
+    return 0
+
+
+def generate_files(
+    dir_path: Path, file_count: int, install_location_count: int, package_count: int, *, unique_images: bool
+) -> list[Path]:
+    """Generate containerfiles with every install location in a stage of its own
+
+    Without unique images, all install locations are based on the same image, and thus share one query image.
+    """
+    dir_path.mkdir(parents=True)
+    file_paths = []
+    for file_index in range(file_count):
+        file_path = dir_path / f'{file_index}.Containerfile'
+        file_path.write_text(
+            generate_containerfile_contents(
+                file_index, install_location_count, package_count, unique_images=unique_images
+            ),
+            encoding='utf-8',
+        )
+        file_paths.append(file_path)
+    return file_paths
+
+
+def generate_containerfile_contents(
+    file_index: int, install_location_count: int, package_count: int, *, unique_images: bool
+) -> str:
+    lines = ['ARG ALPINE_VERSION=3.20']
+    for install_location_index in range(install_location_count):
+        lines.append('FROM alpine:${ALPINE_VERSION}')
+        if unique_images:
+            lines.append(f'RUN echo {file_index}_{install_location_index} > /id')
+        # Every other package is outdated
+        packages = [
+            f'package{file_index}x{install_location_index}x{package_index}==1.0.0-r{package_index % 2}'
+            for package_index in range(package_count)
+        ]
+        lines.append('RUN apk add --no-cache \\')
+        lines.extend(f'    {package} \\' for package in packages[:-1])
+        lines.append(f'    {packages[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _run_unold(file_paths: Sequence[Path], cache_dir: Path, args: argparse.Namespace) -> tuple[float, int]:
+    env = {
+        **os.environ,
+        'UNOLD_FAKE_BUILD_LATENCY': str(args.build_latency),
+        'UNOLD_FAKE_RUN_LATENCY': str(args.run_latency),
+        'UNOLD_FAKE_FAILURE_RATE': str(args.failure_rate),
+    }
+    command = [
+        sys.executable,
+        str(TOP_DIR / 'src' / 'unold.py'),
+        '-c',
+        str(FAKE_CONTAINER_MANAGER),
+        '-j',
+        str(args.jobs),
+        '--query-mode',
+        args.query_mode,
+        '--no-cache',
+        '--cache-dir',
+        str(cache_dir),
+        *map(str, file_paths),
+    ]
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    duration = time.perf_counter() - start
+    # Outdated packages make unold exit with 1, but anything else means that the benchmark is broken
+    if completed.returncode not in {0, 1}:
+        sys.stderr.buffer.write(completed.stderr)
+        raise subprocess.CalledProcessError(completed.returncode, command)
+    return duration, completed.returncode
+
+
+def _compare(result: dict[str, object], results_path: Path) -> None:
+    """Print the earlier results with the same parameters"""
+    if not results_path.exists():
+        return
+    for line in results_path.read_text(encoding='utf-8').splitlines():
+        earlier = json.loads(line)
+        if earlier['params'] == result['params']:
+            dirty = ' (dirty)' if earlier['dirty'] else ''
+            print(f'{earlier["commit"][:10]}{dirty}: {earlier["median"]:.3f} s', file=sys.stderr)
+
+
+def _git(*args: str) -> str:
+    return subprocess.check_output(['git', *args], cwd=TOP_DIR, text=True).strip()
+
+
+def _parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=1000, help='Number of containerfiles. Defaults to %(default)s.')
+    parser.add_argument(
+        '--install-locations',
+        type=int,
+        default=10,
+        help='Number of install locations per containerfile. Defaults to %(default)s.',
+    )
+    parser.add_argument(
+        '--packages', type=int, default=3, help='Number of packages per install location. Defaults to %(default)s.'
+    )
+    parser.add_argument(
+        '--unique-images',
+        action='store_true',
+        help='Give every install location a query image of its own, instead of sharing one',
+    )
+    parser.add_argument('--build-latency', type=float, default=0.0, help='Seconds that a build takes')
+    parser.add_argument('--run-latency', type=float, default=0.0, help='Seconds that starting a container takes')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of builds and runs that fail')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Passed on to unold')
+    parser.add_argument('--query-mode', choices=['run', 'exec', 'export'], default='run', help='Passed on to unold')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs. Defaults to %(default)s.')
+    parser.add_argument(
+        '--results',
+        type=Path,
+        default=TOP_DIR / 'benchmark_results.jsonl',
+        help='File to append the result to, after showing the earlier results with the same parameters. '
+        'Defaults to %(default)s.',
+    )
+    parser.add_argument('--no-results', dest='results', action='store_const', const=None, help="Don't record results")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Compare the apk argument scanner with the argparse based parser it replaced, for results and speed"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import timeit
+from contextlib import redirect_stderr
+from io import StringIO
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from benchmark import generate_containerfile_contents
+
+TOP_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(TOP_DIR / 'src'))
+
+from package_manager import split_command, split_shell_words  # noqa: E402
+from package_manager_apk import PackageManagerApk  # noqa: E402
+from unold import parse_containerfile_contents  # noqa: E402
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from package import Package
+
+# Commands of the unit tests, besides those of the containerfiles
+COMMANDS = [
+    'apk update',
+    'ls apk add git',
+    'add apk git',
+    'apk add git<2.43.0 git=2.43.0 git==2.43.0 git>2.43.0 git~2.43.0 git~=2.43.0 git=~2.43.0',
+    'PATH=/usr/local/bin sudo apk -q -i add --initdb -t nginx=1.26.2 git=2.43.0',
+    'apk add --no-cache -Xhttps://example.com git',
+    'apk add --no-cache --virtual .build-deps gcc musl-dev',
+    'apk -U --no-cache add --arch=x86_64 git',
+]
+
+Result = tuple[list[tuple[str, str, str | None]], list[str]]
+
+
+def main() -> int:
+    args = _parse_arguments()
+    corpus = _load_corpus(args.files)
+    package_manager = PackageManagerApk()
+
+    mismatches = 0
+    for sub_command in corpus:
+        expected = _summarize(*_parse_with_argparse(sub_command))
+        actual = _summarize(*package_manager._parse_install_package_subcommand(sub_command))  # noqa: SLF001
+        if actual != expected:
+            mismatches += 1
+            print(f'Mismatch for {sub_command}: {actual} instead of {expected}', file=sys.stderr)
+
+    time_argparse = min(timeit.repeat(lambda: [_parse_with_argparse(c) for c in corpus], number=1, repeat=args.repeat))
+    time_scanner = min(
+        timeit.repeat(
+            lambda: [package_manager._parse_install_package_subcommand(c) for c in corpus],  # noqa: SLF001
+            number=1,
+            repeat=args.repeat,
+        )
+    )
+    print(f'{len(corpus)} apk subcommands, {mismatches} mismatches')
+    print(f'argparse: {time_argparse * 1000:.1f} ms')
+    print(f'scanner:  {time_scanner * 1000:.1f} ms ({time_argparse / time_scanner:.0f}x)')
+    return 1 if mismatches else 0
+
+
+def _load_corpus(generated_file_count: int) -> list[Sequence[str]]:
+    """Get the subcommands of the RUN instructions of the test containerfiles and of generated ones"""
+    contents = [path.read_text(encoding='utf-8') for path in sorted((TOP_DIR / 'test' / 'containerfiles').iterdir())]
+    contents.extend(
+        generate_containerfile_contents(file_index, 10, 3, unique_images=True)
+        for file_index in range(generated_file_count)
+    )
+    commands = [
+        layer.value[0]
+        for contents_file in contents
+        for layer in parse_containerfile_contents(contents_file)
+        if layer.cmd.casefold() == 'run'
+    ]
+    return [
+        sub_command
+        for command in [*commands, *COMMANDS]
+        for sub_command, _ in split_command(split_shell_words(command))
+    ]
+
+
+def _summarize(packages: Sequence[Package], forwarded_args: Sequence[str]) -> Result:
+    return [(package.name, package.conditional.name, package.version_str) for package in packages], list(forwarded_args)
+
+
+def _parse_with_argparse(command: Sequence[str]) -> tuple[list[Package], list[str]]:  # noqa: C901
+    """The parser before the scanner, with an ArgumentParser per call"""
+    for apk_idx, sub_command in enumerate(command):  # noqa: B007
+        if sub_command == 'sudo' or re.match('[A-Za-z_][A-Za-z0-9_]*=', sub_command):
+            continue
+        if sub_command == 'apk':
+            break
+        return [], []
+    else:
+        return [], []
+
+    apk_args = command[apk_idx + 1 :]
+
+    parser = argparse.ArgumentParser()
+    parser_parent = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    parser_add = subparsers.add_parser('add', parents=[parser_parent], add_help=False)
+    for arg in [
+        '--arch',
+        '--cache-dir',
+        '--cache-max-age',
+        '--keys-dir',
+        '--progress-fd',
+        '--repositories-file',
+        '--repository',
+        '--root',
+        '--timeout',
+        '--wait',
+        '-p',
+        '-X',
+    ]:
+        parser_parent.add_argument(arg)
+    for arg in ['-t', '--virtual']:
+        parser_add.add_argument(arg)
+
+    try:
+        with redirect_stderr(StringIO()):
+            args_parent_known, _ = parser_parent.parse_known_args(apk_args)
+            args_known, args_unknown = parser.parse_known_args(apk_args)
+    except SystemExit:
+        return [], []
+
+    if args_known.command != 'add':
+        return [], []
+
+    forwarded_args = []
+    if args_parent_known.arch:
+        forwarded_args.extend(['--arch', args_parent_known.arch])
+    if args_parent_known.repository:
+        forwarded_args.extend(['--repository', args_parent_known.repository])
+    if args_parent_known.X:
+        forwarded_args.extend(['-X', args_parent_known.X])
+
+    return [
+        PackageManagerApk._create_package(arg)  # noqa: SLF001
+        for arg in args_unknown
+        if not arg.startswith('-')
+    ], forwarded_args
+
+
+def _parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--files', type=int, default=1000, help='Number of generated containerfiles. Defaults to %(default)s.'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs. Defaults to %(default)s.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Stand-in for the docker/podman command line interface, to benchmark unold without a container manager
+
+Builds only sleep. Commands of containers run on the host, with an 'apk' that lists canned versions. Configure it with
+environment variables:
+
+- UNOLD_FAKE_BUILD_LATENCY: seconds that a build takes, defaults to 0
+- UNOLD_FAKE_RUN_LATENCY: seconds that starting a container takes, defaults to 0
+- UNOLD_FAKE_FAILURE_RATE: fraction of builds and container runs that fail, defaults to 0
+- UNOLD_FAKE_SEED: which builds and runs fail is random, but the same for the same seed and arguments
+- UNOLD_FAKE_VERSION: version that 'apk list' lists for every package, defaults to 1.0.0-r1
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+# The file to which the export query mode of unold writes the output of a version query
+QUERY_OUTPUT_FILE_NAME = 'unold_versions'
+
+
+def main(args: Sequence[str]) -> int:  # noqa: PLR0911
+    # The fake is also the 'apk' of the commands that containers run
+    if Path(sys.argv[0]).name == 'apk':
+        return _apk(args)
+
+    match list(args):
+        case ['build', *build_args]:
+            return _build(build_args)
+        case ['run', '-d', *_]:
+            print(_hash(args))
+            return 0
+        case ['run', *run_args]:
+            return _run(args, run_args[-1])
+        case ['exec', _, 'sh', '-c', command]:
+            return _run(args, command)
+        case ['image', 'inspect', '--format', _, image]:
+            print(f'sha256:{_hash([image])}')
+            return 0
+        case ['image', 'inspect', *_]:
+            # Query images of earlier runs aren't kept
+            print('[]')
+            return 0
+        case ['images' | 'ps', *_] | ['rm' | 'pull', *_] | ['image', 'rm', *_]:
+            return 0
+    print(f'Error: unknown command {list(args)}', file=sys.stderr)
+    return 125
+
+
+def _build(args: Sequence[str]) -> int:
+    _sleep('UNOLD_FAKE_BUILD_LATENCY')
+    # The containerfile is in a temporary directory of its own, so decide by its contents
+    containerfile = Path(args[args.index('-f') + 1]).read_text(encoding='utf-8')
+    if _fails([containerfile]):
+        print('Error: building at STEP "RUN apk update -q": simulated failure', file=sys.stderr)
+        return 1
+
+    output = next((arg.partition('dest=')[2] for arg in args if arg.startswith('type=local,')), None)
+    if output is not None:
+        # Run the query of the export containerfile, whose output is the only file that is exported
+        command = next(line for line in containerfile.splitlines() if f'> /{QUERY_OUTPUT_FILE_NAME}' in line)
+        command = command.removeprefix('RUN ').partition(' >')[0]
+        Path(output).mkdir(parents=True, exist_ok=True)
+        (Path(output) / QUERY_OUTPUT_FILE_NAME).write_text(_shell(command).stdout, encoding='utf-8')
+    else:
+        print(f'sha256:{_hash([containerfile])}')
+    return 0
+
+
+def _run(args: Sequence[str], command: str) -> int:
+    _sleep('UNOLD_FAKE_RUN_LATENCY')
+    if _fails(args):
+        print('Error: simulated failure', file=sys.stderr)
+        return 126
+    completed = _shell(command)
+    sys.stdout.write(completed.stdout)
+    return completed.returncode
+
+
+def _apk(args: Sequence[str]) -> int:
+    if args and args[0] == 'list':
+        version = os.environ.get('UNOLD_FAKE_VERSION', '1.0.0-r1')
+        for package_name in (arg for arg in args[1:] if not arg.startswith('-')):
+            print(f'{package_name}-{version} x86_64 {{{package_name}}} (MIT)')
+    return 0
+
+
+def _shell(command: str) -> subprocess.CompletedProcess[str]:
+    bin_dir = Path(tempfile.gettempdir()) / f'unold_fake_container_manager_{os.getuid()}'
+    bin_dir.mkdir(exist_ok=True)
+    with contextlib.suppress(FileExistsError):
+        (bin_dir / 'apk').symlink_to(Path(__file__).resolve())
+    env = {**os.environ, 'PATH': f'{bin_dir}{os.pathsep}{os.environ.get("PATH", "")}'}
+    return subprocess.run(['sh', '-c', command], env=env, stdout=subprocess.PIPE, text=True, check=False)
+
+
+def _sleep(variable: str) -> None:
+    time.sleep(float(os.environ.get(variable, '0')))
+
+
+def _fails(args: Sequence[str]) -> bool:
+    failure_rate = float(os.environ.get('UNOLD_FAKE_FAILURE_RATE', '0'))
+    return random.Random(f'{os.environ.get("UNOLD_FAKE_SEED", "")}\0{_hash(args)}').random() < failure_rate
+
+
+def _hash(args: Sequence[str]) -> str:
+    return hashlib.sha256('\0'.join(args).encode()).hexdigest()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))